@@ -0,0 +1,319 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+from chip8 import (
+    DEFAULT_QUIRKS, INSTRUCTIONS_CHIP8, INSTRUCTIONS_XOCHIP, MEMORY_SIZE, NNN_OPCODES, QUIRK_PROFILES,
+    START_ADDRESS, XKK_OPCODES, XO_MEMORY_SIZE, Chip8, decode_entry, get_decode_table
+)
+
+# Bump when the analysis changes, cached analyses of older versions are ignored
+ANALYSIS_VERSION = 2
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "p-chip8", "analysis")
+
+# Kinds of control flow edge
+EDGE_FALL = "fall"
+EDGE_JUMP = "jump"
+EDGE_CALL = "call"
+EDGE_SKIP = "skip"
+
+SKIP_HANDLERS = (Chip8.OP_3xkk, Chip8.OP_4xkk, Chip8.OP_5xy0, Chip8.OP_9xy0, Chip8.OP_Ex9E, Chip8.OP_ExA1)
+# XO-CHIP skips, which step over F000 NNNN as a whole
+LONG_SKIP_HANDLERS = (Chip8.OP_3xkk_long, Chip8.OP_4xkk_long, Chip8.OP_5xy0_long, Chip8.OP_9xy0_long,
+                      Chip8.OP_Ex9E_long, Chip8.OP_ExA1_long)
+
+
+# Memory of the machines a quirk profile runs on, XO-CHIP machines have 64 KB
+def memory_size(quirks=DEFAULT_QUIRKS):
+    instructions = QUIRK_PROFILES[quirks].get("instructions", INSTRUCTIONS_CHIP8)
+    return XO_MEMORY_SIZE if instructions == INSTRUCTIONS_XOCHIP else MEMORY_SIZE
+
+
+# Memory of a machine of the profile with the rom loaded
+def load_memory(rom, quirks=DEFAULT_QUIRKS):
+    memory = bytearray(memory_size(quirks))
+    if START_ADDRESS + len(rom) > len(memory):
+        raise ValueError(f"ROM is too large: {len(rom)} bytes")
+    memory[START_ADDRESS:START_ADDRESS + len(rom)] = rom
+    return memory
+
+
+# Formats the operands of an instruction the way the listing shows them
+def format_operands(opcode, operands):
+    first_nibble = opcode >> 12
+    if not operands:
+        return ""
+    if first_nibble in NNN_OPCODES:
+        return f"{operands[0]:#05x}"
+    if first_nibble in XKK_OPCODES:
+        return f"V{operands[0]:X}, {operands[1]:#04x}"
+    if len(operands) == 3:
+        return f"V{operands[0]:X}, V{operands[1]:X}, {operands[2]}"
+    return ", ".join(f"V{register:X}" for register in operands)
+
+
+# Returns [(edge kind, target)] for the instruction at address, and whether
+# control can leave it through an address that is only known at runtime
+def successors(address, opcode, handler, operands, memory):
+    next_address = address + 2
+    if handler is Chip8.OP_1NNN:
+        return [(EDGE_JUMP, operands[0])], False
+    if handler is Chip8.OP_2NNN:
+        # Subroutines are assumed to return to the instruction after the call
+        return [(EDGE_CALL, operands[0]), (EDGE_FALL, next_address)], False
+    if handler is Chip8.OP_00EE:
+        return [], False
+    if handler is Chip8.OP_00FD:
+        return [], False
+    if handler is Chip8.OP_Bnnn or handler is Chip8.OP_Bxnn:
+        return [], True
+    if handler in SKIP_HANDLERS:
+        return [(EDGE_FALL, next_address), (EDGE_SKIP, next_address + 2)], False
+    if handler in LONG_SKIP_HANDLERS:
+        long = next_address + 1 < len(memory) and read_opcode(memory, next_address) == 0xF000
+        return [(EDGE_FALL, next_address), (EDGE_SKIP, next_address + (4 if long else 2))], False
+    if handler is Chip8.OP_F000:
+        # The address is the next word
+        return [(EDGE_FALL, address + 4)], False
+    return [(EDGE_FALL, next_address)], False
+
+
+# A straight run of instructions, control only enters at start and leaves after end
+class BasicBlock():
+    def __init__(self, start, end, edges):
+        self.start = start
+        # Address after the last instruction
+        self.end = end
+        self.edges = edges
+
+    def to_dict(self):
+        return {"start": self.start, "end": self.end, "edges": [list(edge) for edge in self.edges]}
+
+
+# What a rom looks like statically: which bytes are reachable code, how the
+# code is split into basic blocks and how they connect
+class RomAnalysis():
+    def __init__(self, rom_hash, size, code, blocks, subroutines, indirect_jumps, idle_addresses):
+        self.rom_hash = rom_hash
+        self.size = size
+        # Addresses of every reachable instruction, in order
+        self.code = code
+        # BasicBlocks by start address
+        self.blocks = blocks
+        self.subroutines = subroutines
+        # Bnnn instructions, control flow past them is unknown
+        self.indirect_jumps = indirect_jumps
+        # Addresses of instructions in key waits, jumps to themselves and
+        # delay timer polling loops
+        self.idle_addresses = idle_addresses
+        self.code_set = set(code)
+
+    # True if the byte at address belongs to a reachable instruction
+    def is_code(self, address):
+        return address in self.code_set or (address - 1) in self.code_set
+
+    # Rom addresses that no reachable instruction covers, sprites and other data
+    def data_addresses(self):
+        return [address for address in range(START_ADDRESS, START_ADDRESS + self.size)
+                if not self.is_code(address)]
+
+    # Block start addresses, where translated blocks are worth building up front
+    def block_starts(self):
+        return sorted(self.blocks)
+
+    def to_dict(self):
+        return {
+            "version": ANALYSIS_VERSION,
+            "rom_hash": self.rom_hash,
+            "size": self.size,
+            "code": self.code,
+            "blocks": [self.blocks[start].to_dict() for start in sorted(self.blocks)],
+            "subroutines": self.subroutines,
+            "indirect_jumps": self.indirect_jumps,
+            "idle_addresses": self.idle_addresses,
+        }
+
+    @classmethod
+    def from_dict(cls, entry):
+        blocks = {}
+        for block in entry["blocks"]:
+            blocks[block["start"]] = BasicBlock(block["start"], block["end"],
+                                                [tuple(edge) for edge in block["edges"]])
+        return cls(entry["rom_hash"], entry["size"], entry["code"], blocks, entry["subroutines"],
+                   entry["indirect_jumps"], entry["idle_addresses"])
+
+
+def read_opcode(memory, address):
+    return (memory[address] << 8) | memory[address + 1]
+
+
+# Walks the rom from START_ADDRESS, following jumps, calls, returns and skips
+# as a machine with the quirk profile would run it
+def analyze(rom, quirks=DEFAULT_QUIRKS):
+    memory = load_memory(rom, quirks)
+    decode_table = get_decode_table(quirks)
+
+    instructions = {}
+    leaders = {START_ADDRESS}
+    subroutines = set()
+    indirect_jumps = []
+    pending = [START_ADDRESS]
+    while pending:
+        address = pending.pop()
+        if address in instructions or address + 1 >= len(memory):
+            continue
+        opcode = read_opcode(memory, address)
+        handler, operands = decode_entry(decode_table, opcode)
+        edges, indirect = successors(address, opcode, handler, operands, memory)
+        edges = [(kind, target) for kind, target in edges if target + 1 < len(memory)]
+        instructions[address] = edges
+        if indirect:
+            indirect_jumps.append(address)
+        for kind, target in edges:
+            if kind == EDGE_CALL:
+                subroutines.add(target)
+            if kind != EDGE_FALL or len(edges) > 1 or indirect:
+                leaders.add(target)
+            pending.append(target)
+        if len(edges) != 1 or edges[0] != (EDGE_FALL, address + 2):
+            # Anything after a control transfer starts a new block
+            leaders.add(address + 2)
+
+    blocks = {}
+    for start in sorted(leaders):
+        if start not in instructions:
+            continue
+        address = start
+        while True:
+            edges = instructions[address]
+            next_address = address + 2
+            falls_through = len(edges) == 1 and edges[0] == (EDGE_FALL, next_address)
+            if not falls_through or next_address in leaders or next_address not in instructions:
+                blocks[start] = BasicBlock(start, next_address, edges)
+                break
+            address = next_address
+
+    return RomAnalysis(
+        hashlib.sha1(bytes(rom)).hexdigest(), len(rom), sorted(instructions), blocks,
+        sorted(subroutines), sorted(indirect_jumps), find_idle_addresses(memory, instructions),
+    )
+
+
+# Instructions where scheduler.idle_state can find a busy wait
+def find_idle_addresses(memory, instructions):
+    idle = set()
+    for address in instructions:
+        opcode = read_opcode(memory, address)
+        if opcode == 0x1000 | address or (opcode & 0xF0FF) == 0xF00A:
+            idle.add(address)
+        elif (opcode & 0xF0FF) == 0xF007 and address + 5 < len(memory):
+            x = (opcode >> 8) & 0xF
+            if (read_opcode(memory, address + 2) == (0x3000 | (x << 8))
+                    and read_opcode(memory, address + 4) == (0x1000 | address)):
+                idle.update((address, address + 2, address + 4))
+    return sorted(idle)
+
+
+# Returns the analysis of rom, reading it from cache_dir if it was analyzed before
+# Pass cache_dir=None to skip the disk cache
+def load_analysis(rom, cache_dir=DEFAULT_CACHE_DIR, quirks=DEFAULT_QUIRKS):
+    rom = bytes(rom)
+    if cache_dir is None:
+        return analyze(rom, quirks)
+    path = os.path.join(cache_dir, f"{hashlib.sha1(rom).hexdigest()}.{quirks}.json")
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+        if entry.get("version") == ANALYSIS_VERSION:
+            return RomAnalysis.from_dict(entry)
+    except (OSError, ValueError, KeyError):
+        pass
+    analysis = analyze(rom, quirks)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written to a temporary name first so readers never see half a file
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(analysis.to_dict(), f)
+        os.replace(temporary, path)
+    except OSError:
+        # Caching is only an optimization, a read-only disk is fine
+        pass
+    return analysis
+
+
+# Disassembly of the rom, reachable instructions with their OP_* handler names
+# and everything else as data bytes
+def listing(rom, analysis, quirks=DEFAULT_QUIRKS):
+    memory = load_memory(rom, quirks)
+    decode_table = get_decode_table(quirks)
+    jump_targets = set()
+    for block in analysis.blocks.values():
+        for kind, target in block.edges:
+            if kind == EDGE_JUMP:
+                jump_targets.add(target)
+    subroutines = set(analysis.subroutines)
+
+    lines = []
+    address = START_ADDRESS
+    end = START_ADDRESS + len(rom)
+    while address < end:
+        if address in subroutines:
+            lines.append(f"sub_{address:03X}:")
+        elif address in jump_targets:
+            lines.append(f"loc_{address:03X}:")
+        if address in analysis.code_set:
+            opcode = read_opcode(memory, address)
+            handler, operands = decode_entry(decode_table, opcode)
+            lines.append(f"  {address:03X}  {opcode:04X}  {handler.__name__:<8} {format_operands(opcode, operands)}".rstrip())
+            address += 2
+            continue
+        # Data runs up to the next instruction, eight bytes per line
+        data = []
+        while address < end and address not in analysis.code_set and len(data) < 8:
+            data.append(memory[address])
+            address += 1
+            if address in subroutines or address in jump_targets:
+                break
+        start = address - len(data)
+        lines.append(f"  {start:03X}  {' '.join(f'{byte:02X}' for byte in data):<23}  ; data")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the code, data and control flow of a CHIP-8 rom")
+    parser.add_argument("rom", help="path to the rom file")
+    parser.add_argument("--listing", action="store_true", help="print a disassembly")
+    parser.add_argument("--json", action="store_true", help="print the analysis as JSON")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_DIR, help="directory of cached analyses")
+    parser.add_argument("--no-cache", action="store_true", help="always analyze from scratch")
+    parser.add_argument("--quirks", default=DEFAULT_QUIRKS, choices=sorted(QUIRK_PROFILES),
+                        help="quirk profile the rom is written for")
+    args = parser.parse_args(argv)
+
+    with open(args.rom, "rb") as f:
+        rom = f.read()
+    analysis = load_analysis(rom, None if args.no_cache else args.cache, args.quirks)
+
+    if args.json:
+        json.dump(analysis.to_dict(), sys.stdout)
+        sys.stdout.write("\n")
+        return 0
+    if args.listing:
+        print("\n".join(listing(rom, analysis, args.quirks)))
+        return 0
+    print(f"rom: {analysis.size} bytes, sha1 {analysis.rom_hash}")
+    print(f"code: {len(analysis.code)} instructions in {len(analysis.blocks)} blocks, "
+          f"{len(analysis.subroutines)} subroutines")
+    print(f"data: {len(analysis.data_addresses())} bytes not reached as code")
+    if analysis.indirect_jumps:
+        print("indirect jumps (not followed): " + " ".join(f"{address:#05x}" for address in analysis.indirect_jumps))
+    if analysis.idle_addresses:
+        print("busy waits: " + " ".join(f"{address:#05x}" for address in analysis.idle_addresses))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
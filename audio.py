@@ -0,0 +1,261 @@
+import collections
+import math
+import threading
+import time
+import wave
+from array import array
+
+from chip8 import INSTRUCTIONS_XOCHIP
+
+SAMPLE_RATE = 44100
+# Samples written to the sink at a time, about 5.8 ms, a change of the sound is
+# heard at most one block after it happened
+BLOCK_SIZE = 256
+BLOCK_TIME = BLOCK_SIZE / SAMPLE_RATE
+# The beep, a square wave
+TONE_HZ = 440
+AMPLITUDE = 6000
+# XO-CHIP patterns are 128 one bit samples played at 4000 Hz at pitch 64,
+# each step of pitch is 1/48 of an octave
+PATTERN_BITS = 128
+PATTERN_HZ = 4000
+# Pattern buffers kept, by pattern and pitch
+MAX_PATTERN_BUFFERS = 64
+# The sound of a machine that is not playing an XO-CHIP pattern
+SOUND_BEEP = "beep"
+# Commands not picked up by the audio thread yet before the oldest are dropped,
+# the emulator never waits on audio
+MAX_COMMANDS = 64
+
+
+# One second of the beep, exactly TONE_HZ periods, so it loops without a click
+def tone_buffer(hz=TONE_HZ, amplitude=AMPLITUDE):
+    half_periods = 2 * hz
+    samples = array("h", (amplitude if (i * half_periods // SAMPLE_RATE) % 2 == 0 else -amplitude
+                          for i in range(SAMPLE_RATE)))
+    return samples.tobytes()
+
+
+# An XO-CHIP pattern played at a pitch, as enough whole loops of the pattern to
+# cover a few blocks
+def pattern_buffer(pattern, pitch, amplitude=AMPLITUDE):
+    rate = PATTERN_HZ * 2 ** ((pitch - 64) / 48)
+    loop_samples = PATTERN_BITS * SAMPLE_RATE / rate
+    loops = max(1, math.ceil(4 * BLOCK_SIZE / loop_samples))
+    length = max(1, round(loops * loop_samples))
+    bits = int.from_bytes(pattern, "big")
+    step = rate / SAMPLE_RATE
+    samples = array("h", (amplitude if bits >> (PATTERN_BITS - 1 - int(i * step) % PATTERN_BITS) & 1 else -amplitude
+                          for i in range(length)))
+    return samples.tobytes()
+
+
+# Takes blocks of 16 bit mono samples and keeps the audio thread to real time
+# Sinks that do not block on a device sleep until the block would have finished
+# playing, or return straight away when realtime is False
+class PacedSink():
+    def __init__(self, realtime=True):
+        self.realtime = realtime
+        self.deadline = None
+        self.samples = 0
+
+    def write(self, data):
+        self.samples += len(data) // 2
+        if not self.realtime:
+            return
+        now = time.perf_counter()
+        if self.deadline is None or self.deadline < now:
+            # Started, or fell behind, play on from now
+            self.deadline = now
+        self.deadline += len(data) / 2 / SAMPLE_RATE
+        time.sleep(max(0.0, self.deadline - now))
+
+    # Seconds of audio handed over but not heard yet when write returns
+    def delay(self):
+        return 0.0
+
+    def close(self):
+        pass
+
+
+# Throws the samples away, for headless machines and measuring latency
+class NullSink(PacedSink):
+    pass
+
+
+# Writes the samples to a WAV file
+class WaveSink(PacedSink):
+    def __init__(self, path, realtime=True):
+        super().__init__(realtime)
+        self.file = wave.open(path, "wb")
+        self.file.setnchannels(1)
+        self.file.setsampwidth(2)
+        self.file.setframerate(SAMPLE_RATE)
+
+    def write(self, data):
+        self.file.writeframes(data)
+        super().write(data)
+
+    def close(self):
+        self.file.close()
+
+
+# Plays the blocks through pygame.mixer, one playing and one queued on a channel
+class PygameSink():
+    def __init__(self):
+        import pygame
+        self.pygame = pygame
+        # pygame.init may have opened the mixer with other settings, and the device
+        # must not change them, the raw blocks are played as they are
+        pygame.mixer.quit()
+        pygame.mixer.init(SAMPLE_RATE, -16, 1, BLOCK_SIZE, allowedchanges=0)
+        self.channels = pygame.mixer.get_init()[2]
+        self.channel = None
+
+    def write(self, data):
+        if self.channels == 2:
+            mono = array("h", data)
+            stereo = array("h", bytes(len(data) * 2))
+            stereo[0::2] = mono
+            stereo[1::2] = mono
+            data = stereo.tobytes()
+        sound = self.pygame.mixer.Sound(buffer=data)
+        if self.channel is None or not self.channel.get_busy():
+            self.channel = sound.play()
+            return
+        # The queue holds one sound, wait for the playing block to finish
+        while self.channel.get_queue() is not None:
+            time.sleep(BLOCK_TIME / 4)
+        self.channel.queue(sound)
+
+    # The block queued behind the one playing, and the mixer's own buffer
+    def delay(self):
+        return 2 * BLOCK_TIME
+
+    def close(self):
+        self.pygame.mixer.quit()
+
+
+# Sinks by name, see create_sink
+SINKS = {
+    "null": NullSink,
+    "wave": WaveSink,
+    "pygame": PygameSink,
+}
+
+
+def create_sink(name, path=None):
+    if name not in SINKS:
+        raise ValueError(f"Unknown audio sink: {name}")
+    if name == "wave":
+        if path is None:
+            raise ValueError("The wave sink needs a file to write")
+        return WaveSink(path)
+    return SINKS[name]()
+
+
+# Plays the sound of a machine on a thread of its own
+# Set as chip8.audio, the machine calls update whenever the sound timer, the
+# audio pattern or the pitch is set, and update only queues a command when what
+# should be heard actually changed
+# Commands go to the audio thread through a deque, whose append and popleft are
+# atomic, so neither side ever takes a lock or waits for the other
+# The audio thread loops the precomputed buffer of the current sound (or
+# silence) into the sink one block at a time and picks up commands between blocks
+class AudioEngine():
+    def __init__(self, sink, block_size=BLOCK_SIZE):
+        self.sink = sink
+        self.block_size = block_size
+        self.tone = tone_buffer()
+        self.silence = bytes(2 * block_size)
+        self.patterns = {}
+        # (time queued, sound) where sound is None for silence, SOUND_BEEP, or
+        # (pattern, pitch) of an XO-CHIP pattern
+        self.commands = collections.deque(maxlen=MAX_COMMANDS)
+        # What the machine last asked for, kept on the emulator's side
+        self.playing = None
+        # Seconds from a command being queued to its first block reaching the sink,
+        # plus the sink's own delay
+        self.latencies = collections.deque(maxlen=1000)
+        self.blocks = 0
+        self.running = True
+        self.error = None
+        self.thread = threading.Thread(target=self.play_loop, name="audio", daemon=True)
+        self.thread.start()
+
+    def update(self, chip8):
+        sound = None
+        if chip8.sound_timer > 0:
+            sound = SOUND_BEEP
+            # A pattern that was never loaded plays the beep
+            if chip8.instructions == INSTRUCTIONS_XOCHIP and any(chip8.audio_pattern):
+                sound = (bytes(chip8.audio_pattern), chip8.pitch)
+        if sound == self.playing:
+            return
+        self.playing = sound
+        self.commands.append((time.perf_counter(), sound))
+
+    # Returns the buffer looped for a sound
+    def buffer(self, sound):
+        if sound is None:
+            return None
+        if sound == SOUND_BEEP:
+            return self.tone
+        buffer = self.patterns.get(sound)
+        if buffer is None:
+            if len(self.patterns) >= MAX_PATTERN_BUFFERS:
+                self.patterns.clear()
+            buffer = self.patterns[sound] = pattern_buffer(*sound)
+        return buffer
+
+    def play_loop(self):
+        commands = self.commands
+        block_bytes = 2 * self.block_size
+        source = None
+        offset = 0
+        try:
+            while self.running:
+                queued = None
+                while commands:
+                    queued, sound = commands.popleft()
+                    source = self.buffer(sound)
+                    offset = 0
+                if source is None:
+                    data = self.silence
+                else:
+                    # Loop the buffer, wrapping around its end as often as needed
+                    parts = []
+                    needed = block_bytes
+                    while needed:
+                        part = source[offset:offset + needed]
+                        parts.append(part)
+                        needed -= len(part)
+                        offset = (offset + len(part)) % len(source)
+                    data = b"".join(parts)
+                if queued is not None:
+                    self.latencies.append(time.perf_counter() - queued + self.sink.delay())
+                self.sink.write(data)
+                self.blocks += 1
+        except Exception as error:
+            # Audio stops, the emulator runs on
+            self.error = error
+            self.running = False
+
+    # Latency of starting and stopping the sound, in milliseconds
+    def stats(self):
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {"changes": 0, "blocks": self.blocks}
+        return {
+            "changes": len(latencies),
+            "blocks": self.blocks,
+            "mean_ms": 1000 * sum(latencies) / len(latencies),
+            "p50_ms": 1000 * latencies[len(latencies) // 2],
+            "p95_ms": 1000 * latencies[min(len(latencies) - 1, len(latencies) * 95 // 100)],
+            "max_ms": 1000 * latencies[-1],
+        }
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sink.close()
@@ -0,0 +1,361 @@
+from array import array
+
+import numpy as np
+
+from chip8 import (
+    DEFAULT_QUIRKS, DISPLAY_HEIGHT, DISPLAY_WIDTH, FONTSET_SIZE, FONTSET_START_ADDRESS,
+    MEMORY_SIZE, START_ADDRESS, Chip8, fontset
+)
+
+STACK_SIZE = 16
+
+
+# Runs many CHIP-8 machines in lockstep, with all of their state held in NumPy arrays
+# Every step executes one instruction on every running machine, machines are grouped
+# by opcode and each group is executed with array operations, following the same
+# semantics as the OP_* handlers of Chip8
+# Machines that would raise an IndexError in Chip8 (memory or keypad accessed out of
+# range) are marked as faulted and halted instead of stopping the whole batch
+# Cxkk draws from a NumPy generator, so random values differ from Chip8.random_Generator
+class BatchChip8():
+    def __init__(self, count, seed=None):
+        self.count = count
+        self.registers = np.zeros((count, 16), dtype=np.uint8)
+        self.memory = np.zeros((count, MEMORY_SIZE), dtype=np.uint8)
+        self.index = np.zeros(count, dtype=np.int64)
+        self.pc = np.full(count, START_ADDRESS, dtype=np.int64)
+        self.stack = np.zeros((count, STACK_SIZE), dtype=np.int64)
+        self.stack_pointer = np.zeros(count, dtype=np.int64)
+        self.delay_timer = np.zeros(count, dtype=np.int64)
+        self.sound_timer = np.zeros(count, dtype=np.int64)
+        self.keypad = np.zeros((count, 16), dtype=np.uint8)
+        self.display = np.zeros((count, DISPLAY_HEIGHT), dtype=np.uint64)
+        self.opcode = np.zeros(count, dtype=np.int64)
+        self.halted = np.zeros(count, dtype=bool)
+        self.faulted = np.zeros(count, dtype=bool)
+        self.draw_flag = np.zeros(count, dtype=bool)
+        self.rng = np.random.default_rng(seed)
+
+    def load_fontset(self):
+        self.memory[:, FONTSET_START_ADDRESS:FONTSET_START_ADDRESS + FONTSET_SIZE] = fontset
+
+    # Loads the same rom into every machine, or only into the machines given
+    def load_rom(self, rom_path, machines=None):
+        with open(rom_path, 'rb') as f:
+            self.load_bytes(f.read(), machines)
+
+    def load_bytes(self, rom, machines=None):
+        if START_ADDRESS + len(rom) > MEMORY_SIZE:
+            raise ValueError(f"ROM is too large: {len(rom)} bytes")
+        data = np.frombuffer(bytes(rom), dtype=np.uint8)
+        target = slice(None) if machines is None else machines
+        self.memory[target, START_ADDRESS:START_ADDRESS + len(rom)] = data
+
+    # Decrements the delay and sound timers of every machine, called at 60 Hz
+    def update_timers(self):
+        self.delay_timer -= self.delay_timer > 0
+        self.sound_timer -= self.sound_timer > 0
+
+    # Halts the given machines because they did something Chip8 raises an error for
+    def fault(self, machines):
+        self.faulted[machines] = True
+        self.halted[machines] = True
+
+    # Executes one instruction on every machine that is not halted
+    # Returns the number of machines that executed an instruction
+    def step(self):
+        running = np.flatnonzero(~self.halted)
+        # Fetching past the end of memory raises in Chip8
+        out_of_range = self.pc[running] + 1 >= MEMORY_SIZE
+        if out_of_range.any():
+            self.fault(running[out_of_range])
+            running = running[~out_of_range]
+        if running.size == 0:
+            return 0
+
+        pc = self.pc[running]
+        opcode = (self.memory[running, pc].astype(np.int64) << 8) | self.memory[running, pc + 1]
+        self.opcode[running] = opcode
+        self.pc[running] = pc + 2
+
+        first_nibble = opcode >> 12
+        for nibble, execute in self.groups:
+            selected = first_nibble == nibble
+            if selected.any():
+                op = opcode[selected]
+                execute(self, running[selected], op, (op >> 8) & 0xF, (op >> 4) & 0xF)
+        return running.size
+
+    # Runs up to the given number of steps, stopping early once every machine halted
+    # Returns the number of instructions executed over all machines
+    def run(self, cycles):
+        executed = 0
+        for _ in range(cycles):
+            count = self.step()
+            if count == 0:
+                break
+            executed += count
+        return executed
+
+    # Returns Vx of each machine
+    def vx(self, m, x):
+        return self.registers[m, x].astype(np.int64)
+
+    # Skips the next instruction on the machines where condition holds
+    def skip(self, m, condition):
+        self.pc[m[condition]] += 2
+
+    def group0(self, m, op, x, y):
+        low = op & 0xFF
+        # CLS
+        cls = m[low == 0xE0]
+        if cls.size:
+            changed = self.display[cls].any(axis=1)
+            self.display[cls] = 0
+            self.draw_flag[cls[changed]] = True
+        # RET
+        ret = m[low == 0xEE]
+        if ret.size:
+            underflow = self.stack_pointer[ret] <= 0
+            bad = ret[underflow]
+            self.pc[bad] = 0
+            self.halted[bad] = True
+            good = ret[~underflow]
+            self.stack_pointer[good] -= 1
+            self.pc[good] = self.stack[good, self.stack_pointer[good]]
+
+    def group1(self, m, op, x, y):
+        self.pc[m] = op & 0xFFF
+
+    def group2(self, m, op, x, y):
+        overflow = self.stack_pointer[m] >= STACK_SIZE
+        bad = m[overflow]
+        self.pc[bad] = 0
+        self.halted[bad] = True
+        good = m[~overflow]
+        nnn = (op & 0xFFF)[~overflow]
+        self.stack[good, self.stack_pointer[good]] = self.pc[good]
+        self.stack_pointer[good] += 1
+        self.pc[good] = nnn
+
+    def group3(self, m, op, x, y):
+        self.skip(m, self.vx(m, x) == (op & 0xFF))
+
+    def group4(self, m, op, x, y):
+        self.skip(m, self.vx(m, x) != (op & 0xFF))
+
+    def group5(self, m, op, x, y):
+        self.skip(m, self.vx(m, x) == self.vx(m, y))
+
+    def group6(self, m, op, x, y):
+        self.registers[m, x] = op & 0xFF
+
+    def group7(self, m, op, x, y):
+        self.registers[m, x] = (self.vx(m, x) + (op & 0xFF)) & 0xFF
+
+    def group8(self, m, op, x, y):
+        n = op & 0xF
+        R = self.registers
+        for sub in (0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0xE):
+            selected = n == sub
+            if not selected.any():
+                continue
+            s = m[selected]
+            sx = x[selected]
+            sy = y[selected]
+            vx = self.vx(s, sx)
+            vy = self.vx(s, sy)
+            if sub == 0x0:
+                R[s, sx] = vy
+            elif sub == 0x1:
+                R[s, sx] = vx | vy
+            elif sub == 0x2:
+                R[s, sx] = vx & vy
+            elif sub == 0x3:
+                R[s, sx] = vx ^ vy
+            elif sub == 0x4:
+                total = vx + vy
+                R[s, 0xF] = total > 255
+                R[s, sx] = total & 0xFF
+            # The remaining handlers set VF first and then read Vx and Vy again,
+            # which matters when x or y is F
+            elif sub == 0x5:
+                R[s, 0xF] = vx > vy
+                R[s, sx] = (self.vx(s, sx) - self.vx(s, sy)) & 0xFF
+            elif sub == 0x6:
+                R[s, 0xF] = vx & 0x1
+                R[s, sx] = self.vx(s, sx) >> 1
+            elif sub == 0x7:
+                R[s, 0xF] = vy > vx
+                R[s, sx] = (self.vx(s, sy) - self.vx(s, sx)) & 0xFF
+            else:
+                R[s, 0xF] = (vx >> 7) & 0x1
+                R[s, sx] = (self.vx(s, sx) << 1) & 0xFF
+
+    def group9(self, m, op, x, y):
+        self.skip(m, self.vx(m, x) != self.vx(m, y))
+
+    def groupA(self, m, op, x, y):
+        self.index[m] = op & 0xFFF
+
+    def groupB(self, m, op, x, y):
+        self.pc[m] = (op & 0xFFF) + self.registers[m, 0]
+
+    def groupC(self, m, op, x, y):
+        random_bytes = self.rng.integers(0, 256, size=m.size)
+        self.registers[m, x] = random_bytes & (op & 0xFF)
+
+    def groupD(self, m, op, x, y):
+        n = op & 0xF
+        # Sprite rows read past the end of memory raise in Chip8
+        bad = self.index[m] + np.maximum(n - 1, 0) >= MEMORY_SIZE
+        bad &= n > 0
+        if bad.any():
+            self.fault(m[bad])
+            keep = ~bad
+            m, x, y, n = m[keep], x[keep], y[keep], n[keep]
+            if m.size == 0:
+                return
+
+        x_pos = self.vx(m, x) % DISPLAY_WIDTH
+        y_pos = self.vx(m, y) % DISPLAY_HEIGHT
+        shift = DISPLAY_WIDTH - 8 - x_pos
+        left = np.maximum(shift, 0).astype(np.uint64)
+        right = np.maximum(-shift, 0).astype(np.uint64)
+        wrap = ((DISPLAY_WIDTH - right) % DISPLAY_WIDTH).astype(np.uint64)
+        index = self.index[m]
+
+        collision = np.zeros(m.size, dtype=bool)
+        changed = np.zeros(m.size, dtype=bool)
+        for row in range(int(n.max())):
+            active = (row < n).nonzero()[0]
+            if active.size == 0:
+                break
+            s = m[active]
+            sprite_row = self.memory[s, index[active] + row].astype(np.uint64)
+            bits = np.where(
+                shift[active] >= 0,
+                sprite_row << left[active],
+                (sprite_row >> right[active]) | (sprite_row << wrap[active]),
+            )
+            display_row = (y_pos[active] + row) % DISPLAY_HEIGHT
+            current = self.display[s, display_row]
+            collision[active] |= (current & bits) != 0
+            changed[active] |= bits != 0
+            self.display[s, display_row] = current ^ bits
+
+        self.registers[m, 0xF] = collision
+        self.draw_flag[m[changed]] = True
+
+    def groupE(self, m, op, x, y):
+        low = op & 0xFF
+        for sub, pressed in ((0x9E, 1), (0xA1, 0)):
+            selected = low == sub
+            if not selected.any():
+                continue
+            s = m[selected]
+            key = self.vx(s, x[selected])
+            # Keys past F raise in Chip8
+            bad = key >= 16
+            if bad.any():
+                self.fault(s[bad])
+                s = s[~bad]
+                key = key[~bad]
+            self.skip(s, self.keypad[s, key] == pressed)
+
+    def groupF(self, m, op, x, y):
+        low = op & 0xFF
+        R = self.registers
+        for sub in (0x07, 0x0A, 0x15, 0x18, 0x1E, 0x29, 0x33, 0x55, 0x65):
+            selected = low == sub
+            if not selected.any():
+                continue
+            s = m[selected]
+            sx = x[selected]
+            if sub == 0x07:
+                R[s, sx] = self.delay_timer[s]
+            elif sub == 0x0A:
+                keys = self.keypad[s] != 0
+                pressed = keys.any(axis=1)
+                R[s[pressed], sx[pressed]] = keys[pressed].argmax(axis=1)
+                self.pc[s[~pressed]] -= 2
+            elif sub == 0x15:
+                self.delay_timer[s] = R[s, sx]
+            elif sub == 0x18:
+                self.sound_timer[s] = R[s, sx]
+            elif sub == 0x1E:
+                self.index[s] += R[s, sx]
+            elif sub == 0x29:
+                self.index[s] = FONTSET_START_ADDRESS + self.vx(s, sx) * 5
+            else:
+                length = 3 if sub == 0x33 else sx + 1
+                bad = self.index[s] + length > MEMORY_SIZE
+                if bad.any():
+                    self.fault(s[bad])
+                    s = s[~bad]
+                    sx = sx[~bad]
+                    if sub != 0x33:
+                        length = length[~bad]
+                if s.size == 0:
+                    continue
+                index = self.index[s]
+                if sub == 0x33:
+                    value = self.vx(s, sx)
+                    self.memory[s, index] = value // 100
+                    self.memory[s, index + 1] = (value // 10) % 10
+                    self.memory[s, index + 2] = value % 10
+                else:
+                    for i in range(16):
+                        active = i <= sx
+                        if not active.any():
+                            break
+                        a = s[active]
+                        if sub == 0x55:
+                            self.memory[a, index[active] + i] = R[a, i]
+                        else:
+                            R[a, i] = self.memory[a, index[active] + i]
+
+    # Handlers for each first nibble, run in this order every step
+    groups = (
+        (0x0, group0), (0x1, group1), (0x2, group2), (0x3, group3),
+        (0x4, group4), (0x5, group5), (0x6, group6), (0x7, group7),
+        (0x8, group8), (0x9, group9), (0xA, groupA), (0xB, groupB),
+        (0xC, groupC), (0xD, groupD), (0xE, groupE), (0xF, groupF),
+    )
+
+    # Copies the state of one machine into a new Chip8 instance
+    def to_chip8(self, machine):
+        chip8 = Chip8()
+        chip8.registers[:] = self.registers[machine].tobytes()
+        chip8.memory[:] = self.memory[machine].tobytes()
+        chip8.index = int(self.index[machine])
+        chip8.pc = int(self.pc[machine])
+        chip8.stack[:] = array('H', [int(v) for v in self.stack[machine]])
+        chip8.stack_pointer = int(self.stack_pointer[machine])
+        chip8.delay_timer = int(self.delay_timer[machine])
+        chip8.sound_timer = int(self.sound_timer[machine])
+        chip8.keypad[:] = self.keypad[machine].tobytes()
+        chip8.display[:] = [int(row) for row in self.display[machine]]
+        chip8.opcode = int(self.opcode[machine])
+        chip8.halted = bool(self.halted[machine])
+        return chip8
+
+    # Copies the state of a Chip8 instance into one machine
+    # Batches only run the default quirks, which use the original instruction set,
+    # any other profile would silently run with different semantics
+    def from_chip8(self, machine, chip8):
+        if chip8.quirks != DEFAULT_QUIRKS:
+            raise ValueError(f"Batches only run the {DEFAULT_QUIRKS} quirk profile, not {chip8.quirks}")
+        self.registers[machine] = np.frombuffer(bytes(chip8.registers), dtype=np.uint8)
+        self.memory[machine] = np.frombuffer(bytes(chip8.memory), dtype=np.uint8)
+        self.index[machine] = chip8.index
+        self.pc[machine] = chip8.pc
+        self.stack[machine] = list(chip8.stack)
+        self.stack_pointer[machine] = chip8.stack_pointer
+        self.delay_timer[machine] = chip8.delay_timer
+        self.sound_timer[machine] = chip8.sound_timer
+        self.keypad[machine] = np.frombuffer(bytes(chip8.keypad), dtype=np.uint8)
+        self.display[machine] = np.array(chip8.display, dtype=np.uint64)
+        self.opcode[machine] = chip8.opcode
+        self.halted[machine] = chip8.halted
+        self.faulted[machine] = False
@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio import AudioEngine, NullSink
+from chip8 import Chip8
+from scheduler import DEFAULT_CPU_HZ, FRAME_TIME, Scheduler
+
+# Beeps for 5 frames, then waits 20 frames on the delay timer, forever
+BEEP_ROM = [
+    0x6005,  # LD V0, 5
+    0xF018,  # LD ST, V0
+    0x6114,  # LD V1, 20
+    0xF115,  # LD DT, V1
+    0xF107,  # LD V1, DT
+    0x3100,  # SE V1, 0
+    0x1208,  # JP 0x208
+    0x1200,  # JP 0x200
+]
+
+
+# Plays the rom in real time with the sound going to a NullSink and returns the
+# engine's latency statistics
+def measure(frames, cpu_hz):
+    chip8 = Chip8(seed=0)
+    chip8.load_fontset()
+    chip8.load_bytes(b"".join(word.to_bytes(2, "big") for word in BEEP_ROM))
+    chip8.audio = AudioEngine(NullSink())
+    scheduler = Scheduler(chip8, cpu_hz)
+    try:
+        for _ in range(frames):
+            scheduler.run_frame()
+            scheduler.sync()
+    finally:
+        chip8.audio.close()
+    return chip8.audio.stats()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how long the sound takes to start and stop")
+    parser.add_argument("--frames", type=int, default=300, help="frames played in real time")
+    parser.add_argument("--hz", type=int, default=DEFAULT_CPU_HZ, help="instructions per second of emulated time")
+    args = parser.parse_args(argv)
+
+    stats = measure(args.frames, args.hz)
+    if not stats["changes"]:
+        print("the sound never changed")
+        return 1
+    print(f"{stats['changes']} starts and stops, {stats['blocks']} blocks")
+    for key in ("mean_ms", "p50_ms", "p95_ms", "max_ms"):
+        print(f"{key[:-3]:<6}{stats[key]:>8.2f} ms")
+    # Every change has to be heard within the frame it happened in
+    if stats["p95_ms"] > FRAME_TIME * 1000:
+        print(f"p95 latency is over one frame ({FRAME_TIME * 1000:.1f} ms)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,34 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch import BatchChip8
+from bench_decode import BENCH_ROMS, words_to_bytes
+
+
+# Aggregate instructions/sec of BatchChip8 for growing batch sizes
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how BatchChip8 scales with the number of machines")
+    parser.add_argument("-n", "--steps", type=int, default=200)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000])
+    args = parser.parse_args(argv)
+
+    print(f"{'rom':<8}{'machines':>10}{'instructions':>16}")
+    for name, words in BENCH_ROMS.items():
+        rom = words_to_bytes(words)
+        for size in args.sizes:
+            machines = BatchChip8(size, seed=0)
+            machines.load_fontset()
+            machines.load_bytes(rom)
+            start = time.perf_counter()
+            executed = machines.run(args.steps)
+            elapsed = time.perf_counter() - start
+            print(f"{name:<8}{size:>10}{executed / elapsed:>14.0f}/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import argparse
+import inspect
+import os
+import sys
+import textwrap
+import time
+from types import MethodType
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chip8.core as chip8_core
+from chip8 import Chip8, START_ADDRESS, TABLE, TABLE0, TABLE8, TABLEE, TABLEF
+
+# Small looping programs, each runs forever
+BENCH_ROMS = {
+    # 8xyN arithmetic in a tight loop
+    "alu": [
+        0x6001, 0x6103, 0x8014, 0x8115, 0x8016, 0x810E,
+        0x8017, 0x8102, 0x8013, 0x7105, 0x3000, 0x1204,
+    ],
+    # Draws and erases a font sprite
+    "draw": [
+        0x6000, 0x6100, 0x6205, 0xF229, 0xD015, 0xD015, 0x7001, 0x1208,
+    ],
+    # Calls a subroutine that stores and loads registers
+    "call": [
+        0xA300, 0x220A, 0x7001, 0x1202, 0x0000,
+        0xF233, 0xF255, 0xF265, 0x00EE,
+    ],
+}
+
+
+def words_to_bytes(words):
+    return b"".join(word.to_bytes(2, "big") for word in words)
+
+
+# Seeded so the states of the two dispatchers can be compared
+def create_machine(words, machine_class=Chip8):
+    chip8 = machine_class(0)
+    chip8.load_fontset()
+    rom = words_to_bytes(words)
+    chip8.memory[START_ADDRESS:START_ADDRESS + len(rom)] = list(rom)
+    return chip8
+
+
+# How the handlers pulled their operands out of self.opcode before the decode table
+OPERAND_SOURCE = {
+    "nnn": "nnn = self.opcode & 0x0FFF",
+    "x": "x = (self.opcode & 0x0F00) >> 8",
+    "y": "y = (self.opcode & 0x00F0) >> 4",
+    "kk": "kk = self.opcode & 0x00FF",
+    "n": "n = self.opcode & 0x000F",
+}
+
+
+# Recompiles a handler the way it was written before the decode table: called
+# with the opcode, it decodes its own operands and then runs the same body
+def legacy_handler(handler):
+    lines = textwrap.dedent(inspect.getsource(handler)).splitlines()
+    operands = list(inspect.signature(handler).parameters)[1:]
+    header = next(number for number, line in enumerate(lines) if line.startswith("def "))
+    source = "\n".join(
+        [f"def {handler.__name__}(self, *args):"]
+        + [f"    {OPERAND_SOURCE[name]}" for name in operands]
+        + lines[header + 1:]
+    )
+    namespace = dict(vars(chip8_core))
+    exec(source, namespace)
+    return namespace[handler.__name__]
+
+
+# Chip8 with the two-level dispatch it had before the decode table, a copy of
+# the old table/table0/table8/tableE/tableF dicts of bound methods
+class LegacyChip8(Chip8):
+    handlers = {
+        handler.__name__: legacy_handler(handler)
+        for table in (TABLE, TABLE0, TABLE8, TABLEE, TABLEF) for handler in table.values()
+    }
+
+    def __init__(self, seed=None):
+        super().__init__(seed)
+        bind = {name: MethodType(handler, self) for name, handler in self.handlers.items()}
+        self.table = {key: bind[handler.__name__] for key, handler in TABLE.items()}
+        self.table[0x0] = self.group0
+        self.table[0x8] = self.group8
+        self.table[0xE] = self.groupE
+        self.table[0xF] = self.groupF
+        self.table0 = {i: self.op_null for i in range(0x10)}
+        self.table8 = {i: self.op_null for i in range(0x10)}
+        self.tableE = {i: self.op_null for i in range(0x10)}
+        self.tableF = {i: self.op_null for i in range(0x100)}
+        for sub_table, handlers in ((self.table0, TABLE0), (self.table8, TABLE8),
+                                    (self.tableE, TABLEE), (self.tableF, TABLEF)):
+            for key, handler in handlers.items():
+                sub_table[key] = bind[handler.__name__]
+
+    def group0(self, opcode):
+        return self.table0.get(opcode & 0x00FF, self.op_null)
+
+    def group8(self, opcode):
+        return self.table8.get(opcode & 0x000F, self.op_null)
+
+    def groupE(self, opcode):
+        return self.tableE.get(opcode & 0x00FF, self.op_null)
+
+    def groupF(self, opcode):
+        return self.tableF.get(opcode & 0x00FF, self.op_null)
+
+
+# Fetch and dispatch the way Cycle did before the decode table
+# Timers are left out, they are ticked by the scheduler now
+def legacy_run(chip8, cycles):
+    for _ in range(cycles):
+        chip8.opcode = (chip8.memory[chip8.pc] << 8) | chip8.memory[chip8.pc + 1]
+        chip8.pc += 2
+        first_nibble = (chip8.opcode & 0xF000) >> 12
+        if first_nibble in chip8.table:
+            handler = chip8.table[first_nibble]
+            if callable(handler):
+                sub_handler = handler(chip8.opcode)
+                if callable(sub_handler):
+                    sub_handler(chip8.opcode)
+
+
+def time_run(run, cycles, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(cycles)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return cycles / best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare decode table dispatch with the old two-level dispatch")
+    parser.add_argument("-n", "--cycles", type=int, default=200000)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'rom':<8}{'legacy':>14}{'decode table':>16}{'speedup':>10}")
+    for name, words in BENCH_ROMS.items():
+        legacy_chip8 = create_machine(words, LegacyChip8)
+        legacy = time_run(lambda cycles: legacy_run(legacy_chip8, cycles), args.cycles, args.repeat)
+
+        chip8 = create_machine(words)
+        current = time_run(chip8.run, args.cycles, args.repeat)
+        # Both ran the same instructions, so they have to end up in the same state
+        if legacy_chip8.save_state() != chip8.save_state():
+            raise RuntimeError(f"{name}: legacy dispatch ended in a different state")
+
+        print(f"{name:<8}{legacy:>12.0f}/s{current:>14.0f}/s{current / legacy:>9.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
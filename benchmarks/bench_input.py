@@ -0,0 +1,119 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chip8 import Chip8
+from scheduler import DEFAULT_CPU_HZ, DEFAULT_INPUT_SLICES, FRAME_TIME, InputLatency, Scheduler
+
+# Waits for a key, shows it, then waits for the key to be let go, forever
+KEY_ROM = [
+    0xF00A,  # LD V0, K
+    0x00E0,  # CLS
+    0xF029,  # LD F, V0
+    0xD115,  # DRW V1, V1, 5
+    0xE0A1,  # SKNP V0
+    0x1208,  # JP 0x208
+    0x1200,  # JP 0x200
+]
+# Frames a synthetic key is held down for
+HOLD_FRAMES = 3
+
+
+# Stands in for a frontend, pressing keys at set times as if a player did
+# The press times are known exactly, so the real time to the frame showing
+# the key can be measured next to what InputLatency reports
+class SyntheticInput():
+    def __init__(self, presses):
+        self.presses = presses
+        self.next = 0
+        self.held = None
+        self.release_at = None
+        self.shown = []
+
+    def poll(self, chip8):
+        now = time.perf_counter()
+        if self.held is not None and now >= self.release_at:
+            chip8.keypad[self.held] = 0
+            self.held = None
+        if self.held is None and self.next < len(self.presses) and now >= self.presses[self.next][0]:
+            pressed_at, key = self.presses[self.next]
+            chip8.keypad[key] = 1
+            self.held = key
+            self.release_at = now + HOLD_FRAMES * FRAME_TIME
+            self.shown.append([pressed_at, None])
+            self.next += 1
+        return self.next < len(self.presses) or self.held is not None
+
+    def present(self, chip8):
+        chip8.dirty_rows = 0
+        now = time.perf_counter()
+        for press in self.shown:
+            if press[1] is None:
+                press[1] = now
+
+
+def percentiles(values):
+    values = sorted(values)
+    last = len(values) - 1
+    return {
+        "p50_ms": 1000 * values[last // 2],
+        "p95_ms": 1000 * values[min(last, len(values) * 95 // 100)],
+        "max_ms": 1000 * values[last],
+    }
+
+
+# Plays the rom in real time with presses at random moments, returns the real
+# latencies and the InputLatency statistics
+def measure(presses, slices, cpu_hz, seed):
+    rng = random.Random(seed)
+    start = time.perf_counter() + 0.1
+    times = []
+    at = start
+    for _ in range(presses):
+        # Leave the key wait time to come round again between presses
+        at += (HOLD_FRAMES + 2 + rng.random() * 4) * FRAME_TIME
+        times.append((at, rng.randrange(16)))
+    chip8 = Chip8(seed=0)
+    chip8.load_fontset()
+    chip8.load_bytes(b"".join(word.to_bytes(2, "big") for word in KEY_ROM))
+    synthetic = SyntheticInput(times)
+    latency = InputLatency()
+    scheduler = Scheduler(chip8, cpu_hz, synthetic.present, idle_skip=True,
+                          input=synthetic.poll, input_slices=slices, latency=latency)
+    scheduler.run()
+    real = [shown - pressed for pressed, shown in synthetic.shown if shown is not None]
+    return percentiles(real), latency.stats()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the time from a key press to the frame showing it")
+    parser.add_argument("--presses", type=int, default=60, help="key presses made in real time")
+    parser.add_argument("--slices", type=int, default=DEFAULT_INPUT_SLICES, help="input slices per frame")
+    parser.add_argument("--hz", type=int, default=DEFAULT_CPU_HZ, help="instructions per second of emulated time")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the press times")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for slices in sorted({1, args.slices}):
+        real, stats = measure(args.presses, slices, args.hz, args.seed)
+        results[slices] = real
+        print(f"{slices} input slice{'s' if slices > 1 else ''} per frame, "
+              f"{stats['answered']} of {stats['presses']} presses answered")
+        print(f"  {'real':<8}" + "".join(f"{key[:-3]:>5} {real[key]:6.2f} ms" for key in ("p50_ms", "p95_ms", "max_ms")))
+        for name in ("seen", "worst"):
+            if name in stats:
+                print(f"  {name:<8}" + "".join(f"{key[:-3]:>5} {stats[name][key]:6.2f} ms"
+                                               for key in ("p50_ms", "p95_ms", "max_ms")))
+    # A press has to be on screen within the frame it happened in
+    if results[args.slices]["p95_ms"] > FRAME_TIME * 1000:
+        print(f"p95 latency is over one frame ({FRAME_TIME * 1000:.1f} ms)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
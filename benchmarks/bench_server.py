@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_decode import BENCH_ROMS, words_to_bytes
+from chip8 import DISPLAY_HEIGHT
+from scheduler import DEFAULT_CPU_HZ
+from server import (DEFAULT_CPU_SHARE, DEFAULT_HOST, DEFAULT_PORT, MSG_ERROR, MSG_FRAME, MSG_OPENED, SessionServer,
+                    apply_frame, encode_keys, encode_open, read_message)
+
+
+# One client session: opens a machine, presses random keys and counts the frames it gets back
+class LoadClient():
+    def __init__(self, rom, cpu_hz, use_jit, key_rate, seed):
+        self.rom = rom
+        self.cpu_hz = cpu_hz
+        self.use_jit = use_jit
+        self.key_rate = key_rate
+        self.random = random.Random(seed)
+        self.display = [0] * DISPLAY_HEIGHT
+        self.frames = 0
+        self.bytes_received = 0
+        self.error = None
+
+    async def run(self, connect, duration):
+        reader, writer = await connect()
+        writer.write(encode_open(self.rom, self.cpu_hz, self.random.getrandbits(32), self.use_jit))
+        keys = asyncio.ensure_future(self.press_keys(writer))
+        end = time.perf_counter() + duration
+        try:
+            while True:
+                remaining = end - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    kind, payload = await asyncio.wait_for(read_message(reader), remaining)
+                except asyncio.TimeoutError:
+                    break
+                self.bytes_received += len(payload) + 3
+                if kind == MSG_FRAME:
+                    apply_frame(self.display, payload)
+                    self.frames += 1
+                elif kind == MSG_ERROR:
+                    self.error = payload.decode()
+                    break
+                elif kind != MSG_OPENED:
+                    self.error = f"unexpected message {kind}"
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self.error = f"{type(e).__name__}: {e}"
+        finally:
+            keys.cancel()
+            writer.close()
+
+    async def press_keys(self, writer):
+        while True:
+            await asyncio.sleep(self.random.expovariate(self.key_rate))
+            writer.write(encode_keys(1 << self.random.randrange(16)))
+            await asyncio.sleep(0.1)
+            writer.write(encode_keys(0))
+
+
+async def load_test(args):
+    server = None
+    if args.connect:
+        host, port = args.connect.rsplit(":", 1)
+
+        def connect():
+            return asyncio.open_connection(host, int(port))
+    elif args.unix:
+        def connect():
+            return asyncio.open_unix_connection(args.unix)
+    else:
+        # Run the server in this process, it then competes with the clients for the CPU
+        server = SessionServer(max_sessions=args.sessions, cpu_share=args.cpu_share)
+        serving = asyncio.ensure_future(server.serve(DEFAULT_HOST, args.port))
+        await asyncio.sleep(0.2)
+
+        def connect():
+            return asyncio.open_connection(DEFAULT_HOST, args.port)
+
+    rom = words_to_bytes(BENCH_ROMS[args.rom])
+    clients = [LoadClient(rom, args.hz, args.jit, args.key_rate, number) for number in range(args.sessions)]
+    start = time.perf_counter()
+    await asyncio.gather(*(client.run(connect, args.duration) for client in clients))
+    elapsed = time.perf_counter() - start
+
+    errors = [client.error for client in clients if client.error]
+    frames = sum(client.frames for client in clients)
+    received = sum(client.bytes_received for client in clients)
+    print(f"{args.sessions} sessions for {elapsed:.1f}s: {frames} frames received, "
+          f"{frames / elapsed / args.sessions:.1f} frames/s per session, {received / elapsed / 1024:.0f} KiB/s")
+    if server is not None:
+        stats = server.stats()
+        print(f"server: {stats['late_frames']} of {stats['frames']} ticks late, load {stats['load']:.0%}, "
+              f"{stats['memory'] / 1024:.0f} KiB in sessions")
+        serving.cancel()
+    if errors:
+        print(f"{len(errors)} sessions failed, first error: {errors[0]}")
+        return 1
+    return 0
+
+
+# Opens many sessions against a server (or one started in this process) and
+# reports how many frames each of them got
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the CHIP-8 session server")
+    parser.add_argument("-s", "--sessions", type=int, default=100)
+    parser.add_argument("-d", "--duration", type=float, default=5.0, help="seconds to run for")
+    parser.add_argument("--rom", choices=sorted(BENCH_ROMS), default="draw")
+    parser.add_argument("--hz", type=int, default=DEFAULT_CPU_HZ)
+    parser.add_argument("--jit", action="store_true")
+    parser.add_argument("--key-rate", type=float, default=1.0, help="key presses per second per session")
+    parser.add_argument("--cpu-share", type=float, default=DEFAULT_CPU_SHARE,
+                        help="cpu share of each session for an in-process server")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port of the in-process server")
+    parser.add_argument("--connect", metavar="HOST:PORT", help="use a running server over TCP")
+    parser.add_argument("--unix", metavar="PATH", help="use a running server over a Unix socket")
+    args = parser.parse_args(argv)
+    return asyncio.run(load_test(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Run in a fresh interpreter every time, so nothing is imported or decoded yet
+# Prints the milliseconds from the first import to the first executed instruction
+# and the heavy modules that were pulled in on the way
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from chip8 import Chip8
+imported = time.perf_counter()
+chip8 = Chip8(seed=0)
+chip8.load_fontset()
+chip8.load_bytes(bytes([0x60, 0x01, 0x12, 0x00]))
+chip8.Cycle()
+end = time.perf_counter()
+print(json.dumps({
+    "import": (imported - start) * 1000,
+    "first_instruction": (end - start) * 1000,
+    "heavy_modules": sorted(name for name in ("pygame", "numpy", "ctypes") if name in sys.modules),
+}))
+"""
+
+
+def run_child():
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT_DIR, capture_output=True, text=True, check=True)
+    result = json.loads(output.stdout)
+    result["process"] = (time.perf_counter() - start) * 1000
+    return result
+
+
+# Wall time of an interpreter that does nothing, the floor under every process above
+def run_empty():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the time from a cold start to the first executed instruction")
+    parser.add_argument("-r", "--repeat", type=int, default=20, help="fresh interpreters started")
+    args = parser.parse_args(argv)
+
+    # The first start writes the bytecode caches, it is not counted
+    run_child()
+    results = [run_child() for _ in range(args.repeat)]
+    empty = statistics.median(run_empty() for _ in range(args.repeat))
+
+    for key in ("import", "first_instruction", "process"):
+        values = [result[key] for result in results]
+        print(f"{key:<20}{statistics.median(values):>8.2f} ms median{min(values):>8.2f} ms best")
+    print(f"{'empty interpreter':<20}{empty:>8.2f} ms median")
+    heavy = results[0]["heavy_modules"]
+    print("heavy modules imported: " + (", ".join(heavy) if heavy else "none"))
+    return 1 if heavy else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from jit import BlockCache
+from chip8 import Chip8, START_ADDRESS, get_decode_table
+from scheduler import DEFAULT_CPU_HZ, Scheduler
+
+DEFAULT_HISTORY = os.path.join(BENCHMARK_DIR, "history.jsonl")
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+# Fail when instructions/sec drop more than this fraction below the baseline
+DEFAULT_THRESHOLD = 0.15
+WARM_UP_FRAMES = 60
+
+
+# Synthetic roms, each loops forever over one kind of instruction
+# All of them are generated from a seed, so every run measures the same program
+
+# 8xyN arithmetic between V0-VE
+def alu_rom(length=64, seed=0):
+    rng = random.Random(seed)
+    words = [0x6000 | (register << 8) | rng.randrange(256) for register in range(15)]
+    loop = START_ADDRESS + 2 * len(words)
+    for _ in range(length):
+        operation = rng.choice((0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0xE))
+        words.append(0x8000 | (rng.randrange(15) << 8) | (rng.randrange(15) << 4) | operation)
+    words.append(0x1000 | loop)
+    return words
+
+
+# Font sprites drawn at positions that move every pass
+def draw_rom(length=16, seed=0):
+    rng = random.Random(seed)
+    words = [0x6000, 0x6100]
+    loop = START_ADDRESS + 2 * len(words)
+    for _ in range(length):
+        words += [0x6200 | rng.randrange(16), 0xF229, 0xD015, 0x7000 | rng.randrange(1, 8)]
+    words += [0x7103, 0x1000 | loop]
+    return words
+
+
+# A chain of nested subroutines, each adding to a register before calling the next
+def call_rom(depth=12, seed=0):
+    rng = random.Random(seed)
+    # 2NNN then a jump back to it
+    first = START_ADDRESS + 4
+    words = [0x2000 | first, 0x1000 | START_ADDRESS]
+    for level in range(depth):
+        words.append(0x7000 | (rng.randrange(15) << 8) | 1)
+        if level < depth - 1:
+            words.append(0x2000 | (START_ADDRESS + 2 * len(words) + 4))
+        words.append(0x00EE)
+    return words
+
+
+# BCD conversions, stores and loads of all registers in a scratch area past the rom
+def memory_rom(length=16, seed=0):
+    rng = random.Random(seed)
+    words = []
+    for _ in range(length):
+        address = 0x800 + 16 * rng.randrange(64)
+        register = rng.randrange(15)
+        words += [0xA000 | address, 0xF033 | (register << 8), 0xFF55, 0xFF65, 0xF01E | (register << 8)]
+    words.append(0x1000 | START_ADDRESS)
+    return words
+
+
+SUITE_ROMS = {
+    "alu": alu_rom,
+    "draw": draw_rom,
+    "call": call_rom,
+    "memory": memory_rom,
+}
+
+
+def words_to_bytes(words):
+    return b"".join(word.to_bytes(2, "big") for word in words)
+
+
+def create_machine(rom):
+    chip8 = Chip8(seed=0)
+    chip8.load_fontset()
+    chip8.load_bytes(rom)
+    return chip8
+
+
+# Calls Cycle directly, the interpreter's hot path without the run loop around it
+def cycle_engine(chip8):
+    def run(cycles):
+        cycle = chip8.Cycle
+        for _ in range(cycles):
+            cycle()
+        return cycles
+    return run
+
+
+# Engines by name, each makes a run(cycles) callable for a machine
+ENGINES = {
+    "cycle": cycle_engine,
+    "run": lambda chip8: chip8.run,
+    "jit": lambda chip8: BlockCache(chip8).run,
+}
+
+
+# Best instructions/sec of repeat runs, each on a fresh machine after a warm-up run
+def measure_instructions(rom, engine, cycles, repeat):
+    best = None
+    for _ in range(repeat):
+        chip8 = create_machine(rom)
+        run = ENGINES[engine](chip8)
+        run(1000)
+        start = time.perf_counter()
+        run(cycles)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return cycles / best
+
+
+# Emulated frames per second of host time, through an unthrottled Scheduler
+# so the timers and the frame bookkeeping are counted too
+# A second of frames is run first, so the JIT is timed with its blocks translated
+def measure_frames(rom, engine, frames, cpu_hz):
+    chip8 = create_machine(rom)
+    scheduler = Scheduler(chip8, cpu_hz, throttle=False, engine=ENGINES[engine](chip8))
+    for _ in range(WARM_UP_FRAMES):
+        scheduler.run_frame()
+    start = time.perf_counter()
+    for _ in range(frames):
+        scheduler.run_frame()
+    return frames / (time.perf_counter() - start)
+
+
+# Peak bytes allocated to create a machine, load the rom and run it
+# The shared decode table is built beforehand and not counted
+def measure_memory(rom, engine, cycles):
+    get_decode_table()
+    tracemalloc.start()
+    try:
+        chip8 = create_machine(rom)
+        ENGINES[engine](chip8)(cycles)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_suite(roms, engines, cycles, repeat, frames, cpu_hz):
+    results = []
+    for name in roms:
+        rom = words_to_bytes(SUITE_ROMS[name]())
+        for engine in engines:
+            results.append({
+                "rom": name,
+                "engine": engine,
+                "instructions_per_second": measure_instructions(rom, engine, cycles, repeat),
+                "frames_per_second": measure_frames(rom, engine, frames, cpu_hz),
+                "peak_memory": measure_memory(rom, engine, min(cycles, 10000)),
+            })
+    return results
+
+
+def git_commit():
+    try:
+        output = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCHMARK_DIR, capture_output=True,
+                                text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return output.stdout.strip() or None
+
+
+# Appends one JSON line per run to the history file
+def append_history(path, results, args):
+    record = {
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cycles": args.cycles,
+        "cpu_hz": args.hz,
+        "results": results,
+    }
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+# Instructions/sec by "rom/engine"
+def baseline_entries(results):
+    return {f"{result['rom']}/{result['engine']}": result["instructions_per_second"] for result in results}
+
+
+# Returns (key, baseline, current) for every result slower than the baseline allows
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for key, current in baseline_entries(results).items():
+        expected = baseline.get(key)
+        if expected is not None and current < expected * (1 - threshold):
+            regressions.append((key, expected, current))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the interpreter on synthetic roms and track regressions")
+    parser.add_argument("-n", "--cycles", type=int, default=200000, help="instructions per timed run")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="timed runs, the best one counts")
+    parser.add_argument("--frames", type=int, default=600, help="frames run through the scheduler")
+    parser.add_argument("--hz", type=int, default=DEFAULT_CPU_HZ, help="instructions per second of emulated time")
+    parser.add_argument("--roms", nargs="+", choices=sorted(SUITE_ROMS), default=list(SUITE_ROMS))
+    parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES), default=list(ENGINES))
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON lines file the results are appended to")
+    parser.add_argument("--no-history", action="store_true", help="do not write the history file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="JSON file of instructions/sec to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--no-baseline", action="store_true", help="only measure, do not compare with the baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed drop below the baseline, as a fraction")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.roms, args.engines, args.cycles, args.repeat, args.frames, args.hz)
+
+    print(f"{'rom':<8}{'engine':<8}{'instructions':>16}{'frames':>12}{'peak memory':>14}")
+    for result in results:
+        print(f"{result['rom']:<8}{result['engine']:<8}{result['instructions_per_second']:>14.0f}/s"
+              f"{result['frames_per_second']:>10.0f}/s{result['peak_memory'] / 1024:>11.1f} KB")
+
+    if not args.no_history:
+        append_history(args.history, results, args)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(baseline_entries(results), f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+        return 0
+    if args.no_baseline:
+        return 0
+
+    # A missing baseline fails the gate, otherwise it could never catch anything
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, store one with --save-baseline on a known good commit "
+              "or pass --no-baseline", file=sys.stderr)
+        return 1
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = find_regressions(results, baseline, args.threshold)
+    for key, expected, current in regressions:
+        print(f"REGRESSION {key}: {current:.0f}/s, baseline {expected:.0f}/s ({current / expected - 1:+.1%})")
+    if regressions:
+        return 1
+    print(f"no regressions beyond {args.threshold:.0%} of the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,422 @@
+import argparse
+import hashlib
+import queue
+import re
+import struct
+import sys
+import threading
+import zlib
+
+from chip8 import pack_rows
+from recording import read_varint, write_varint
+
+# Capture files: a header followed by records, one per distinct frame
+CAPTURE_MAGIC = b"C8CV"
+CAPTURE_VERSION = 1
+# Magic, version, frames per second of emulated time
+CAPTURE_HEADER = struct.Struct(">4sBB")
+FRAME_RATE = 60
+
+# Kinds of record, each starts with the kind and the number of frames since the
+# previous record as a varint
+# A whole frame: width, height and number of bitplanes as bytes, then the
+# run-length encoded packed rows (all of plane 1, then plane 2)
+RECORD_KEY = 0
+# The run-length encoded XOR of the packed rows with the previous frame
+RECORD_DELTA = 1
+# The end of the capture, gives the last frame its length
+RECORD_END = 2
+
+# Frames waiting for the writer thread, frames arriving while it is full are dropped
+DEFAULT_QUEUE_SIZE = 256
+# A whole frame is written at least this often, so a damaged file loses little
+DEFAULT_KEYFRAME_INTERVAL = 600
+
+# Colours of exported images: off, plane 1, plane 2, both planes
+CAPTURE_PALETTE = [(0, 0, 0), (255, 255, 255), (255, 85, 0), (255, 170, 0)]
+
+# Three or more equal bytes in a row
+RUN = re.compile(rb"(.)\1{2,}", re.DOTALL)
+
+# The 8 pixels (0 or 1) for every possible byte of a packed row
+BYTE_PIXELS = [bytes((value >> (7 - bit)) & 1 for bit in range(8)) for value in range(256)]
+
+
+# PackBits run-length encoding: a control byte below 128 is followed by that
+# many plus one literal bytes, one above 128 by a byte repeated 257 minus it times
+# The runs are found by a regular expression, so long zero runs in deltas cost little
+def rle_encode(data):
+    out = bytearray()
+    position = 0
+    for match in RUN.finditer(data):
+        write_literals(out, data[position:match.start()])
+        value = match.group(1)
+        length = match.end() - match.start()
+        while length >= 2:
+            count = min(length, 128)
+            out.append(257 - count)
+            out += value
+            length -= count
+        # A single byte left over from a long run
+        write_literals(out, value * length)
+        position = match.end()
+    write_literals(out, data[position:])
+    return bytes(out)
+
+
+def write_literals(out, data):
+    for start in range(0, len(data), 128):
+        chunk = data[start:start + 128]
+        out.append(len(chunk) - 1)
+        out += chunk
+
+
+def rle_decode(data):
+    out = bytearray()
+    offset = 0
+    while offset < len(data):
+        control = data[offset]
+        offset += 1
+        if control < 128:
+            out += data[offset:offset + control + 1]
+            offset += control + 1
+        elif control > 128:
+            out += data[offset:offset + 1] * (257 - control)
+            offset += 1
+    return bytes(out)
+
+
+# XORs two equal length byte strings
+def xor_bytes(a, b):
+    return (int.from_bytes(a, "big") ^ int.from_bytes(b, "big")).to_bytes(len(a), "big")
+
+
+# Packed rows of every bitplane of a machine, hashed the same way as headless.display_hash
+def frame_bytes(chip8):
+    data = pack_rows(chip8.display, chip8.width)
+    if chip8.plane2 is not None:
+        data += pack_rows(chip8.plane2, chip8.width)
+    return data
+
+
+# Follows the framebuffer of a headless run, hashing every distinct frame and
+# optionally streaming them to a capture file
+# The encoding and writing happen on a background thread fed through a bounded
+# queue, a full queue drops frames instead of holding up the emulation
+class Capture():
+    def __init__(self, path=None, queue_size=DEFAULT_QUEUE_SIZE, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        # (frame number, SHA-1) of every frame that differed from the one before it
+        self.hashes = []
+        # Frame number each distinct framebuffer was first seen at, by SHA-1
+        self.first_seen = {}
+        self.last = None
+        # Number of the frame after the last one seen, where the capture ends
+        self.end = 0
+        self.captured = 0
+        self.dropped = 0
+        # The last frame dropped while the queue was full, queued again with the
+        # next frame even if that did not change, or when the capture is closed
+        self.pending = None
+        self.error = None
+        self.queue = None
+        self.thread = None
+        if path is not None:
+            self.queue = queue.Queue(queue_size)
+            self.thread = threading.Thread(target=self.write_loop, name="capture-writer", daemon=True)
+            self.thread.start()
+
+    # Called once per emulated frame, returns True if the frame was new
+    # Machines that did not draw since the last call are skipped without looking at the display
+    def frame(self, number, chip8):
+        self.end = number + 1
+        if not chip8.draw_flag and self.pending is None and self.last is not None:
+            return False
+        chip8.draw_flag = False
+        data = frame_bytes(chip8)
+        key = (chip8.width, data)
+        changed = key != self.last
+        if changed:
+            self.last = key
+            digest = hashlib.sha1(data).hexdigest()
+            self.hashes.append((number, digest))
+            self.first_seen.setdefault(digest, number)
+        if self.queue is not None and (changed or self.pending is not None):
+            planes = 1 if chip8.plane2 is None else 2
+            record = (RECORD_KEY, number, chip8.width, chip8.height, planes, data)
+            try:
+                self.queue.put_nowait(record)
+                self.captured += 1
+                self.pending = None
+            except queue.Full:
+                self.dropped += 1
+                self.pending = record
+        return changed
+
+    # Number of distinct framebuffers seen
+    def distinct_frames(self):
+        return len(self.first_seen)
+
+    # Ends the capture after the last frame seen, or at frame number end,
+    # and waits for the writer to finish
+    def close(self, end=None):
+        if self.thread is None:
+            return
+        if self.pending is not None:
+            # The file has to end on the final framebuffer
+            self.queue.put(self.pending)
+            self.captured += 1
+            self.pending = None
+        self.queue.put((RECORD_END, self.end if end is None else end, None, None, None, None))
+        self.thread.join()
+        self.thread = None
+        if self.error is not None:
+            raise self.error
+
+    # Runs on the writer thread, encodes frames as keyframes or deltas against
+    # the previous frame written
+    def write_loop(self):
+        try:
+            with open(self.path, "wb") as f:
+                f.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, FRAME_RATE))
+                previous = None
+                last_number = 0
+                since_keyframe = 0
+                while True:
+                    kind, number, width, height, planes, data = self.queue.get()
+                    record = bytearray((kind,))
+                    write_varint(record, number - last_number)
+                    last_number = number
+                    if kind == RECORD_END:
+                        f.write(record)
+                        return
+                    shape = (width, height, planes)
+                    if previous is None or previous[0] != shape or since_keyframe >= self.keyframe_interval:
+                        record += bytes(shape)
+                        payload = rle_encode(data)
+                        since_keyframe = 0
+                    else:
+                        record[0] = RECORD_DELTA
+                        payload = rle_encode(xor_bytes(data, previous[1]))
+                        since_keyframe += 1
+                    write_varint(record, len(payload))
+                    f.write(record)
+                    f.write(payload)
+                    previous = (shape, data)
+        except Exception as error:
+            self.error = error
+            # Keep draining so the emulation never blocks on a dead writer
+            while True:
+                if self.queue.get()[0] == RECORD_END:
+                    return
+
+
+# Reads a capture file, returns (frame rate, frames, end frame) where frames is
+# a list of (frame number, width, height, planes, packed rows)
+def read_capture(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < CAPTURE_HEADER.size:
+        raise ValueError("Capture file is too short")
+    magic, version, frame_rate = CAPTURE_HEADER.unpack_from(data)
+    if magic != CAPTURE_MAGIC:
+        raise ValueError("Not a capture file")
+    if version != CAPTURE_VERSION:
+        raise ValueError(f"Unsupported capture version: {version}")
+    frames = []
+    number = 0
+    end = None
+    offset = CAPTURE_HEADER.size
+    previous = None
+    while offset < len(data):
+        kind = data[offset]
+        delta, offset = read_varint(data, offset + 1)
+        number += delta
+        if kind == RECORD_END:
+            end = number
+            break
+        if kind == RECORD_KEY:
+            shape = tuple(data[offset:offset + 3])
+            offset += 3
+        elif kind == RECORD_DELTA:
+            if previous is None:
+                raise ValueError("Capture starts with a delta frame")
+            shape = previous[0]
+        else:
+            raise ValueError(f"Unknown record kind {kind} in capture")
+        length, offset = read_varint(data, offset)
+        packed = rle_decode(data[offset:offset + length])
+        offset += length
+        if kind == RECORD_DELTA:
+            packed = xor_bytes(packed, previous[1])
+        previous = (shape, packed)
+        frames.append((number,) + shape + (packed,))
+    if end is None:
+        # The run was cut off, the last frame gets a single frame
+        end = frames[-1][0] + 1 if frames else 0
+    return frame_rate, frames, end
+
+
+# Palette index rows of a frame, each pixel scale x scale
+def frame_pixels(width, height, planes, packed, scale):
+    row_bytes = width // 8
+    plane_size = row_bytes * height
+    rows = []
+    for y in range(height):
+        pixels = 0
+        for plane in range(planes):
+            start = plane * plane_size + y * row_bytes
+            # One byte per pixel, 0 or 1, shifted into the plane's bit of the palette index
+            expanded = b"".join(BYTE_PIXELS[value] for value in packed[start:start + row_bytes])
+            pixels |= int.from_bytes(expanded, "big") << plane
+        row = bytes(value for value in pixels.to_bytes(width, "big") for _ in range(scale))
+        rows += [row] * scale
+    return rows
+
+
+# Frames with their lengths in emulated frames, all scaled to the size of the largest
+def export_frames(frames, end, scale):
+    width = max(frame[1] for frame in frames)
+    height = max(frame[2] for frame in frames)
+    exported = []
+    for i, (number, frame_width, frame_height, planes, packed) in enumerate(frames):
+        length = (frames[i + 1][0] if i + 1 < len(frames) else end) - number
+        rows = frame_pixels(frame_width, frame_height, planes, packed, scale * width // frame_width)
+        exported.append((rows, max(length, 1)))
+    return width * scale, height * scale, exported
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+# Writes the frames of a capture as an animated PNG with a palette
+def export_apng(path, frames, end, frame_rate=FRAME_RATE, scale=4, palette=CAPTURE_PALETTE):
+    width, height, exported = export_frames(frames, end, scale)
+    out = [b"\x89PNG\r\n\x1a\n", png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)),
+           png_chunk(b"PLTE", b"".join(bytes(colour) for colour in palette)),
+           png_chunk(b"acTL", struct.pack(">II", len(exported), 0))]
+    sequence = 0
+    for i, (rows, length) in enumerate(exported):
+        out.append(png_chunk(b"fcTL", struct.pack(">IIIIIHHBB", sequence, width, height, 0, 0,
+                                                   length, frame_rate, 0, 0)))
+        sequence += 1
+        image = zlib.compress(b"".join(b"\0" + row for row in rows), 9)
+        if i == 0:
+            out.append(png_chunk(b"IDAT", image))
+        else:
+            out.append(png_chunk(b"fdAT", struct.pack(">I", sequence) + image))
+            sequence += 1
+    out.append(png_chunk(b"IEND", b""))
+    with open(path, "wb") as f:
+        f.write(b"".join(out))
+
+
+# GIF's variable width LZW, codes are packed least significant bit first
+def lzw_encode(pixels, min_code_size=2):
+    clear = 1 << min_code_size
+    stop = clear + 1
+    out = bytearray()
+    buffer = 0
+    buffer_bits = 0
+
+    def reset():
+        return {bytes((value,)): value for value in range(clear)}, stop + 1, min_code_size + 1
+
+    table, next_code, code_size = reset()
+    codes = [clear]
+    sizes = [code_size]
+    current = b""
+    for value in pixels:
+        extended = current + bytes((value,))
+        if extended in table:
+            current = extended
+            continue
+        codes.append(table[current])
+        sizes.append(code_size)
+        if next_code < 4096:
+            table[extended] = next_code
+            next_code += 1
+            if next_code > (1 << code_size) and code_size < 12:
+                code_size += 1
+        else:
+            codes.append(clear)
+            sizes.append(code_size)
+            table, next_code, code_size = reset()
+        current = bytes((value,))
+    if current:
+        codes.append(table[current])
+        sizes.append(code_size)
+    codes.append(stop)
+    sizes.append(code_size)
+
+    for code, size in zip(codes, sizes):
+        buffer |= code << buffer_bits
+        buffer_bits += size
+        while buffer_bits >= 8:
+            out.append(buffer & 0xFF)
+            buffer >>= 8
+            buffer_bits -= 8
+    if buffer_bits:
+        out.append(buffer & 0xFF)
+    return bytes(out)
+
+
+# Writes the frames of a capture as a looping animated GIF
+# GIF delays are in hundredths of a second, rounding errors are carried over
+# so the animation keeps the emulated timing
+def export_gif(path, frames, end, frame_rate=FRAME_RATE, scale=4, palette=CAPTURE_PALETTE):
+    width, height, exported = export_frames(frames, end, scale)
+    out = bytearray(b"GIF89a")
+    # Global colour table of 4 entries
+    out += struct.pack("<HHBBB", width, height, 0xF1, 0, 0)
+    out += b"".join(bytes(colour) for colour in palette)
+    out += b"\x21\xFF\x0BNETSCAPE2.0\x03\x01\x00\x00\x00"
+    elapsed = 0
+    shown = 0
+    for rows, length in exported:
+        elapsed += length
+        delay = round(elapsed * 100 / frame_rate) - shown
+        shown += delay
+        out += b"\x21\xF9\x04\x00" + struct.pack("<H", delay) + b"\x00\x00"
+        out += b"\x2C" + struct.pack("<HHHHB", 0, 0, width, height, 0)
+        image = lzw_encode(b"".join(rows))
+        out.append(2)
+        for start in range(0, len(image), 255):
+            block = image[start:start + 255]
+            out.append(len(block))
+            out += block
+        out.append(0)
+    out.append(0x3B)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or export a capture written by headless.py --capture")
+    parser.add_argument("capture", help="capture file")
+    parser.add_argument("--export", metavar="PATH", help="write an animated .png or .gif")
+    parser.add_argument("--scale", type=int, default=4, help="size of a CHIP-8 pixel in exported images")
+    parser.add_argument("--hashes", action="store_true", help="print the SHA-1 of every frame")
+    args = parser.parse_args(argv)
+
+    frame_rate, frames, end = read_capture(args.capture)
+    print(f"{len(frames)} frames over {end} emulated frames ({end / frame_rate:.1f}s)")
+    if args.hashes:
+        for number, width, height, planes, packed in frames:
+            print(f"  {number:>8}  {width}x{height}  {hashlib.sha1(packed).hexdigest()}")
+    if args.export:
+        if not frames:
+            print("nothing to export")
+            return 1
+        if args.export.lower().endswith(".gif"):
+            export_gif(args.export, frames, end, frame_rate, args.scale)
+        else:
+            export_apng(args.export, frames, end, frame_rate, args.scale)
+        print(f"exported to {args.export}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,11 @@
+# The interpreter core, importable without pygame or any other frontend
+# Frontends live in chip8.frontends and are only imported when one is picked
+from chip8.core import (
+    BIG_FONTSET_SIZE, BIG_FONTSET_START_ADDRESS, BLANK_DISPLAY, DEFAULT_PITCH, DEFAULT_QUIRKS,
+    DISPLAY_HEIGHT, DISPLAY_WIDTH, FONT_LAYOUTS, FONTSET_SIZE, FONTSET_START_ADDRESS, FRAME_TIME,
+    HIRES_HEIGHT, HIRES_WIDTH, INSTRUCTION_SETS, INSTRUCTIONS_CHIP8, INSTRUCTIONS_SCHIP,
+    INSTRUCTIONS_XOCHIP, MEMORY_SIZE, NNN_OPCODES, QUIRK_PROFILES, QUIRK_VARIANTS, ROW_MASK,
+    START_ADDRESS, STATE_SIZE, TABLE, TABLE0, TABLE8, TABLEE, TABLEF, TIMER_HZ, XKK_OPCODES,
+    XO_MEMORY_SIZE, XY_OPCODES, Chip8, Decoder, big_fontset, build_decode_table, decode_entry,
+    decode_opcode, fontset, get_decode_table, pack_rows, unpack_rows
+)
@@ -0,0 +1,1242 @@
+import random
+import struct
+from array import array
+
+from chip8.romcache import rom_cache
+
+START_ADDRESS = 0x200
+# The delay and sound timers always count down at 60 Hz
+TIMER_HZ = 60
+FRAME_TIME = 1.0 / TIMER_HZ
+# Quirk profile of machines that do not ask for one, see QUIRK_PROFILES
+DEFAULT_QUIRKS = "default"
+FONTSET_START_ADDRESS = 0x50
+FONTSET_SIZE = 80
+# The 8x10 digits of Fx30 follow the small font on SUPER-CHIP and XO-CHIP machines
+BIG_FONTSET_START_ADDRESS = 0xA0
+BIG_FONTSET_SIZE = 160
+
+MEMORY_SIZE = 4096
+# XO-CHIP machines address 64 KB
+XO_MEMORY_SIZE = 0x10000
+
+# Instruction sets a quirk profile can ask for, see QUIRK_PROFILES
+INSTRUCTIONS_CHIP8 = "chip8"
+INSTRUCTIONS_SCHIP = "schip"
+INSTRUCTIONS_XOCHIP = "xochip"
+
+DISPLAY_WIDTH = 64
+DISPLAY_HEIGHT = 32
+# Each display row is a 64-bit int, the leftmost pixel is the highest bit
+ROW_MASK = (1 << DISPLAY_WIDTH) - 1
+BLANK_DISPLAY = [0] * DISPLAY_HEIGHT
+# SUPER-CHIP hires mode, rows are then 128-bit ints
+HIRES_WIDTH = 128
+HIRES_HEIGHT = 64
+
+# Playback rate of XO-CHIP audio patterns until Fx3A sets one, 4000 Hz
+DEFAULT_PITCH = 64
+
+# Save state layout: a fixed header followed by registers, stack, keypad, display and memory,
+# with the random number generator at the end so a restored Cxkk repeats its values
+STATE_MAGIC = b"C8ST"
+STATE_VERSION = 3
+STATE_HEADER = struct.Struct(">4sBIHBBBBIH")
+STATE_STACK = struct.Struct(">16H")
+STATE_DISPLAY = struct.Struct(f">{DISPLAY_HEIGHT}Q")
+STATE_REGISTERS_OFFSET = STATE_HEADER.size
+STATE_STACK_OFFSET = STATE_REGISTERS_OFFSET + 16
+STATE_KEYPAD_OFFSET = STATE_STACK_OFFSET + STATE_STACK.size
+STATE_DISPLAY_OFFSET = STATE_KEYPAD_OFFSET + 16
+STATE_MEMORY_OFFSET = STATE_DISPLAY_OFFSET + STATE_DISPLAY.size
+# The 624 words and position of the Mersenne Twister behind random.Random
+STATE_RNG = struct.Struct(">625I")
+# Version of random.Random.getstate() tuples
+RNG_STATE_VERSION = 3
+STATE_SIZE = STATE_MEMORY_OFFSET + MEMORY_SIZE + STATE_RNG.size
+# Machines with the SUPER-CHIP or XO-CHIP instructions save version 4 states: the
+# same layout with all of their memory, followed by an extension holding the
+# resolution, bitplanes, flag registers and audio state, then the generator
+# The classic display region is left empty, the rows of both bitplanes follow the extension
+STATE_EXTENDED_VERSION = 4
+STATE_EXTENSION = struct.Struct(">BBBQ16s16s")
+STATE_PLANE_SIZE = HIRES_HEIGHT * HIRES_WIDTH // 8
+
+# Define the Chip8 class
+class Chip8():
+    # Fixed attributes keep an instance down to a few KB
+    __slots__ = (
+        "registers", "memory", "index", "pc", "stack", "stack_pointer",
+        "delay_timer", "sound_timer", "keypad", "display", "opcode",
+        "halted", "draw_flag", "dirty_rows", "decode_table", "rng", "rng_draws", "rng_state", "quirks",
+        "instructions", "width", "height", "plane2", "planes", "rpl_flags",
+        "audio_pattern", "pitch", "audio"
+    )
+
+    # Machines created with the same seed produce the same random numbers
+    # quirks names one of QUIRK_PROFILES, its handler variants are bound into the decode table
+    def __init__(self, seed=None, quirks=DEFAULT_QUIRKS):
+        # Handlers and operands for every opcode, shared by all instances with the same quirks
+        self.decode_table = get_decode_table(quirks)
+        self.quirks = quirks
+        self.instructions = QUIRK_PROFILES[quirks].get("instructions", INSTRUCTIONS_CHIP8)
+        xochip = self.instructions == INSTRUCTIONS_XOCHIP
+
+        # Byte sized state lives in bytearrays, which also refuse values outside 0-255
+        self.registers = bytearray(16)
+        self.memory = bytearray(XO_MEMORY_SIZE if xochip else MEMORY_SIZE)
+        self.index = 0
+        self.pc = START_ADDRESS
+        self.stack = array('H', [0] * 16)
+        self.stack_pointer = 0
+        self.delay_timer = 0
+        self.sound_timer = 0
+        self.keypad = bytearray(16)
+        self.display = [0] * DISPLAY_HEIGHT
+        self.opcode = 0
+        self.halted = False
+        self.draw_flag = False
+        # Bit y is set when display row y changed since the frontend last drew it
+        self.dirty_rows = 0
+        # Current resolution, 00FF switches SUPER-CHIP and XO-CHIP machines to HIRES_WIDTH x HIRES_HEIGHT
+        self.width = DISPLAY_WIDTH
+        self.height = DISPLAY_HEIGHT
+        # XO-CHIP's second bitplane, packed like display, None on other machines
+        self.plane2 = [0] * DISPLAY_HEIGHT if xochip else None
+        # Bitplanes drawn, cleared and scrolled: bit 0 for display, bit 1 for plane2
+        self.planes = 1
+        # SUPER-CHIP flag registers written by Fx75
+        self.rpl_flags = bytearray(16)
+        # XO-CHIP audio, the 128 one bit samples loaded by F002 and the rate set by Fx3A
+        self.audio_pattern = bytearray(16)
+        self.pitch = DEFAULT_PITCH
+        # Told about every change of the sound, see audio.AudioEngine, None plays nothing
+        self.audio = None
+
+        # Random numbers for Cxkk, seeded from the OS when no seed is given
+        self.rng = random.Random(seed)
+        # Values drawn so far, and the packed generator with the count it was packed at
+        # Packing takes longer than the rest of a save state, most roms never draw
+        # between two saves so it is only done again after a draw
+        self.rng_draws = 0
+        self.rng_state = (-1, b"")
+
+    def op_null(self, *args):
+        # Do nothing
+        pass
+
+    # Stands in for every opcode that has not run yet, see Decoder
+    def op_decode(self, decoder):
+        handler, operands = decoder.decode(self.opcode)
+        handler(self, *operands)
+        
+
+    # Loads the rom binary into the memory
+    # The whole memory is replaced in one copy by an image with the fonts and the
+    # rom in place, built once per rom and shared through rom_cache
+    def load_rom(self, rom_path):
+        self.memory[:] = rom_cache.load(rom_path).image(len(self.memory), START_ADDRESS, FONT_LAYOUTS[self.instructions])
+
+    # Loads a rom that is already in memory, for example one sent over a socket
+    def load_bytes(self, rom):
+        if START_ADDRESS + len(rom) > len(self.memory):
+            raise ValueError(f"ROM is too large: {len(rom)} bytes")
+        self.memory[START_ADDRESS:START_ADDRESS + len(rom)] = rom
+
+    def load_fontset(self):
+        for address, font in FONT_LAYOUTS[self.instructions]:
+            self.memory[address:address + len(font)] = font
+
+    # Size of the blobs save_state makes for this machine, STATE_SIZE for the original instruction set
+    def state_size(self):
+        if self.instructions == INSTRUCTIONS_CHIP8:
+            return STATE_SIZE
+        return (STATE_MEMORY_OFFSET + len(self.memory) + STATE_EXTENSION.size + 2 * STATE_PLANE_SIZE
+                + STATE_RNG.size)
+
+    # Serializes the whole machine into a state_size() byte blob
+    def save_state(self):
+        extended = self.instructions != INSTRUCTIONS_CHIP8
+        state = bytearray(self.state_size())
+        flags = (1 if self.halted else 0) | (2 if self.draw_flag else 0)
+        STATE_HEADER.pack_into(
+            state, 0, STATE_MAGIC, STATE_EXTENDED_VERSION if extended else STATE_VERSION, self.index,
+            self.pc, self.stack_pointer, self.delay_timer, self.sound_timer, flags,
+            0 if extended else self.dirty_rows, self.opcode
+        )
+        state[STATE_REGISTERS_OFFSET:STATE_STACK_OFFSET] = self.registers
+        STATE_STACK.pack_into(state, STATE_STACK_OFFSET, *self.stack)
+        state[STATE_KEYPAD_OFFSET:STATE_DISPLAY_OFFSET] = self.keypad
+        memory_end = STATE_MEMORY_OFFSET + len(self.memory)
+        state[STATE_MEMORY_OFFSET:memory_end] = self.memory
+        draws, packed = self.rng_state
+        if draws != self.rng_draws:
+            packed = STATE_RNG.pack(*self.rng.getstate()[1])
+            self.rng_state = (self.rng_draws, packed)
+        state[len(state) - STATE_RNG.size:] = packed
+        if not extended:
+            STATE_DISPLAY.pack_into(state, STATE_DISPLAY_OFFSET, *self.display)
+            return bytes(state)
+
+        STATE_EXTENSION.pack_into(
+            state, memory_end, self.width == HIRES_WIDTH, self.planes, self.pitch, self.dirty_rows,
+            bytes(self.rpl_flags), bytes(self.audio_pattern)
+        )
+        offset = memory_end + STATE_EXTENSION.size
+        for rows in (self.display, self.plane2):
+            if rows is not None:
+                state[offset:offset + STATE_PLANE_SIZE] = pack_rows(rows, HIRES_WIDTH).ljust(STATE_PLANE_SIZE, b"\0")
+            offset += STATE_PLANE_SIZE
+        return bytes(state)
+
+    # Restores a blob made by save_state, copying straight into the existing buffers
+    # Any translated code (jit.BlockCache) has to be flushed afterwards
+    def load_state(self, state):
+        size = self.state_size()
+        if len(state) != size:
+            raise ValueError(f"Save state must be {size} bytes, got {len(state)}")
+        extended = self.instructions != INSTRUCTIONS_CHIP8
+        # Checked before anything is assigned, a rejected blob leaves the machine as it was
+        header = STATE_HEADER.unpack_from(state, 0)
+        magic, version, flags = header[0], header[1], header[7]
+        if magic != STATE_MAGIC or version != (STATE_EXTENDED_VERSION if extended else STATE_VERSION):
+            raise ValueError("Not a save state, or from an incompatible version")
+        (self.index, self.pc, self.stack_pointer, self.delay_timer, self.sound_timer) = header[2:7]
+        self.dirty_rows, self.opcode = header[8:]
+        self.halted = bool(flags & 1)
+        self.draw_flag = bool(flags & 2)
+        view = memoryview(state)
+        self.registers[:] = view[STATE_REGISTERS_OFFSET:STATE_STACK_OFFSET]
+        self.stack[:] = array('H', STATE_STACK.unpack_from(state, STATE_STACK_OFFSET))
+        self.keypad[:] = view[STATE_KEYPAD_OFFSET:STATE_DISPLAY_OFFSET]
+        memory_end = STATE_MEMORY_OFFSET + len(self.memory)
+        self.memory[:] = view[STATE_MEMORY_OFFSET:memory_end]
+        packed = bytes(view[size - STATE_RNG.size:])
+        if self.rng_state != (self.rng_draws, packed):
+            self.rng.setstate((RNG_STATE_VERSION, STATE_RNG.unpack(packed), None))
+            self.rng_state = (self.rng_draws, packed)
+        if not extended:
+            self.display[:] = STATE_DISPLAY.unpack_from(state, STATE_DISPLAY_OFFSET)
+            self.sound_changed()
+            return
+
+        hires, self.planes, self.pitch, self.dirty_rows, rpl_flags, audio_pattern = \
+            STATE_EXTENSION.unpack_from(state, memory_end)
+        self.rpl_flags[:] = rpl_flags
+        self.audio_pattern[:] = audio_pattern
+        self.width = HIRES_WIDTH if hires else DISPLAY_WIDTH
+        self.height = HIRES_HEIGHT if hires else DISPLAY_HEIGHT
+        offset = memory_end + STATE_EXTENSION.size
+        for rows in (self.display, self.plane2):
+            if rows is not None:
+                rows[:] = unpack_rows(view[offset:offset + STATE_PLANE_SIZE], HIRES_WIDTH)[:self.height]
+            offset += STATE_PLANE_SIZE
+        self.sound_changed()
+
+    # Returns 1 if the pixel at (x, y) is set
+    def get_pixel(self, x, y):
+        return (self.display[y] >> (self.width - 1 - x)) & 1
+
+    def random_Generator(self):
+        self.rng_draws += 1
+        return self.rng.getrandbits(8)
+    
+    # CLS - Clear the display
+    def OP_00E0(self):
+        # Clear the display
+        # Set all rows to 0 in one go
+        dirty = 0
+        for row, bits in enumerate(self.display):
+            if bits:
+                dirty |= 1 << row
+        if dirty:
+            self.display[:] = BLANK_DISPLAY
+            self.dirty_rows |= dirty
+            self.draw_flag = True
+    
+    # RET - Return from a subroutine
+    def OP_00EE(self):
+        # Ensure stack pointer is within bounds
+        if self.stack_pointer <= 0:
+            print("Stack underflow error")
+            self.pc = 0  # Reset program counter to prevent further execution
+            self.halted = True
+            return
+        self.stack_pointer -= 1
+        self.pc = self.stack[self.stack_pointer]
+    
+    # JP addr - Jump to address NNN
+    def OP_1NNN(self, nnn):
+        # Jump to address NNN
+        # The address is stored in the last 12 bits of the opcode
+        self.pc = nnn
+    
+    # CALL addr - Call subroutine at NNN
+    def OP_2NNN(self, nnn):
+        # Call subroutine at NNN
+        # The address is stored in the last 12 bits of the opcode
+        # The stack pointer is incremented and the current program counter is pushed onto the stack
+        # The program counter is set to the address
+        # Stack pointer should not exceed the stack size
+        if self.stack_pointer >= len(self.stack):
+            print("Stack overflow error")
+            self.pc = 0
+            self.halted = True
+            return
+        self.stack[self.stack_pointer] = self.pc
+        self.stack_pointer += 1
+        self.pc = nnn
+    
+    # SE Vx, byte - Skip next instruction if Vx == kk
+    def OP_3xkk(self, x, kk):
+        # Skip the next instruction if Vx == kk
+        # The first byte of the opcode is the register number (Vx)
+        # The last byte of the opcode is the value to compare (kk)
+        if self.registers[x] == kk:
+            self.pc += 2
+    
+    # SNE Vx, byte - Skip next instruction if Vx != kk
+    def OP_4xkk(self, x, kk):
+        # Skip the next instruction if Vx != kk
+        # The first byte of the opcode is the register number (Vx)
+        # The last byte of the opcode is the value to compare (kk)
+        if self.registers[x] != kk:
+            self.pc += 2
+    
+    # SE Vx, Vy - Skip next instruction if Vx == Vy
+    def OP_5xy0(self, x, y):
+        # Skip the next instruction if Vx == Vy
+        # The first byte of the opcode is the register number (Vx)
+        # The second byte of the opcode is the register number (Vy)
+        if self.registers[x] == self.registers[y]:
+            self.pc += 2
+    
+    # LD Vx, byte - Set Vx = kk
+    def OP_6xkk(self, x, kk):
+        # Set Vx = kk
+        # The first byte of the opcode is the register number (Vx)
+        # The last byte of the opcode is the value to set (kk)
+        self.registers[x] = kk 
+
+    # ADD Vx, byte - Set Vx = Vx + kk
+    def OP_7xkk(self, x, kk):
+        # Set Vx = Vx + kk
+        # The first byte of the opcode is the register number (Vx)
+        # The last byte of the opcode is the value to add (kk)
+        # The result wraps around to 8 bits, no carry flag is set
+        self.registers[x] = (self.registers[x] + kk) & 0xFF
+    
+    # LD Vx, Vy - Set Vx = Vy
+    def OP_8xy0(self, x, y):
+        # Set Vx = Vy
+        # The first byte of the opcode is the register number (Vx)
+        # The second byte of the opcode is the register number (Vy)
+        self.registers[x] = self.registers[y]
+
+    # OR Vx, Vy - Set Vx = Vx OR Vy
+    def OP_8xy1(self, x, y):
+        # Set Vx = Vx OR Vy
+        # The first byte of the opcode is the register number (Vx)
+        # The second byte of the opcode is the register number (Vy)
+        self.registers[x] |= self.registers[y]
+    
+    # AND Vx, Vy - Set Vx = Vx AND Vy
+    def OP_8xy2(self, x, y):
+        # Set Vx = Vx AND Vy
+        # The first byte of the opcode is the register number (Vx)
+        # The second byte of the opcode is the register number (Vy)
+        self.registers[x] &= self.registers[y]
+    
+    # XOR Vx, Vy - Set Vx = Vx XOR Vy
+    def OP_8xy3(self, x, y):
+        # Set Vx = Vx XOR Vy
+        # The first byte of the opcode is the register number (Vx)
+        # The second byte of the opcode is the register number (Vy)
+        self.registers[x] ^= self.registers[y]
+    
+    # ADD Vx, Vy - Set Vx = Vx + Vy, set VF = carry
+    def OP_8xy4(self, x, y):
+        # Set Vx = Vx + Vy, set VF = carry
+        # The first byte of the opcode is the register number (Vx)
+        # The second byte of the opcode is the register number (Vy)
+
+        sum = self.registers[x] + self.registers[y]
+        if sum > 255:
+            self.registers[0xF] = 1
+        else:
+            self.registers[0xF] = 0
+        self.registers[x] = sum & 0xFF
+    
+    # SUB Vx, Vy - Set Vx = Vx - Vy, set VF = NOT borrow
+    def OP_8xy5(self, x, y):
+        # Set Vx = Vx - Vy, set VF = NOT borrow
+        # The first byte of the opcode is the register number (Vx)
+        # The second byte of the opcode is the register number (Vy)
+
+        if self.registers[x] > self.registers[y]:
+            self.registers[0xF] = 1
+        else:
+            self.registers[0xF] = 0
+        self.registers[x] = (self.registers[x] - self.registers[y]) & 0xFF
+
+    # SHR Vx {, Vy} - Set Vx = Vx SHL 1
+    def OP_8xy6(self, x, y):
+        # Set Vx = Vx SHR 1
+        # The first byte of the opcode is the register number (Vx)
+        # The second byte of the opcode is the register number (Vy)
+        self.registers[0xF] = self.registers[x] & 0x1
+        self.registers[x] >>= 1
+    
+    # SUBN Vx, Vy - Set Vx = Vy - Vx, set VF = NOT borrow
+    def OP_8xy7(self, x, y):
+        # Set Vx = Vy - Vx, set VF = NOT borrow
+        # The first byte of the opcode is the register number (Vx)
+        # The second byte of the opcode is the register number (Vy)
+        # Flipped order of x and y from OP_8xy5
+
+        if self.registers[y] > self.registers[x]:
+            self.registers[0xF] = 1
+        else:
+            self.registers[0xF] = 0
+        self.registers[x] = (self.registers[y] - self.registers[x]) & 0xFF
+    
+    # SHL Vx {, Vy} - Set Vx = Vx SHL 1
+    def OP_8xyE(self, x, y):
+        # Set Vx = Vx SHL 1
+        # The first byte of the opcode is the register number (Vx)
+        # The second byte of the opcode is the register number (Vy)
+        self.registers[0xF] = (self.registers[x] >> 7) & 0x1
+        self.registers[x] = (self.registers[x] << 1) & 0xFF
+    
+    # SNE Vx, Vy - Skip next instruction if Vx != Vy
+    def OP_9xy0(self, x, y):
+        # Skip the next instruction if Vx != Vy
+        # The first byte of the opcode is the register number (Vx)
+        # The second byte of the opcode is the register number (Vy)
+        if self.registers[x] != self.registers[y]:
+            self.pc += 2  
+    
+    # LD I, addr - Set I = nnn
+    def OP_Annn(self, nnn):
+        # Set I = nnn
+        # The last 12 bits of the opcode are the address (nnn)
+        self.index = nnn
+    
+    # JP V0, addr - Jump to location nnn + V0
+    def OP_Bnnn(self, nnn):
+        # Jump to address nnn + V0
+        # The last 12 bits of the opcode are the address (nnn)
+        self.pc = nnn + self.registers[0]
+    
+    # RND Vx, byte - Set Vx = random byte AND kk
+    def OP_Cxkk(self, x, kk):
+        # Set Vx = random byte AND kk
+        # The first byte of the opcode is the register number (Vx)
+        # The last byte of the opcode is the value to AND with (kk)
+        self.registers[x] = self.random_Generator() & kk
+
+    # DRW Vx, Vy, nibble - Draw a sprite at coordinate (Vx, Vy)
+    def OP_Dxyn(self, x, y, n):
+        # Draw a sprite at coordinate (Vx, Vy)
+        # Each sprite row is rotated into place and XORed onto a whole display row,
+        # pixels going past the right edge wrap around to the left
+        display = self.display
+        memory = self.memory
+        index = self.index
+
+        xPos = self.registers[x] % DISPLAY_WIDTH
+        yPos = self.registers[y] % DISPLAY_HEIGHT
+        shift = DISPLAY_WIDTH - 8 - xPos
+
+        collision = 0
+        dirty = 0
+        for row in range(n):
+            sprite_row = memory[index + row]
+            if not sprite_row:
+                continue
+            if shift >= 0:
+                bits = sprite_row << shift
+            else:
+                bits = ((sprite_row >> -shift) | (sprite_row << (DISPLAY_WIDTH + shift))) & ROW_MASK
+            display_row = (yPos + row) % DISPLAY_HEIGHT
+            if display[display_row] & bits:
+                collision = 1
+            display[display_row] ^= bits
+            dirty |= 1 << display_row
+
+        self.registers[0xF] = collision
+        if dirty:
+            self.dirty_rows |= dirty
+            self.draw_flag = True
+
+    # SKP Vx - Skip next instruction if key with the value of Vx is pressed
+    def OP_Ex9E(self, x):
+        # Skip the next instruction if the key stored in Vx is pressed
+        # The first byte of the opcode is the register number (Vx)
+        if self.keypad[self.registers[x]] == 1:
+            self.pc += 2
+    
+    # SKNP Vx - Skip next instruction if key with the value of Vx is not pressed
+    def OP_ExA1(self, x):
+        # Skip the next instruction if the key stored in Vx is not pressed
+        # The first byte of the opcode is the register number (Vx)
+        if self.keypad[self.registers[x]] == 0:
+            self.pc += 2
+    
+    # LD Vx, DT - Set Vx = delay timer value
+    def OP_Fx07(self, x):
+        # Set Vx = delay timer value
+        # The first byte of the opcode is the register number (Vx)
+        self.registers[x] = self.delay_timer
+    
+    # LD Vx, K - Wait for a key press, store the value of the key in Vx
+    def OP_Fx0A(self, x):
+        # Wait for a key press and store the value in Vx
+        # The first byte of the opcode is the register number (Vx)
+
+        # Wait for a key press
+        if self.keypad[0]:
+            self.registers[x] = 0
+            
+        elif self.keypad[1]:
+            self.registers[x] = 1
+            
+        elif self.keypad[2]:
+            self.registers[x] = 2
+            
+        elif self.keypad[3]:
+            self.registers[x] = 3
+            
+        elif self.keypad[4]:
+            self.registers[x] = 4
+            
+        elif self.keypad[5]:
+            self.registers[x] = 5
+            
+        elif self.keypad[6]:
+            self.registers[x] = 6
+            
+        elif self.keypad[7]:
+            self.registers[x] = 7
+            
+        elif self.keypad[8]:
+            self.registers[x] = 8
+            
+        elif self.keypad[9]:
+            self.registers[x] = 9
+            
+        elif self.keypad[10]:
+            self.registers[x] = 10
+            
+        elif self.keypad[11]:
+            self.registers[x] = 11
+        
+        elif self.keypad[12]:
+            self.registers[x] = 12
+        
+        elif self.keypad[13]:
+            self.registers[x] = 13
+        
+        elif self.keypad[14]:
+            self.registers[x] = 14
+        
+        elif self.keypad[15]:
+            self.registers[x] = 15
+        
+        else:
+            # No key pressed, wait for a key press
+            self.pc -= 2
+
+    # LD DT, Vx - Set delay timer = Vx
+    def OP_Fx15(self, x):
+        # Set delay timer = Vx
+        # The first byte of the opcode is the register number (Vx)
+        self.delay_timer = self.registers[x]
+    
+    # LD ST, Vx - Set sound timer = Vx
+    def OP_Fx18(self, x):
+        # Set sound timer = Vx
+        # The first byte of the opcode is the register number (Vx)
+        self.sound_timer = self.registers[x]
+        self.sound_changed()
+
+    # LD I, Vx - Set I = I + Vx
+    def OP_Fx1E(self, x):
+        # Set I = I + Vx
+        # The first byte of the opcode is the register number (Vx)
+        self.index += self.registers[x]
+    
+    # LD F, Vx - Set I = location of sprite for digit Vx
+    def OP_Fx29(self, x):
+        # Set I = location of sprite for digit Vx
+        # The first byte of the opcode is the register number (Vx)
+        self.index = FONTSET_START_ADDRESS + (self.registers[x] * 5)
+    
+    # LD B, Vx - Store BCD representation of Vx in memory locations I, I+1, and I+2
+    def OP_Fx33(self, x):
+        # Store BCD representation of Vx in memory locations I, I+1, and I+2
+        # The first byte of the opcode is the register number (Vx)
+        value = self.registers[x]
+        self.memory[self.index] = value // 100
+        self.memory[self.index + 1] = (value // 10) % 10
+        self.memory[self.index + 2] = value % 10
+    
+    # LD [I], Vx - Store registers V0 to Vx in memory starting at location I
+    def OP_Fx55(self, x):
+        # Store registers V0 to Vx in memory starting at address I
+        # The first byte of the opcode is the register number (Vx)
+        for i in range(x + 1):
+            self.memory[self.index + i] = self.registers[i]
+    
+    # LD Vx, [I] - Read registers V0 to Vx from memory starting at location I
+    def OP_Fx65(self, x):
+        # Read registers V0 to Vx from memory starting at address I
+        # The first byte of the opcode is the register number (Vx)
+        for i in range(x + 1):
+            self.registers[i] = self.memory[self.index + i]
+
+    # Variants of the handlers above used by the quirk profiles, a profile binds
+    # them into its decode table in place of the originals
+
+    # SHR Vx, Vy - Set Vx = Vy SHR 1, VF is written last
+    def OP_8xy6_vy(self, x, y):
+        value = self.registers[y]
+        self.registers[x] = value >> 1
+        self.registers[0xF] = value & 0x1
+
+    # SHL Vx, Vy - Set Vx = Vy SHL 1, VF is written last
+    def OP_8xyE_vy(self, x, y):
+        value = self.registers[y]
+        self.registers[x] = (value << 1) & 0xFF
+        self.registers[0xF] = value >> 7
+
+    # JP Vx, addr - Jump to address xnn + Vx
+    def OP_Bxnn(self, nnn):
+        self.pc = nnn + self.registers[nnn >> 8]
+
+    # DRW Vx, Vy, nibble - Like OP_Dxyn, but pixels past the edges of the display are cut off
+    def OP_Dxyn_clip(self, x, y, n):
+        display = self.display
+        memory = self.memory
+        index = self.index
+
+        # The starting position still wraps
+        xPos = self.registers[x] % DISPLAY_WIDTH
+        yPos = self.registers[y] % DISPLAY_HEIGHT
+        shift = DISPLAY_WIDTH - 8 - xPos
+
+        collision = 0
+        dirty = 0
+        for row in range(min(n, DISPLAY_HEIGHT - yPos)):
+            sprite_row = memory[index + row]
+            if not sprite_row:
+                continue
+            bits = sprite_row << shift if shift >= 0 else sprite_row >> -shift
+            display_row = yPos + row
+            if display[display_row] & bits:
+                collision = 1
+            display[display_row] ^= bits
+            dirty |= 1 << display_row
+
+        self.registers[0xF] = collision
+        if dirty:
+            self.dirty_rows |= dirty
+            self.draw_flag = True
+
+    # LD [I], Vx - Store V0 to Vx at I, then I = I + x + 1
+    def OP_Fx55_increment(self, x):
+        index = self.index
+        for i in range(x + 1):
+            self.memory[index + i] = self.registers[i]
+        self.index = index + x + 1
+
+    # LD Vx, [I] - Read V0 to Vx from I, then I = I + x + 1
+    def OP_Fx65_increment(self, x):
+        index = self.index
+        for i in range(x + 1):
+            self.registers[i] = self.memory[index + i]
+        self.index = index + x + 1
+
+    # LD [I], Vx - Store V0 to Vx at I, then I = I + x
+    def OP_Fx55_increment_x(self, x):
+        index = self.index
+        for i in range(x + 1):
+            self.memory[index + i] = self.registers[i]
+        self.index = index + x
+
+    # LD Vx, [I] - Read V0 to Vx from I, then I = I + x
+    def OP_Fx65_increment_x(self, x):
+        index = self.index
+        for i in range(x + 1):
+            self.registers[i] = self.memory[index + i]
+        self.index = index + x
+
+    # SUPER-CHIP and XO-CHIP instructions, bound into the decode tables of the
+    # profiles with those instruction sets
+    # Display rows are ints as wide as the current resolution, so scrolling
+    # shifts or moves whole rows instead of single pixels
+
+    # Display rows of the bitplanes selected by Fn01
+    def selected_planes(self):
+        if self.planes == 1:
+            return (self.display,)
+        if self.planes == 2:
+            return (self.plane2,)
+        if self.planes == 3:
+            return (self.display, self.plane2)
+        return ()
+
+    # Marks every row as changed after a clear, scroll or resolution change
+    def touch_all_rows(self):
+        self.dirty_rows = (1 << self.height) - 1
+        self.draw_flag = True
+
+    # CLS - Clear the selected bitplanes
+    def OP_00E0_planes(self):
+        for rows in self.selected_planes():
+            rows[:] = [0] * self.height
+        self.touch_all_rows()
+
+    # SCD nibble - Scroll the selected bitplanes down n rows
+    def OP_00Cn(self, n):
+        height = self.height
+        for rows in self.selected_planes():
+            rows[:] = ([0] * n + rows)[:height]
+        self.touch_all_rows()
+
+    # SCU nibble - Scroll the selected bitplanes up n rows (XO-CHIP)
+    def OP_00Dn(self, n):
+        for rows in self.selected_planes():
+            rows[:] = rows[n:] + [0] * n
+        self.touch_all_rows()
+
+    # SCR - Scroll the selected bitplanes right 4 pixels
+    def OP_00FB(self):
+        for rows in self.selected_planes():
+            rows[:] = [row >> 4 for row in rows]
+        self.touch_all_rows()
+
+    # SCL - Scroll the selected bitplanes left 4 pixels
+    def OP_00FC(self):
+        mask = (1 << self.width) - 1
+        for rows in self.selected_planes():
+            rows[:] = [(row << 4) & mask for row in rows]
+        self.touch_all_rows()
+
+    # EXIT - Stop the interpreter
+    def OP_00FD(self):
+        self.halted = True
+
+    # LOW - Switch to 64x32
+    def OP_00FE(self):
+        self.set_resolution(False)
+
+    # HIGH - Switch to 128x64
+    def OP_00FF(self):
+        self.set_resolution(True)
+
+    # Changing the resolution clears both bitplanes, the row lists are resized in place
+    def set_resolution(self, hires):
+        self.width = HIRES_WIDTH if hires else DISPLAY_WIDTH
+        self.height = HIRES_HEIGHT if hires else DISPLAY_HEIGHT
+        self.display[:] = [0] * self.height
+        if self.plane2 is not None:
+            self.plane2[:] = [0] * self.height
+        self.touch_all_rows()
+
+    # DRW Vx, Vy, nibble - Draw on the selected bitplanes at the current resolution,
+    # n = 0 draws a 16x16 sprite of 32 bytes
+    # With both bitplanes selected the sprite for plane2 follows the one for display
+    def OP_Dxyn_hires(self, x, y, n):
+        self.draw_sprite(x, y, n, False)
+
+    # DRW Vx, Vy, nibble - Like OP_Dxyn_hires, but pixels past the edges of the display are cut off
+    def OP_Dxyn_hires_clip(self, x, y, n):
+        self.draw_sprite(x, y, n, True)
+
+    def draw_sprite(self, x, y, n, clip):
+        memory = self.memory
+        index = self.index
+        width = self.width
+        height = self.height
+
+        xPos = self.registers[x] % width
+        yPos = self.registers[y] % height
+        if n == 0:
+            rows, sprite_width, row_bytes = 16, 16, 2
+        else:
+            rows, sprite_width, row_bytes = n, 8, 1
+        shift = width - sprite_width - xPos
+        row_mask = (1 << width) - 1
+        drawn_rows = min(rows, height - yPos) if clip else rows
+
+        collision = 0
+        dirty = 0
+        for display in self.selected_planes():
+            for row in range(drawn_rows):
+                address = index + row * row_bytes
+                if row_bytes == 1:
+                    sprite_row = memory[address]
+                else:
+                    sprite_row = (memory[address] << 8) | memory[address + 1]
+                if not sprite_row:
+                    continue
+                if shift >= 0:
+                    bits = sprite_row << shift
+                elif clip:
+                    bits = sprite_row >> -shift
+                else:
+                    bits = ((sprite_row >> -shift) | (sprite_row << (width + shift))) & row_mask
+                display_row = (yPos + row) % height
+                if display[display_row] & bits:
+                    collision = 1
+                display[display_row] ^= bits
+                dirty |= 1 << display_row
+            index += rows * row_bytes
+
+        self.registers[0xF] = collision
+        if dirty:
+            self.dirty_rows |= dirty
+            self.draw_flag = True
+
+    # LD HF, Vx - Set I = location of the 8x10 sprite for digit Vx
+    def OP_Fx30(self, x):
+        self.index = BIG_FONTSET_START_ADDRESS + (self.registers[x] & 0xF) * 10
+
+    # LD R, Vx - Store V0 to Vx in the flag registers
+    def OP_Fx75(self, x):
+        self.rpl_flags[:x + 1] = self.registers[:x + 1]
+
+    # LD Vx, R - Read V0 to Vx from the flag registers
+    def OP_Fx85(self, x):
+        self.registers[:x + 1] = self.rpl_flags[:x + 1]
+
+    # SAVE Vx - Vy - Store Vx to Vy at I, in either order, I is left alone (XO-CHIP)
+    def OP_5xy2(self, x, y):
+        step = 1 if x <= y else -1
+        index = self.index
+        for offset, register in enumerate(range(x, y + step, step)):
+            self.memory[index + offset] = self.registers[register]
+
+    # LOAD Vx - Vy - Read Vx to Vy from I, in either order, I is left alone (XO-CHIP)
+    def OP_5xy3(self, x, y):
+        step = 1 if x <= y else -1
+        index = self.index
+        for offset, register in enumerate(range(x, y + step, step)):
+            self.registers[register] = self.memory[index + offset]
+
+    # LD I, long NNNN - Set I to the 16 bit address in the next two bytes (XO-CHIP)
+    def OP_F000(self):
+        pc = self.pc
+        self.index = (self.memory[pc] << 8) | self.memory[pc + 1]
+        self.pc = pc + 2
+
+    # PLANE n - Select the bitplanes drawn, cleared and scrolled (XO-CHIP)
+    def OP_Fn01(self, x):
+        self.planes = x & 0x3
+
+    # AUDIO - Load 16 bytes of audio pattern from I (XO-CHIP)
+    def OP_F002(self):
+        index = self.index
+        self.audio_pattern[:] = self.memory[index:index + 16]
+        self.sound_changed()
+
+    # PITCH Vx - Set the playback rate of the audio pattern (XO-CHIP)
+    def OP_Fx3A(self, x):
+        self.pitch = self.registers[x]
+        self.sound_changed()
+
+    # Skips the next instruction, which is four bytes long when it is F000 NNNN
+    def skip_next(self):
+        pc = self.pc
+        if self.memory[pc] == 0xF0 and self.memory[pc + 1] == 0x00:
+            self.pc = pc + 4
+        else:
+            self.pc = pc + 2
+
+    # The skips of XO-CHIP machines, which step over F000 NNNN as a whole
+
+    # SE Vx, byte
+    def OP_3xkk_long(self, x, kk):
+        if self.registers[x] == kk:
+            self.skip_next()
+
+    # SNE Vx, byte
+    def OP_4xkk_long(self, x, kk):
+        if self.registers[x] != kk:
+            self.skip_next()
+
+    # SE Vx, Vy
+    def OP_5xy0_long(self, x, y):
+        if self.registers[x] == self.registers[y]:
+            self.skip_next()
+
+    # SNE Vx, Vy
+    def OP_9xy0_long(self, x, y):
+        if self.registers[x] != self.registers[y]:
+            self.skip_next()
+
+    # SKP Vx
+    def OP_Ex9E_long(self, x):
+        if self.keypad[self.registers[x]] == 1:
+            self.skip_next()
+
+    # SKNP Vx
+    def OP_ExA1_long(self, x):
+        if self.keypad[self.registers[x]] == 0:
+            self.skip_next()
+
+    def Cycle(self):
+        # Fetch the opcode
+        pc = self.pc
+        opcode = (self.memory[pc] << 8) | self.memory[pc + 1]
+        self.opcode = opcode
+
+        # Increment the program counter
+        self.pc = pc + 2
+
+        # Every opcode is decoded once, the first time it runs, so a single lookup gives the handler and its operands
+        handler, operands = self.decode_table[opcode]
+        handler(self, *operands)
+
+    # Decrements the delay and sound timers, called at 60 Hz by the scheduler
+    def update_timers(self):
+        if self.delay_timer > 0:
+            self.delay_timer -= 1
+        if self.sound_timer > 0:
+            self.sound_timer -= 1
+            if not self.sound_timer:
+                self.sound_changed()
+
+    # Called whenever the sound timer, audio pattern or pitch is set, so the beep
+    # starts and stops on the change instead of the audio polling every frame
+    def sound_changed(self):
+        if self.audio is not None:
+            self.audio.update(self)
+
+    # Runs up to the given number of cycles as fast as possible
+    # Stops early if the machine halts, returns the number of cycles executed
+    def run(self, cycles):
+        if self.halted:
+            return 0
+        cycle = self.Cycle
+        for i in range(cycles):
+            cycle()
+            if self.halted:
+                return i + 1
+        return cycles
+
+# Handlers selected by the first nibble of the opcode
+# Nibbles 0x0, 0x8, 0xE and 0xF select a group that is looked up again by sub-opcode
+TABLE = {
+    0x1: Chip8.OP_1NNN,
+    0x2: Chip8.OP_2NNN,
+    0x3: Chip8.OP_3xkk,
+    0x4: Chip8.OP_4xkk,
+    0x5: Chip8.OP_5xy0,
+    0x6: Chip8.OP_6xkk,
+    0x7: Chip8.OP_7xkk,
+    0x9: Chip8.OP_9xy0,
+    0xA: Chip8.OP_Annn,
+    0xB: Chip8.OP_Bnnn,
+    0xC: Chip8.OP_Cxkk,
+    0xD: Chip8.OP_Dxyn
+}
+
+# Keyed by the last byte of the opcode
+TABLE0 = {
+    0xE0: Chip8.OP_00E0,
+    0xEE: Chip8.OP_00EE
+}
+
+# Keyed by the last nibble of the opcode
+TABLE8 = {
+    0x0: Chip8.OP_8xy0,
+    0x1: Chip8.OP_8xy1,
+    0x2: Chip8.OP_8xy2,
+    0x3: Chip8.OP_8xy3,
+    0x4: Chip8.OP_8xy4,
+    0x5: Chip8.OP_8xy5,
+    0x6: Chip8.OP_8xy6,
+    0x7: Chip8.OP_8xy7,
+    0xE: Chip8.OP_8xyE
+}
+
+# Keyed by the last byte of the opcode
+TABLEE = {
+    0x9E: Chip8.OP_Ex9E,
+    0xA1: Chip8.OP_ExA1
+}
+
+# Keyed by the last byte of the opcode
+TABLEF = {
+    0x07: Chip8.OP_Fx07,
+    0x0A: Chip8.OP_Fx0A,
+    0x15: Chip8.OP_Fx15,
+    0x18: Chip8.OP_Fx18,
+    0x1E: Chip8.OP_Fx1E,
+    0x29: Chip8.OP_Fx29,
+    0x33: Chip8.OP_Fx33,
+    0x55: Chip8.OP_Fx55,
+    0x65: Chip8.OP_Fx65
+}
+
+# First nibbles whose handlers take nnn, (x, kk) or (x, y) as operands
+NNN_OPCODES = (0x1, 0x2, 0xA, 0xB)
+XKK_OPCODES = (0x3, 0x4, 0x6, 0x7, 0xC)
+XY_OPCODES = (0x5, 0x8, 0x9)
+
+
+# Returns the handler for an opcode and the operands it is called with
+def decode_opcode(opcode):
+    first_nibble = (opcode & 0xF000) >> 12
+    x = (opcode & 0x0F00) >> 8
+    y = (opcode & 0x00F0) >> 4
+    n = opcode & 0x000F
+    kk = opcode & 0x00FF
+    nnn = opcode & 0x0FFF
+
+    if first_nibble == 0x0:
+        return TABLE0.get(kk, Chip8.op_null), ()
+    if first_nibble == 0x8:
+        return TABLE8.get(n, Chip8.op_null), (x, y)
+    if first_nibble == 0xE:
+        return TABLEE.get(kk, Chip8.op_null), (x,)
+    if first_nibble == 0xF:
+        return TABLEF.get(kk, Chip8.op_null), (x,)
+
+    handler = TABLE[first_nibble]
+    if first_nibble in NNN_OPCODES:
+        return handler, (nnn,)
+    if first_nibble in XKK_OPCODES:
+        return handler, (x, kk)
+    if first_nibble in XY_OPCODES:
+        return handler, (x, y)
+    return handler, (x, y, n)
+
+
+# SUPER-CHIP instructions keyed by the whole opcode
+SCHIP_TABLE0 = {
+    0x00E0: Chip8.OP_00E0_planes,
+    0x00FB: Chip8.OP_00FB,
+    0x00FC: Chip8.OP_00FC,
+    0x00FD: Chip8.OP_00FD,
+    0x00FE: Chip8.OP_00FE,
+    0x00FF: Chip8.OP_00FF
+}
+
+# SUPER-CHIP instructions keyed by the last byte of the opcode
+SCHIP_TABLEF = {
+    0x30: Chip8.OP_Fx30,
+    0x75: Chip8.OP_Fx75,
+    0x85: Chip8.OP_Fx85
+}
+
+# Skips replaced on XO-CHIP machines
+XOCHIP_SKIPS = {
+    Chip8.OP_3xkk: Chip8.OP_3xkk_long,
+    Chip8.OP_4xkk: Chip8.OP_4xkk_long,
+    Chip8.OP_5xy0: Chip8.OP_5xy0_long,
+    Chip8.OP_9xy0: Chip8.OP_9xy0_long,
+    Chip8.OP_Ex9E: Chip8.OP_Ex9E_long,
+    Chip8.OP_ExA1: Chip8.OP_ExA1_long
+}
+
+
+# Returns the SUPER-CHIP handler and operands for an opcode, or None to keep the original decoding
+def decode_schip(opcode):
+    x = (opcode & 0x0F00) >> 8
+    if (opcode & 0xFFF0) == 0x00C0:
+        return Chip8.OP_00Cn, (opcode & 0xF,)
+    if opcode in SCHIP_TABLE0:
+        return SCHIP_TABLE0[opcode], ()
+    if (opcode & 0xF000) == 0xD000:
+        return Chip8.OP_Dxyn_hires, (x, (opcode & 0x00F0) >> 4, opcode & 0x000F)
+    if (opcode & 0xF000) == 0xF000 and (opcode & 0xFF) in SCHIP_TABLEF:
+        return SCHIP_TABLEF[opcode & 0xFF], (x,)
+    return None
+
+
+# Returns the XO-CHIP handler and operands for an opcode, or None to keep the original decoding
+# XO-CHIP includes all of SUPER-CHIP
+def decode_xochip(opcode):
+    x = (opcode & 0x0F00) >> 8
+    y = (opcode & 0x00F0) >> 4
+    if (opcode & 0xFFF0) == 0x00D0:
+        return Chip8.OP_00Dn, (opcode & 0xF,)
+    if (opcode & 0xF00F) == 0x5002:
+        return Chip8.OP_5xy2, (x, y)
+    if (opcode & 0xF00F) == 0x5003:
+        return Chip8.OP_5xy3, (x, y)
+    if opcode == 0xF000:
+        return Chip8.OP_F000, ()
+    if opcode == 0xF002:
+        return Chip8.OP_F002, ()
+    if (opcode & 0xF0FF) == 0xF001:
+        return Chip8.OP_Fn01, (x,)
+    if (opcode & 0xF0FF) == 0xF03A:
+        return Chip8.OP_Fx3A, (x,)
+    extended = decode_schip(opcode)
+    if extended is not None:
+        return extended
+    handler, operands = decode_opcode(opcode)
+    if handler in XOCHIP_SKIPS:
+        return XOCHIP_SKIPS[handler], operands
+    return None
+
+
+# Decoders of the instruction sets that extend the original one
+INSTRUCTION_SETS = {
+    INSTRUCTIONS_SCHIP: decode_schip,
+    INSTRUCTIONS_XOCHIP: decode_xochip
+}
+
+
+# Handlers swapped in for each quirk setting, settings not listed here keep the original handlers
+QUIRK_VARIANTS = {
+    # 8xy6/8xyE shift Vy into Vx instead of shifting Vx in place
+    ("shift", "vy"): {Chip8.OP_8xy6: Chip8.OP_8xy6_vy, Chip8.OP_8xyE: Chip8.OP_8xyE_vy},
+    # Fx55/Fx65 leave I pointing past the last register
+    ("load_store", "increment"): {Chip8.OP_Fx55: Chip8.OP_Fx55_increment, Chip8.OP_Fx65: Chip8.OP_Fx65_increment},
+    # Fx55/Fx65 advance I by x, one short of the last register
+    ("load_store", "increment_x"): {Chip8.OP_Fx55: Chip8.OP_Fx55_increment_x, Chip8.OP_Fx65: Chip8.OP_Fx65_increment_x},
+    # Bxnn jumps to xnn + Vx instead of nnn + V0
+    ("jump", "vx"): {Chip8.OP_Bnnn: Chip8.OP_Bxnn},
+    # Sprites are cut off at the edges of the display instead of wrapping around
+    ("sprites", "clip"): {Chip8.OP_Dxyn: Chip8.OP_Dxyn_clip, Chip8.OP_Dxyn_hires: Chip8.OP_Dxyn_hires_clip},
+}
+
+# Named sets of quirks, more can be added before machines are created
+# "instructions" picks the instruction set, INSTRUCTIONS_CHIP8 when left out
+QUIRK_PROFILES = {
+    # What this emulator has always done
+    DEFAULT_QUIRKS: {"shift": "vx", "load_store": "none", "jump": "v0", "sprites": "wrap"},
+    # The original COSMAC VIP interpreter
+    "chip8": {"shift": "vy", "load_store": "increment", "jump": "v0", "sprites": "clip"},
+    "chip48": {"shift": "vx", "load_store": "increment_x", "jump": "vx", "sprites": "clip"},
+    "schip": {"shift": "vx", "load_store": "none", "jump": "vx", "sprites": "clip",
+              "instructions": INSTRUCTIONS_SCHIP},
+    # Octo's XO-CHIP
+    "xochip": {"shift": "vy", "load_store": "increment", "jump": "v0", "sprites": "wrap",
+               "instructions": INSTRUCTIONS_XOCHIP},
+}
+
+
+# Fills in a decode table as opcodes first run, operand tuples are shared between entries to save memory
+# The instruction set and the handlers of the quirk profile replace the original
+# ones here, so no handler has to check a quirk while running
+# A rom only ever runs a few hundred distinct opcodes, decoding all 65536 up front
+# took longer than everything else needed to start a machine
+# The table stays a plain list, a dict or list subclass would slow down every Cycle,
+# so opcodes not decoded yet point at Chip8.op_decode, which decodes and replaces them
+class Decoder():
+    def __init__(self, quirks=DEFAULT_QUIRKS):
+        if quirks not in QUIRK_PROFILES:
+            raise ValueError(f"Unknown quirk profile: {quirks}")
+        self.variants = {}
+        for setting in QUIRK_PROFILES[quirks].items():
+            self.variants.update(QUIRK_VARIANTS.get(setting, {}))
+        self.decode_extended = INSTRUCTION_SETS.get(QUIRK_PROFILES[quirks].get("instructions", INSTRUCTIONS_CHIP8))
+        self.operand_cache = {}
+        self.table = [(Chip8.op_decode, (self,))] * 0x10000
+
+    # Decodes an opcode into its entry of the table and returns the entry
+    def decode(self, opcode):
+        handler, operands = decode_opcode(opcode)
+        if self.decode_extended is not None:
+            extended = self.decode_extended(opcode)
+            if extended is not None:
+                handler, operands = extended
+        handler = self.variants.get(handler, handler)
+        operands = self.operand_cache.setdefault(operands, operands)
+        entry = self.table[opcode] = (handler, operands)
+        return entry
+
+
+# Returns the (handler, operands) entry of an opcode, decoding it if it has not run yet
+# Used by code that inspects handlers instead of calling them
+def decode_entry(decode_table, opcode):
+    entry = decode_table[opcode]
+    if entry[0] is Chip8.op_decode:
+        entry = entry[1][0].decode(opcode)
+    return entry
+
+
+# Decodes all 65536 opcodes up front, for tools that walk the whole table
+def build_decode_table(quirks=DEFAULT_QUIRKS):
+    decoder = Decoder(quirks)
+    for opcode in range(0x10000):
+        decoder.decode(opcode)
+    return decoder.table
+
+
+# Decoders by quirk profile
+decoders = {}
+
+
+# Returns the decode table of a quirk profile, shared by every machine using it
+def get_decode_table(quirks=DEFAULT_QUIRKS):
+    decoder = decoders.get(quirks)
+    if decoder is None:
+        decoder = decoders[quirks] = Decoder(quirks)
+    return decoder.table
+
+
+# Packed display rows as bytes, each row width // 8 bytes big-endian
+def pack_rows(rows, width):
+    row_bytes = width // 8
+    return b"".join(row.to_bytes(row_bytes, "big") for row in rows)
+
+
+# The inverse of pack_rows
+def unpack_rows(data, width):
+    row_bytes = width // 8
+    return [int.from_bytes(data[offset:offset + row_bytes], "big") for offset in range(0, len(data), row_bytes)]
+
+
+# Load the fontset
+fontset = [
+    0xF0, 0x90, 0x90, 0x90, 0xF0, # 0
+    0x20, 0x60, 0x20, 0x20, 0x70, # 1
+    0xF0, 0x10, 0xF0, 0x80, 0xF0, # 2
+    0xF0, 0x10, 0xF0, 0x10, 0xF0, # 3
+    0x90, 0x90, 0xF0, 0x10, 0x10, # 4
+    0xF0, 0x80, 0xF0, 0x10, 0xF0, # 5
+    0xF0, 0x80, 0xF0, 0x90, 0xF0, # 6
+    0xF0, 0x10, 0x20, 0x40, 0x40, # 7
+    0xF0, 0x90, 0xF0, 0x90, 0xF0, # 8
+    0xF0, 0x90, 0xF0, 0x10, 0xF0, # 9
+    0xF0, 0x90, 0xF0, 0x90, 0x90, # A
+    0xE0, 0x90, 0xE0, 0x90, 0xE0, # B
+    0xF0, 0x80, 0x80, 0x80, 0xF0, # C
+    0xF0, 0x80, 0xF0, 0x90, 0xF0, # D
+    0xF0, 0x80, 0xF0, 0x80, 0x80, # E
+    0xF0, 0x80, 0xF0, 0x90, 0x90  # F
+]
+
+# 8x10 digits for Fx30, the SUPER-CHIP font extended with A-F as in Octo
+big_fontset = [
+    0x3C, 0x7E, 0xE7, 0xC3, 0xC3, 0xC3, 0xC3, 0xE7, 0x7E, 0x3C, # 0
+    0x18, 0x38, 0x58, 0x18, 0x18, 0x18, 0x18, 0x18, 0x18, 0x3C, # 1
+    0x3E, 0x7F, 0xC3, 0x06, 0x0C, 0x18, 0x30, 0x60, 0xFF, 0xFF, # 2
+    0x3C, 0x7E, 0xC3, 0x03, 0x0E, 0x0E, 0x03, 0xC3, 0x7E, 0x3C, # 3
+    0x06, 0x0E, 0x1E, 0x36, 0x66, 0xC6, 0xFF, 0xFF, 0x06, 0x06, # 4
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFC, 0xFE, 0x03, 0xC3, 0x7E, 0x3C, # 5
+    0x3E, 0x7C, 0xE0, 0xC0, 0xFC, 0xFE, 0xC3, 0xC3, 0x7E, 0x3C, # 6
+    0xFF, 0xFF, 0x03, 0x06, 0x0C, 0x18, 0x30, 0x60, 0x60, 0x60, # 7
+    0x3C, 0x7E, 0xC3, 0xC3, 0x7E, 0x7E, 0xC3, 0xC3, 0x7E, 0x3C, # 8
+    0x3C, 0x7E, 0xC3, 0xC3, 0x7F, 0x3F, 0x03, 0x03, 0x3E, 0x7C, # 9
+    0x7E, 0xFF, 0xC3, 0xC3, 0xC3, 0xFF, 0xFF, 0xC3, 0xC3, 0xC3, # A
+    0xFC, 0xFC, 0xC3, 0xC3, 0xFC, 0xFC, 0xC3, 0xC3, 0xFC, 0xFC, # B
+    0x3C, 0xFF, 0xC3, 0xC0, 0xC0, 0xC0, 0xC0, 0xC3, 0xFF, 0x3C, # C
+    0xFC, 0xFE, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xFE, 0xFC, # D
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, # E
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC0, 0xC0, 0xC0, 0xC0  # F
+]
+
+# Fonts each instruction set keeps in memory, as (address, bytes)
+FONT_LAYOUTS = {
+    INSTRUCTIONS_CHIP8: ((FONTSET_START_ADDRESS, bytes(fontset)),),
+    INSTRUCTIONS_SCHIP: ((FONTSET_START_ADDRESS, bytes(fontset)), (BIG_FONTSET_START_ADDRESS, bytes(big_fontset))),
+    INSTRUCTIONS_XOCHIP: ((FONTSET_START_ADDRESS, bytes(fontset)), (BIG_FONTSET_START_ADDRESS, bytes(big_fontset))),
+}
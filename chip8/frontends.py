@@ -0,0 +1,88 @@
+import importlib
+import time
+
+from chip8.core import FRAME_TIME
+
+DEFAULT_FRONTEND = "pygame"
+
+# Keypad keys in the order they are laid out, four rows of four
+# 1 2 3 C
+# 4 5 6 D
+# 7 8 9 E
+# A 0 B F
+KEYPAD_LAYOUT = (
+    0x1, 0x2, 0x3, 0xC,
+    0x4, 0x5, 0x6, 0xD,
+    0x7, 0x8, 0x9, 0xE,
+    0xA, 0x0, 0xB, 0xF,
+)
+# Keyboard keys for KEYPAD_LAYOUT, the keypad sits on the left of the keyboard
+DEFAULT_KEYS = "1234qwerasdfzxcv"
+
+# Frontends by name, as (module, class) so the libraries a frontend needs are
+# only imported once it is picked
+# A frontend is created with the machine, a scale and key bindings (see
+# parse_bindings, None for the defaults) and provides:
+#   present(chip8)  shows the rows that changed, called by the scheduler after every frame
+#   poll(chip8)     applies pending input to chip8.keypad, returns False once the user quits
+#   wait()          blocks until there is input, returns False if none can ever come
+#   close()         gives back the window or terminal
+FRONTENDS = {
+    "pygame": ("chip8.pygame_frontend", "PygameFrontend"),
+    "terminal": ("chip8.terminal_frontend", "TerminalFrontend"),
+    "null": ("chip8.frontends", "NullFrontend"),
+}
+
+
+# Adds a frontend that lives outside this package
+def register_frontend(name, module, class_name):
+    FRONTENDS[name] = (module, class_name)
+
+
+# Returns the keypad key for each keyboard key name in keys, given in the order
+# of KEYPAD_LAYOUT, either as 16 single characters ("1234qwerasdfzxcv") or as
+# 16 comma separated names ("up,down,...") for keys without a character
+# Frontends turn the names into their own key codes once, when they start
+def parse_bindings(keys=DEFAULT_KEYS):
+    names = keys.split(",") if "," in keys else list(keys)
+    names = [name.strip().lower() for name in names]
+    if len(names) != len(KEYPAD_LAYOUT) or not all(names):
+        raise ValueError(f"Key bindings need {len(KEYPAD_LAYOUT)} keys, got {keys!r}")
+    if len(set(names)) != len(names):
+        raise ValueError(f"Key bindings use a key twice: {keys!r}")
+    return dict(zip(names, KEYPAD_LAYOUT))
+
+
+DEFAULT_BINDINGS = parse_bindings()
+
+
+# Imports a frontend and returns its class
+def load_frontend(name):
+    if name not in FRONTENDS:
+        raise ValueError(f"Unknown frontend: {name}")
+    module, class_name = FRONTENDS[name]
+    return getattr(importlib.import_module(module), class_name)
+
+
+# Shows nothing and reads no input, the rom runs in real time until it halts or
+# waits for a key that will never come
+class NullFrontend():
+    def __init__(self, chip8, scale=None, bindings=None):
+        pass
+
+    def present(self, chip8):
+        chip8.dirty_rows = 0
+
+    def poll(self, chip8):
+        return not chip8.halted
+
+    def wait(self):
+        return False
+
+    def close(self):
+        pass
+
+
+# Sleeps out the rest of a frame, for frontends without a way to block on input
+def sleep_frame():
+    time.sleep(FRAME_TIME)
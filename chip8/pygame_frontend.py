@@ -0,0 +1,66 @@
+import pygame
+
+from chip8.core import DISPLAY_HEIGHT, DISPLAY_WIDTH
+from chip8.frontends import DEFAULT_BINDINGS
+from chip8.renderer import SurfaceRenderer
+
+DEFAULT_SCALE = 10
+
+
+
+# Keypad keys by pygame key code for bindings from chip8.frontends.parse_bindings,
+# built once when the frontend starts (pygame only knows the key names after
+# pygame.init) so an event is a single dict lookup
+def key_table(bindings):
+    table = {}
+    for name, key in bindings.items():
+        try:
+            table[pygame.key.key_code(name)] = key
+        except ValueError:
+            raise ValueError(f"Unknown key name for pygame: {name}") from None
+    return table
+
+
+# A window drawn through chip8.renderer.SurfaceRenderer, with keyboard input
+class PygameFrontend():
+    def __init__(self, chip8, scale=None, bindings=None):
+        scale = scale or DEFAULT_SCALE
+        pygame.init()
+        try:
+            self.key_map = key_table(bindings or DEFAULT_BINDINGS)
+        except ValueError:
+            # The caller reports the error and never gets a frontend to close
+            pygame.quit()
+            raise
+        screen = pygame.display.set_mode((DISPLAY_WIDTH * scale, DISPLAY_HEIGHT * scale))
+        pygame.display.set_caption("CHIP-8 Emulator")
+        self.renderer = SurfaceRenderer(screen)
+        self.present = self.renderer.present
+        self.present(chip8)
+
+    def poll(self, chip8):
+        running = True
+        key_map = self.key_map
+        keypad = chip8.keypad
+        for event in pygame.event.get():
+            if event.type == pygame.KEYDOWN:
+                key = key_map.get(event.key)
+                if key is not None:
+                    keypad[key] = 1
+                elif event.key == pygame.K_ESCAPE:
+                    running = False
+            elif event.type == pygame.KEYUP:
+                key = key_map.get(event.key)
+                if key is not None:
+                    keypad[key] = 0
+            elif event.type == pygame.QUIT:
+                running = False
+        return running
+
+    # Sleeps until the next event and puts it back for poll
+    def wait(self):
+        pygame.event.post(pygame.event.wait())
+        return True
+
+    def close(self):
+        pygame.quit()
@@ -0,0 +1,82 @@
+import pygame
+
+from chip8.core import DISPLAY_HEIGHT, DISPLAY_WIDTH
+
+# The 8 palette indices (0 or 1) for every possible byte of a display row
+BYTE_PIXELS = [bytes((value >> (7 - bit)) & 1 for bit in range(8)) for value in range(256)]
+
+# Colours of the second XO-CHIP bitplane and of pixels set in both planes
+PLANE2_COLOUR = (255, 85, 0)
+BOTH_PLANES_COLOUR = (255, 170, 0)
+
+
+# Expands a packed display row into one palette index byte per pixel
+def row_pixels(row, width=DISPLAY_WIDTH):
+    return b"".join(BYTE_PIXELS[(row >> shift) & 0xFF] for shift in range(width - 8, -1, -8))
+
+
+# Like row_pixels, with a pixel of the second bitplane adding 2 to the palette index
+# Every byte is 0 or 1, so shifting the second row as one big int never carries into the next pixel
+def plane_pixels(row, row2, width=DISPLAY_WIDTH):
+    pixels = int.from_bytes(row_pixels(row, width), "big") | (int.from_bytes(row_pixels(row2, width), "big") << 1)
+    return pixels.to_bytes(width, "big")
+
+
+# Draws the display through a palette surface the size of the machine's resolution,
+# scaled to the window in a single blit, only the rows that changed are uploaded to the surface
+class SurfaceRenderer():
+    def __init__(self, screen, foreground=(255, 255, 255), background=(0, 0, 0)):
+        self.screen = screen
+        self.palette = [background, foreground, PLANE2_COLOUR, BOTH_PLANES_COLOUR]
+        self.scaled = pygame.Surface(screen.get_size(), 0, 8)
+        self.scaled.set_palette(self.palette)
+        self.resize(DISPLAY_WIDTH, DISPLAY_HEIGHT)
+
+    # Makes a new surface for a resolution, everything has to be drawn again
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+        self.surface = pygame.Surface((width, height), 0, 8)
+        self.surface.set_palette(self.palette)
+        self.row_height = self.screen.get_height() / height
+        self.first_frame = True
+
+    # Uploads the dirty rows of chip8.display and shows them, does nothing if no rows changed
+    def present(self, chip8):
+        if chip8.width != self.width:
+            self.resize(chip8.width, chip8.height)
+        dirty = chip8.dirty_rows
+        if self.first_frame:
+            dirty = (1 << self.height) - 1
+            self.first_frame = False
+        if not dirty:
+            return
+        chip8.dirty_rows = 0
+
+        width = self.width
+        pitch = self.surface.get_pitch()
+        buffer = self.surface.get_buffer()
+        display = chip8.display
+        plane2 = chip8.plane2
+        top = None
+        bottom = 0
+        for y in range(self.height):
+            if dirty >> y & 1:
+                if plane2 is None:
+                    pixels = row_pixels(display[y], width)
+                else:
+                    pixels = plane_pixels(display[y], plane2[y], width)
+                buffer.write(pixels, y * pitch)
+                if top is None:
+                    top = y
+                bottom = y
+        # Release the surface lock taken by get_buffer
+        del buffer
+
+        pygame.transform.scale(self.surface, self.scaled.get_size(), self.scaled)
+        self.screen.blit(self.scaled, (0, 0))
+
+        # Only push the band of rows that changed to the window
+        top_pixel = int(top * self.row_height)
+        bottom_pixel = int((bottom + 1) * self.row_height)
+        pygame.display.update((0, top_pixel, self.screen.get_width(), bottom_pixel - top_pixel))
@@ -0,0 +1,111 @@
+import hashlib
+import os
+
+# Largest rom any machine can hold, 64 KB of XO-CHIP memory less the interpreter area
+MAX_ROM_SIZE = 0x10000 - 0x200
+# Number of distinct roms kept before the oldest are dropped
+DEFAULT_MAX_ROMS = 256
+
+
+# One rom file as read from disk, shared by every machine that loads it
+class CachedRom():
+    def __init__(self, data, digest):
+        self.data = data
+        self.size = len(data)
+        # SHA-1 of the contents, as bytes and as hex
+        self.digest = digest
+        self.rom_hash = digest.hex()
+        # Whole memory images with the rom and fonts in place, by layout
+        self.images = {}
+
+    # Returns an immutable memory image with the fonts and the rom at start,
+    # built the first time a machine with this layout asks for it
+    # fonts is a tuple of (address, bytes) so it can be part of the key
+    def image(self, memory_size, start, fonts=()):
+        key = (memory_size, start, fonts)
+        image = self.images.get(key)
+        if image is None:
+            if start + self.size > memory_size:
+                raise ValueError(f"ROM is too large: {self.size} bytes")
+            memory = bytearray(memory_size)
+            for address, font in fonts:
+                memory[address:address + len(font)] = font
+            memory[start:start + self.size] = self.data
+            image = self.images[key] = bytes(memory)
+        return image
+
+
+# Roms by path and by content, so loading the same rom again costs a stat call
+# and one copy of the memory image into the machine
+# A file that changed on disk (size or modification time) is read again, files
+# with the same contents share one CachedRom
+class RomCache():
+    def __init__(self, max_roms=DEFAULT_MAX_ROMS):
+        self.max_roms = max_roms
+        # CachedRoms by (real path, size, modification time)
+        self.paths = {}
+        # CachedRoms by SHA-1 of their contents, oldest first
+        self.roms = {}
+        self.hits = 0
+        self.misses = 0
+
+    # Returns the CachedRom for a file, reading it the first time
+    def load(self, path):
+        stat = os.stat(path)
+        key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+        rom = self.paths.get(key)
+        if rom is not None:
+            self.hits += 1
+            return rom
+        self.misses += 1
+        # Checked before anything is read, a huge file is never loaded
+        if stat.st_size > MAX_ROM_SIZE:
+            raise ValueError(f"ROM is too large: {stat.st_size} bytes")
+        with open(path, "rb") as f:
+            data = f.read()
+        rom = self.add(data)
+        self.paths[key] = rom
+        return rom
+
+    # Returns the CachedRom for rom contents that did not come from a file
+    def load_bytes(self, data):
+        data = bytes(data)
+        if len(data) > MAX_ROM_SIZE:
+            raise ValueError(f"ROM is too large: {len(data)} bytes")
+        return self.add(data)
+
+    def add(self, data):
+        digest = hashlib.sha1(data).digest()
+        rom = self.roms.get(digest)
+        if rom is None:
+            rom = self.roms[digest] = CachedRom(data, digest)
+            while len(self.roms) > self.max_roms:
+                self.evict(next(iter(self.roms)))
+        return rom
+
+    # Drops a rom and the paths that lead to it
+    def evict(self, digest):
+        rom = self.roms.pop(digest)
+        for key in [key for key, cached in self.paths.items() if cached is rom]:
+            del self.paths[key]
+
+    def clear(self):
+        self.paths.clear()
+        self.roms.clear()
+
+    # Bytes held by the cached roms and their memory images
+    def memory_usage(self):
+        return sum(rom.size + sum(len(image) for image in rom.images.values()) for rom in self.roms.values())
+
+    def stats(self):
+        return {
+            "roms": len(self.roms),
+            "paths": len(self.paths),
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory": self.memory_usage(),
+        }
+
+
+# Shared by every Chip8 in the process
+rom_cache = RomCache()
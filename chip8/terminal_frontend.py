@@ -0,0 +1,130 @@
+import os
+import sys
+import time
+
+try:
+    import select
+    import termios
+    import tty
+except ImportError:
+    # Windows consoles are read through msvcrt instead
+    termios = None
+    import msvcrt
+
+from chip8.frontends import DEFAULT_BINDINGS, sleep_frame
+
+# Characters for key names that are not a single character
+KEY_CHARACTERS = {"space": " ", "tab": "\t", "return": "\n"}
+ESCAPE = "\x1b"
+# Terminals only report key presses, a key counts as held for this many seconds
+# after it was last seen, which covers the gap before the keyboard's auto-repeat
+# Kept in time rather than polls, the scheduler may poll several times a frame
+KEY_HOLD_TIME = 0.5
+
+# One character shows two display rows, the upper and lower pixel
+HALF_BLOCKS = (" ", "▄", "▀", "█")
+
+
+# Keypad keys by typed character for bindings from chip8.frontends.parse_bindings
+def key_table(bindings):
+    table = {}
+    for name, key in bindings.items():
+        char = name if len(name) == 1 else KEY_CHARACTERS.get(name)
+        if char is None:
+            raise ValueError(f"The terminal can only bind keys that type a character, not {name}")
+        table[char] = key
+    return table
+
+
+# Draws the display with half block characters and ANSI cursor movement, only
+# the lines holding rows that changed are written
+class TerminalFrontend():
+    def __init__(self, chip8, scale=None, bindings=None):
+        self.key_map = key_table(bindings or DEFAULT_BINDINGS)
+        self.out = sys.stdout
+        self.width = None
+        self.height = None
+        # Time each key is let go, 0 for keys not held
+        self.held = [0] * 16
+        self.settings = None
+        if termios is not None and sys.stdin.isatty():
+            self.settings = termios.tcgetattr(sys.stdin)
+            tty.setcbreak(sys.stdin)
+        # Hide the cursor
+        self.out.write("\x1b[?25l")
+        self.present(chip8)
+
+    def present(self, chip8):
+        dirty = chip8.dirty_rows
+        if chip8.width != self.width:
+            self.width = chip8.width
+            self.height = chip8.height
+            # Clear the screen and draw every row
+            self.out.write("\x1b[2J")
+            dirty = (1 << chip8.height) - 1
+        if not dirty:
+            return
+        chip8.dirty_rows = 0
+        rows = chip8.display
+        if chip8.plane2 is not None:
+            rows = [row | row2 for row, row2 in zip(rows, chip8.plane2)]
+        lines = []
+        for y in range(0, chip8.height, 2):
+            if dirty >> y & 3:
+                upper = rows[y]
+                lower = rows[y + 1]
+                text = "".join(HALF_BLOCKS[(upper >> shift & 1) << 1 | (lower >> shift & 1)]
+                               for shift in range(self.width - 1, -1, -1))
+                lines.append(f"\x1b[{y // 2 + 1};1H{text}")
+        self.out.write("".join(lines))
+        self.out.flush()
+
+    # Presses the keys typed since the last poll and lets go of keys that were
+    # not seen for KEY_HOLD_TIME seconds
+    def poll(self, chip8):
+        keypad = chip8.keypad
+        now = time.perf_counter()
+        for key in range(16):
+            if self.held[key] and self.held[key] <= now:
+                self.held[key] = 0
+                keypad[key] = 0
+        typed = self.read()
+        # A lone escape, not the start of an escape sequence
+        if typed == ESCAPE:
+            return False
+        key_map = self.key_map
+        for char in typed.lower():
+            key = key_map.get(char)
+            if key is not None:
+                keypad[key] = 1
+                self.held[key] = now + KEY_HOLD_TIME
+        return True
+
+    # Returns whatever was typed, without blocking
+    def read(self):
+        if termios is None:
+            typed = []
+            while msvcrt.kbhit():
+                typed.append(msvcrt.getwch())
+            return "".join(typed)
+        if not select.select([sys.stdin], [], [], 0)[0]:
+            return ""
+        return os.read(sys.stdin.fileno(), 64).decode(errors="ignore")
+
+    def wait(self):
+        if termios is None:
+            while not msvcrt.kbhit():
+                sleep_frame()
+        elif self.settings is None:
+            # Input piped in has been read by now
+            return False
+        else:
+            select.select([sys.stdin], [], [])
+        return True
+
+    def close(self):
+        if self.settings is not None:
+            termios.tcsetattr(sys.stdin, termios.TCSADRAIN, self.settings)
+        # Show the cursor again below the display
+        self.out.write(f"\x1b[{self.height // 2 + 1};1H\x1b[?25h\n")
+        self.out.flush()
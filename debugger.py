@@ -0,0 +1,457 @@
+import argparse
+import sys
+
+from chip8 import DEFAULT_QUIRKS, QUIRK_PROFILES, Chip8, decode_entry
+from headless import create_machine
+from quirks import AUTO_QUIRKS, resolve_profile
+from scheduler import DEFAULT_CPU_HZ, frame_budget
+
+# Why Debugger.run returned early, see Stop
+STOP_BREAKPOINT = "breakpoint"
+STOP_WATCHPOINT = "watchpoint"
+STOP_REGISTER = "register"
+STOP_STEP = "step"
+STOP_HALT = "halt"
+
+# Memory accesses a watchpoint can catch
+WATCH_READ = 1
+WATCH_WRITE = 2
+WATCH_ACCESS = WATCH_READ | WATCH_WRITE
+
+# Bits of the per-address trap map
+# A breakpoint on the instruction
+TRAP_BREAK = 1
+# The return address of a step over, only stops at the stack depth of the call
+TRAP_RETURN = 2
+# The instruction after one that hit a watchpoint
+TRAP_WATCH = 4
+
+# Watchpoints are kept in lists by 256 byte page, an access only looks at the
+# watchpoints of the pages it touches
+PAGE_SHIFT = 8
+
+# Memory touched by each handler, as (kind, bytes from I for the operands)
+ACCESSES = {
+    Chip8.OP_Dxyn: (WATCH_READ, lambda chip8, x, y, n: n),
+    Chip8.OP_Dxyn_clip: (WATCH_READ, lambda chip8, x, y, n: n),
+    # 16x16 sprites are 32 bytes, drawn once for every selected bitplane
+    Chip8.OP_Dxyn_hires: (WATCH_READ, lambda chip8, x, y, n: (n or 32) * bin(chip8.planes).count("1")),
+    Chip8.OP_Dxyn_hires_clip: (WATCH_READ, lambda chip8, x, y, n: (n or 32) * bin(chip8.planes).count("1")),
+    Chip8.OP_Fx33: (WATCH_WRITE, lambda chip8, x: 3),
+    Chip8.OP_Fx55: (WATCH_WRITE, lambda chip8, x: x + 1),
+    Chip8.OP_Fx55_increment: (WATCH_WRITE, lambda chip8, x: x + 1),
+    Chip8.OP_Fx55_increment_x: (WATCH_WRITE, lambda chip8, x: x + 1),
+    Chip8.OP_Fx65: (WATCH_READ, lambda chip8, x: x + 1),
+    Chip8.OP_Fx65_increment: (WATCH_READ, lambda chip8, x: x + 1),
+    Chip8.OP_Fx65_increment_x: (WATCH_READ, lambda chip8, x: x + 1),
+    Chip8.OP_5xy2: (WATCH_WRITE, lambda chip8, x, y: abs(x - y) + 1),
+    Chip8.OP_5xy3: (WATCH_READ, lambda chip8, x, y: abs(x - y) + 1),
+    Chip8.OP_F002: (WATCH_READ, lambda chip8: 16),
+}
+
+# Every opcode that may decode to one of ACCESSES, depending on the quirk profile
+MEMORY_OPCODES = (
+    [0xD000 | low for low in range(0x1000)]
+    + [0x5000 | (xy << 4) | n for xy in range(0x100) for n in (2, 3)]
+    + [0xF000 | (x << 8) | kk for x in range(16) for kk in (0x33, 0x55, 0x65)]
+    + [0xF002]
+)
+
+
+# Stops on any matching access to memory from start up to, not including, end
+class Watchpoint():
+    def __init__(self, start, end, kind=WATCH_WRITE):
+        if end <= start:
+            raise ValueError(f"Empty watchpoint range: {start:#x}-{end:#x}")
+        self.start = start
+        self.end = end
+        self.kind = kind
+        self.hits = 0
+
+    def __repr__(self):
+        kind = {WATCH_READ: "r", WATCH_WRITE: "w", WATCH_ACCESS: "rw"}[self.kind]
+        return f"Watchpoint({self.start:#05x}-{self.end - 1:#05x}, {kind})"
+
+
+# One access that hit watchpoints, made by the instruction at pc
+# old and new are the bytes from start to end before and after the instruction
+class WatchHit():
+    def __init__(self, pc, kind, start, end, watchpoints, old, new):
+        self.pc = pc
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.watchpoints = watchpoints
+        self.old = old
+        self.new = new
+
+
+# Where and why Debugger.run returned before running all of its cycles
+# pc is the next instruction to run, except for STOP_REGISTER and STOP_HALT where
+# it is the instruction that changed the register or halted the machine
+# detail is the WatchHit of a watchpoint and the register number of a register stop
+class Stop():
+    def __init__(self, reason, pc, detail=None):
+        self.reason = reason
+        self.pc = pc
+        self.detail = detail
+
+    def describe(self):
+        if self.reason == STOP_WATCHPOINT:
+            hit = self.detail
+            action = "write" if hit.kind == WATCH_WRITE else "read"
+            text = f"{action} of {hit.start:#05x}-{hit.end - 1:#05x} at {hit.pc:#05x}"
+            if hit.old != hit.new:
+                text += f": {hit.old.hex()} -> {hit.new.hex()}"
+            return f"watchpoint, {text}"
+        if self.reason == STOP_REGISTER:
+            return f"register V{self.detail:X} changed at {self.pc:#05x}"
+        return f"{self.reason} at {self.pc:#05x}"
+
+
+# Breakpoints, memory watchpoints and register conditions for one machine
+# Debugger.run has the same contract as Chip8.run and is passed as the engine to
+# a Scheduler, or called directly, stopping early and setting stop when something
+# is hit
+# The run loop only looks up the current address in a trap map, one byte per
+# address of memory, so breakpoints cost the same however many there are
+# Watchpoints are checked by wrappers bound into a copy of the decode table in
+# place of the handlers that touch memory, every other instruction runs as usual
+# The machine's own decode table is left alone, so Cycle never sees the wrappers
+# With nothing set, run is Chip8.run
+class Debugger():
+    def __init__(self, chip8):
+        self.chip8 = chip8
+        self.traps = bytearray(len(chip8.memory))
+        self.breakpoints = set()
+        # Stack pointer to stop at, by return address of a step over
+        self.returns = {}
+        self.watchpoints = []
+        self.pages = [[] for _ in range((len(chip8.memory) >> PAGE_SHIFT) + 1)]
+        # Watched register numbers, with the value to stop at or None for any change
+        self.register_conditions = {}
+        self.last_registers = bytearray(chip8.registers)
+        # Decode table with the watch wrappers, made with the first watchpoint
+        self.watch_table = None
+        # The WatchHit waiting for the TRAP_WATCH set after it
+        self.pending = None
+        self.stop = None
+        # Instructions run through the debugger
+        self.cycles = 0
+
+    def add_breakpoint(self, address):
+        self.breakpoints.add(address)
+        self.traps[address] |= TRAP_BREAK
+
+    def remove_breakpoint(self, address):
+        self.breakpoints.discard(address)
+        self.traps[address] &= ~TRAP_BREAK
+
+    def add_watchpoint(self, start, end=None, kind=WATCH_WRITE):
+        watchpoint = Watchpoint(start, start + 1 if end is None else end, kind)
+        self.watchpoints.append(watchpoint)
+        for page in self.watched_pages(watchpoint.start, watchpoint.end):
+            self.pages[page].append(watchpoint)
+        if self.watch_table is None:
+            self.watch_table = self.build_watch_table()
+        return watchpoint
+
+    def remove_watchpoint(self, watchpoint):
+        self.watchpoints.remove(watchpoint)
+        for page in self.watched_pages(watchpoint.start, watchpoint.end):
+            self.pages[page].remove(watchpoint)
+
+    # Stops after an instruction changes register Vx, or only when it becomes value
+    def watch_register(self, register, value=None):
+        self.register_conditions[register] = value
+        self.last_registers[register] = self.chip8.registers[register]
+
+    def unwatch_register(self, register):
+        self.register_conditions.pop(register, None)
+
+    # Pages of the page lists covering start to end, clamped to the memory
+    def watched_pages(self, start, end):
+        return range(start >> PAGE_SHIFT, min((end - 1) >> PAGE_SHIFT, len(self.pages) - 1) + 1)
+
+    # A copy of the machine's decode table with every memory access wrapped
+    # The opcodes are decoded here, so none of them can run unwrapped through Chip8.op_decode
+    def build_watch_table(self):
+        decode_table = self.chip8.decode_table
+        watch_table = list(decode_table)
+        for opcode in MEMORY_OPCODES:
+            handler, operands = decode_entry(decode_table, opcode)
+            if handler in ACCESSES:
+                watch_table[opcode] = (self.watched, (handler, operands) + ACCESSES[handler])
+        return watch_table
+
+    # Runs a handler that touches memory, recording a WatchHit if the access
+    # overlaps any watchpoint
+    # The hit is reported by trapping the next instruction, so the run loop has no
+    # check of its own
+    def watched(self, chip8, handler, operands, kind, length):
+        start = chip8.index
+        end = start + length(chip8, *operands)
+        pages = self.pages
+        page = start >> PAGE_SHIFT
+        # Most accesses stay within one page without watchpoints
+        if page == (end - 1) >> PAGE_SHIFT and page < len(pages) and not pages[page]:
+            handler(chip8, *operands)
+            return
+        watchpoints = None
+        if end > start:
+            for page in self.watched_pages(start, end):
+                for watchpoint in self.pages[page]:
+                    if watchpoint.kind & kind and watchpoint.start < end and start < watchpoint.end:
+                        if watchpoints is None:
+                            watchpoints = []
+                        if watchpoint not in watchpoints:
+                            watchpoints.append(watchpoint)
+        if watchpoints is None:
+            handler(chip8, *operands)
+            return
+
+        old = bytes(chip8.memory[start:end])
+        handler(chip8, *operands)
+        for watchpoint in watchpoints:
+            watchpoint.hits += 1
+        self.pending = WatchHit(chip8.pc - 2, kind, start, end, watchpoints, old, bytes(chip8.memory[start:end]))
+        if chip8.pc < len(self.traps):
+            self.traps[chip8.pc] |= TRAP_WATCH
+
+    def active(self):
+        return bool(self.breakpoints or self.returns or self.watchpoints or self.register_conditions
+                    or self.pending is not None)
+
+    # Runs up to the given number of cycles, same contract as Chip8.run
+    # Returns early when something is hit, with the reason in stop
+    # The breakpoint the last run stopped at is not hit again when running on from it
+    # The fetch and dispatch mirror Chip8.Cycle
+    def run(self, cycles):
+        chip8 = self.chip8
+        if not self.active():
+            self.stop = None
+            executed = chip8.run(cycles)
+            self.cycles += executed
+            return executed
+        if chip8.halted:
+            return 0
+        resume = self.stop is not None and self.stop.pc == chip8.pc
+        self.stop = None
+        traps = self.traps
+        memory = chip8.memory
+        decode_table = self.watch_table if self.watchpoints else chip8.decode_table
+        conditions = self.register_conditions
+        if conditions:
+            self.last_registers[:] = chip8.registers
+
+        executed = 0
+        while executed < cycles:
+            pc = chip8.pc
+            if traps[pc] and self.trap(pc, resume and not executed):
+                break
+            opcode = (memory[pc] << 8) | memory[pc + 1]
+            chip8.opcode = opcode
+            chip8.pc = pc + 2
+            handler, operands = decode_table[opcode]
+            handler(chip8, *operands)
+            executed += 1
+            if conditions and self.check_registers(pc):
+                break
+            if chip8.halted:
+                self.stop = Stop(STOP_HALT, pc)
+                break
+        self.cycles += executed
+        return executed
+
+    # Decides whether a flagged address stops the run, setting stop if it does
+    def trap(self, pc, resume):
+        traps = self.traps
+        if traps[pc] & TRAP_WATCH:
+            traps[pc] &= ~TRAP_WATCH
+            if self.pending is not None:
+                self.stop = Stop(STOP_WATCHPOINT, pc, self.pending)
+                self.pending = None
+                return True
+        if traps[pc] & TRAP_RETURN and self.returns[pc] == self.chip8.stack_pointer:
+            self.clear_return(pc)
+            self.stop = Stop(STOP_STEP, pc)
+            return True
+        if traps[pc] & TRAP_BREAK and not resume:
+            self.stop = Stop(STOP_BREAKPOINT, pc)
+            return True
+        return False
+
+    # Compares the watched registers with their values after the last instruction
+    def check_registers(self, pc):
+        registers = self.chip8.registers
+        last = self.last_registers
+        changed = None
+        for register, value in self.register_conditions.items():
+            current = registers[register]
+            if current != last[register]:
+                last[register] = current
+                if changed is None and (value is None or current == value):
+                    changed = register
+        if changed is None:
+            return False
+        self.stop = Stop(STOP_REGISTER, pc, changed)
+        return True
+
+    def clear_return(self, pc):
+        del self.returns[pc]
+        self.traps[pc] &= ~TRAP_RETURN
+
+    # Runs one instruction, hitting watchpoints and register conditions but not
+    # the breakpoint it starts on
+    def step(self):
+        pc = self.chip8.pc
+        self.stop = Stop(STOP_STEP, pc)
+        if self.run(1) and self.stop is None:
+            self.stop = Stop(STOP_STEP, self.chip8.pc)
+        return self.stop
+
+    # Like step, but runs a whole subroutine when the instruction is a call,
+    # stopping when it returns to the same stack depth or anything else is hit
+    def step_over(self, limit=1000000):
+        chip8 = self.chip8
+        pc = chip8.pc
+        opcode = (chip8.memory[pc] << 8) | chip8.memory[pc + 1]
+        if decode_entry(chip8.decode_table, opcode)[0] is not Chip8.OP_2NNN:
+            return self.step()
+        return_address = pc + 2
+        self.returns[return_address] = chip8.stack_pointer
+        self.traps[return_address] |= TRAP_RETURN
+        self.stop = Stop(STOP_STEP, pc)
+        try:
+            self.run(limit)
+        finally:
+            if return_address in self.returns:
+                self.clear_return(return_address)
+        return self.stop
+
+
+def parse_address(text):
+    return int(text, 16)
+
+
+# START[-END][:r|w|rw], END is inclusive as in the listings
+def parse_watch(text):
+    text, _, kind = text.partition(":")
+    start, _, end = text.partition("-")
+    start = parse_address(start)
+    end = parse_address(end) + 1 if end else start + 1
+    kinds = {"": WATCH_WRITE, "r": WATCH_READ, "w": WATCH_WRITE, "rw": WATCH_ACCESS}
+    if kind not in kinds:
+        raise argparse.ArgumentTypeError(f"watch kind must be r, w or rw, not {kind}")
+    return start, end, kinds[kind]
+
+
+def state_text(chip8):
+    opcode = (chip8.memory[chip8.pc] << 8) | chip8.memory[chip8.pc + 1]
+    registers = " ".join(f"V{i:X}={v:02X}" for i, v in enumerate(chip8.registers))
+    return f"  pc={chip8.pc:#05x} [{opcode:04X}] I={chip8.index:#05x} sp={chip8.stack_pointer}\n  {registers}"
+
+
+COMMANDS_HELP = ("c continue, s step, n step over, r registers, b ADDR break, d ADDR delete break, "
+                 "w START[-END][:rw] watch, q quit")
+
+
+# Reads commands until one of them runs the machine
+# Returns "continue", "step", "next" or "quit"
+def prompt(debugger):
+    while True:
+        try:
+            line = input("(chip8) ").split()
+        except EOFError:
+            return "quit"
+        if not line:
+            continue
+        command, arguments = line[0], line[1:]
+        try:
+            if command in ("c", "continue"):
+                return "continue"
+            if command in ("s", "step"):
+                return "step"
+            if command in ("n", "next"):
+                return "next"
+            if command in ("q", "quit"):
+                return "quit"
+            if command in ("b", "break"):
+                debugger.add_breakpoint(parse_address(arguments[0]))
+            elif command in ("d", "delete"):
+                debugger.remove_breakpoint(parse_address(arguments[0]))
+            elif command in ("w", "watch"):
+                print(debugger.add_watchpoint(*parse_watch(arguments[0])))
+            elif command in ("r", "registers"):
+                print(state_text(debugger.chip8))
+            else:
+                print(COMMANDS_HELP)
+        except (IndexError, ValueError, argparse.ArgumentTypeError) as error:
+            print(f"error: {error}" if str(error) else COMMANDS_HELP)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a CHIP-8 rom with breakpoints and watchpoints")
+    parser.add_argument("rom", help="path to the rom file")
+    parser.add_argument("-n", "--cycles", type=int, default=100000,
+                        help="maximum number of cycles to execute")
+    parser.add_argument("--hz", type=int, default=DEFAULT_CPU_HZ,
+                        help="instructions executed per second of emulated time")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for the random number generator (random by default)")
+    parser.add_argument("--quirks", default=DEFAULT_QUIRKS, choices=sorted(QUIRK_PROFILES) + [AUTO_QUIRKS],
+                        help="quirk profile, auto picks one for the rom")
+    parser.add_argument("--quirks-db", metavar="PATH",
+                        help="JSON file of {\"sha1\": \"profile\"} entries for --quirks auto")
+    parser.add_argument("-b", "--break", dest="breakpoints", metavar="ADDR", type=parse_address,
+                        action="append", default=[], help="stop before the instruction at ADDR (hex)")
+    parser.add_argument("-w", "--watch", metavar="START[-END][:r|w|rw]", type=parse_watch, action="append",
+                        default=[], help="stop after an access to memory (hex, writes by default)")
+    parser.add_argument("-r", "--register", metavar="X[=VALUE]", action="append", default=[],
+                        help="stop after VX changes, or becomes VALUE (hex)")
+    parser.add_argument("-i", "--interactive", action="store_true",
+                        help="ask what to do at every stop instead of printing it and running on")
+    args = parser.parse_args(argv)
+
+    chip8 = create_machine(args.rom, args.seed, resolve_profile(args.quirks, args.rom, args.quirks_db))
+    debugger = Debugger(chip8)
+    for address in args.breakpoints:
+        debugger.add_breakpoint(address)
+    for start, end, kind in args.watch:
+        debugger.add_watchpoint(start, end, kind)
+    for condition in args.register:
+        register, _, value = condition.partition("=")
+        debugger.watch_register(int(register, 16), int(value, 16) if value else None)
+
+    budget = frame_budget(args.hz)
+    # Instructions left before the timers tick
+    frame_left = budget
+    action = prompt(debugger) if args.interactive else "continue"
+    while action != "quit" and debugger.cycles < args.cycles and not chip8.halted:
+        before = debugger.cycles
+        if action == "step":
+            debugger.step()
+        elif action == "next":
+            debugger.step_over(args.cycles - debugger.cycles)
+        else:
+            debugger.run(min(frame_left, args.cycles - debugger.cycles))
+        # A step over may run for many frames, the timers catch up afterwards
+        frame_left -= debugger.cycles - before
+        while frame_left <= 0:
+            chip8.update_timers()
+            frame_left += budget
+        if debugger.stop is None:
+            continue
+        print(f"{debugger.cycles}: {debugger.stop.describe()}")
+        print(state_text(chip8))
+        if args.interactive:
+            action = prompt(debugger)
+        else:
+            action = "continue"
+
+    print(f"cycles: {debugger.cycles}" + (" (halted)" if chip8.halted else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from headless import run_headless
+from chip8 import DEFAULT_QUIRKS
+from quirks import resolve_profile
+from scheduler import DEFAULT_CPU_HZ
+
+DEFAULT_CYCLES = 100000
+# Seed of every machine unless the manifest gives one, so roms using Cxkk end
+# with the same framebuffer on every run
+DEFAULT_SEED = 0
+
+# Outcomes of a single rom run
+PASS = "pass"
+FAIL = "fail"
+ERROR = "error"
+# The rom ran but the manifest has no expected hash to compare with
+NO_EXPECTATION = "unchecked"
+
+
+# A rom to run with its cycle budget and the framebuffer hash it should end with
+# quirks is a profile name or quirks.AUTO_QUIRKS, seed seeds the machine's Cxkk
+# quirks_db is the database file AUTO_QUIRKS looks the rom up in, set from the command line
+class Job():
+    def __init__(self, name, rom, cycles=DEFAULT_CYCLES, expected_hash=None,
+                 cpu_hz=DEFAULT_CPU_HZ, use_jit=False, quirks=DEFAULT_QUIRKS, seed=DEFAULT_SEED):
+        self.name = name
+        self.rom = rom
+        self.cycles = cycles
+        self.expected_hash = expected_hash
+        self.cpu_hz = cpu_hz
+        self.use_jit = use_jit
+        self.quirks = quirks
+        self.seed = seed
+        self.quirks_db = None
+
+    def to_dict(self):
+        # The seed is always written, the expected hash only holds for that seed
+        entry = {"name": self.name, "rom": self.rom, "cycles": self.cycles, "seed": self.seed}
+        if self.expected_hash is not None:
+            entry["expected_hash"] = self.expected_hash
+        if self.cpu_hz != DEFAULT_CPU_HZ:
+            entry["hz"] = self.cpu_hz
+        if self.quirks != DEFAULT_QUIRKS:
+            entry["quirks"] = self.quirks
+        return entry
+
+
+# Reads a JSON manifest, a list of {"rom", "cycles", "expected_hash", "hz", "quirks", "seed", "name"} entries
+# Rom paths are relative to the manifest
+def load_manifest(path):
+    with open(path) as f:
+        entries = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for entry in entries:
+        rom = os.path.join(base, entry["rom"])
+        jobs.append(Job(
+            entry.get("name", entry["rom"]),
+            rom,
+            entry.get("cycles", DEFAULT_CYCLES),
+            entry.get("expected_hash"),
+            entry.get("hz", DEFAULT_CPU_HZ),
+            quirks=entry.get("quirks", DEFAULT_QUIRKS),
+            seed=entry.get("seed", DEFAULT_SEED),
+        ))
+    return jobs
+
+
+# Writes the jobs back as a manifest relative to path
+def save_manifest(path, jobs):
+    base = os.path.dirname(os.path.abspath(path))
+    entries = []
+    for job in jobs:
+        entry = job.to_dict()
+        entry["rom"] = os.path.relpath(job.rom, base)
+        entries.append(entry)
+    with open(path, "w") as f:
+        json.dump(entries, f, indent=2)
+        f.write("\n")
+
+
+# One job for every .ch8 file under a directory, nothing to compare against
+def jobs_from_directory(directory, cycles):
+    jobs = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".ch8"):
+                path = os.path.join(root, name)
+                jobs.append(Job(os.path.relpath(path, directory), path, cycles))
+    return jobs
+
+
+# Runs one job in a worker process, returns a plain dict so it pickles cheaply
+# number is the position of the job in the corpus, results arrive out of order
+def run_job(job, number=0):
+    result = {
+        "number": number,
+        "name": job.name,
+        "rom": job.rom,
+        "expected_hash": job.expected_hash,
+    }
+    try:
+        quirks = resolve_profile(job.quirks, job.rom, job.quirks_db)
+        run = run_headless(job.rom, job.cycles, cpu_hz=job.cpu_hz, use_jit=job.use_jit,
+                           seed=job.seed, quirks=quirks)
+    except Exception as e:
+        result["status"] = ERROR
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+
+    actual = run.display_hash()
+    if job.expected_hash is None:
+        status = NO_EXPECTATION
+    elif actual == job.expected_hash:
+        status = PASS
+    else:
+        status = FAIL
+    result.update({
+        "status": status,
+        "display_hash": actual,
+        "cycles": run.cycles,
+        "halt_reason": run.halt_reason,
+        "elapsed": run.elapsed,
+        "cycles_per_second": run.cycles_per_second(),
+    })
+    return result
+
+
+# Fans the jobs out over a process pool and yields results as they finish
+def run_farm(jobs, workers=None):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_job, job, number) for number, job in enumerate(jobs)]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+# Totals over a list of results
+def summarize(results, wall_time):
+    counts = {PASS: 0, FAIL: 0, ERROR: 0, NO_EXPECTATION: 0}
+    total_cycles = 0
+    for result in results:
+        counts[result["status"]] += 1
+        total_cycles += result.get("cycles", 0)
+    return {
+        "roms": len(results),
+        "passed": counts[PASS],
+        "failed": counts[FAIL],
+        "errors": counts[ERROR],
+        "unchecked": counts[NO_EXPECTATION],
+        "total_cycles": total_cycles,
+        "wall_time": wall_time,
+        "cycles_per_second": total_cycles / wall_time if wall_time > 0 else 0.0,
+    }
+
+
+def format_result(result):
+    line = f"{result['status'].upper():<10}{result['name']}"
+    if result["status"] == ERROR:
+        return f"{line}  {result['error']}"
+    line += f"  {result['cycles']} cycles ({result['halt_reason']}), {result['cycles_per_second']:.0f} cycles/s"
+    if result["status"] == FAIL:
+        line += f"\n          expected {result['expected_hash']}\n          got      {result['display_hash']}"
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a corpus of CHIP-8 roms in parallel and check their final framebuffers")
+    parser.add_argument("source", help="JSON manifest, or a directory of .ch8 files")
+    parser.add_argument("-n", "--cycles", type=int, default=DEFAULT_CYCLES,
+                        help="cycle budget for roms found in a directory")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: one per core)")
+    parser.add_argument("--jit", action="store_true",
+                        help="run through the block translation cache")
+    parser.add_argument("--update", action="store_true",
+                        help="store the hashes of this run as the expected hashes in the manifest")
+    parser.add_argument("--json-out", help="write every result and the summary to this file")
+    parser.add_argument("--quirks-db", metavar="PATH",
+                        help="JSON file of {\"sha1\": \"profile\"} entries for jobs with \"quirks\": \"auto\"")
+    args = parser.parse_args(argv)
+
+    if os.path.isdir(args.source):
+        if args.update:
+            parser.error("--update needs a manifest")
+        jobs = jobs_from_directory(args.source, args.cycles)
+    else:
+        jobs = load_manifest(args.source)
+    for job in jobs:
+        job.use_jit = args.jit
+        job.quirks_db = args.quirks_db
+
+    start = time.perf_counter()
+    results = []
+    for result in run_farm(jobs, args.workers):
+        results.append(result)
+        print(format_result(result), flush=True)
+    summary = summarize(results, time.perf_counter() - start)
+
+    print(f"\n{summary['roms']} roms: {summary['passed']} passed, {summary['failed']} failed, "
+          f"{summary['errors']} errors, {summary['unchecked']} unchecked")
+    print(f"wall time {summary['wall_time']:.2f}s, {summary['cycles_per_second']:.0f} cycles/s overall")
+
+    if args.update:
+        for result in results:
+            if result.get("display_hash") is not None:
+                jobs[result["number"]].expected_hash = result["display_hash"]
+        save_manifest(args.source, jobs)
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"results": results, "summary": summary}, f, indent=2)
+
+    return 1 if summary["failed"] or summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,694 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from chip8 import DEFAULT_QUIRKS, INSTRUCTIONS_CHIP8, QUIRK_PROFILES, START_ADDRESS, Chip8, decode_entry
+from jit import BlockCache
+from scheduler import IDLE_LOOP, idle_state
+
+# Instructions each input may run before it is cut off
+DEFAULT_CYCLES = 1000
+# Instructions between timer ticks and key changes, every engine gets the same slices
+SLICE_CYCLES = 100
+# Keys toggled after each slice, in turn, so Fx0A and Ex9E/ExA1 see presses and releases
+KEY_SCHEDULE = (0x5, 0x0, 0xA, 0x5, 0xF, 0x0, 0x1, 0xA)
+DEFAULT_EXECUTIONS = 10000
+# Sizes of the generated inputs, in bytes
+SEED_ROM_SIZE = 64
+MAX_ROM_SIZE = 1024
+# Random inputs the corpus starts with when no seed roms are given
+SEED_INPUTS = 32
+# One input in this many, picked at random, is run again through the other
+# engines and compared, translating blocks for the JIT costs several times as
+# much as fuzzing an input so this keeps it a fixed share of the campaign
+DIFF_SAMPLE = 16
+# Inputs compared with a batch.BatchChip8 at a time
+BATCH_SIZE = 64
+# Executions between looking for inputs other workers added to the corpus
+SYNC_EXECUTIONS = 2000
+# Seconds between progress lines
+PROGRESS_INTERVAL = 10.0
+
+# Kinds of findings
+FINDING_EXCEPTION = "exception"
+FINDING_STATE = "state"
+FINDING_DIVERGENCE = "divergence"
+
+# Instructions the generator and mutator pick from, as (opcode, mask of the bits
+# filled in at random), covering every instruction set so the quirk profiles
+# that decode them get exercised too
+INSTRUCTION_PATTERNS = (
+    (0x00E0, 0x0000), (0x00EE, 0x0000), (0x1000, 0x0FFF), (0x2000, 0x0FFF),
+    (0x3000, 0x0FFF), (0x4000, 0x0FFF), (0x5000, 0x0FF0), (0x6000, 0x0FFF),
+    (0x7000, 0x0FFF), (0x8000, 0x0FF0), (0x8001, 0x0FF0), (0x8002, 0x0FF0),
+    (0x8003, 0x0FF0), (0x8004, 0x0FF0), (0x8005, 0x0FF0), (0x8006, 0x0FF0),
+    (0x8007, 0x0FF0), (0x800E, 0x0FF0), (0x9000, 0x0FF0), (0xA000, 0x0FFF),
+    (0xB000, 0x0FFF), (0xC000, 0x0FFF), (0xD000, 0x0FFF), (0xE09E, 0x0F00),
+    (0xE0A1, 0x0F00), (0xF007, 0x0F00), (0xF00A, 0x0F00), (0xF015, 0x0F00),
+    (0xF018, 0x0F00), (0xF01E, 0x0F00), (0xF029, 0x0F00), (0xF033, 0x0F00),
+    (0xF055, 0x0F00), (0xF065, 0x0F00),
+    # SUPER-CHIP
+    (0x00C0, 0x000F), (0x00FB, 0x0000), (0x00FC, 0x0000), (0x00FD, 0x0000),
+    (0x00FE, 0x0000), (0x00FF, 0x0000), (0xF030, 0x0F00), (0xF075, 0x0F00),
+    (0xF085, 0x0F00),
+    # XO-CHIP
+    (0x00D0, 0x000F), (0x5002, 0x0FF0), (0x5003, 0x0FF0), (0xF000, 0x0000),
+    (0xF001, 0x0F00), (0xF002, 0x0000), (0xF03A, 0x0F00),
+)
+# Patterns whose low 12 bits are an address, pointed into the input most of the time
+ADDRESS_PATTERNS = frozenset((0x1000, 0x2000, 0xA000, 0xB000))
+
+
+# Runs a machine a slice at a time through engine, ticking the timers and
+# toggling a key from KEY_SCHEDULE after every slice, until cycles instructions
+# ran, the machine halted or it is stuck jumping to itself (which nothing can
+# change, so stopping there leaves every engine in the same state)
+# engine is any callable that executes up to n instructions and returns how many ran
+def drive(chip8, engine, cycles):
+    done = 0
+    turn = 0
+    while done < cycles and not chip8.halted:
+        done += engine(min(SLICE_CYCLES, cycles - done))
+        if chip8.halted:
+            break
+        chip8.update_timers()
+        chip8.keypad[KEY_SCHEDULE[turn % len(KEY_SCHEDULE)]] ^= 1
+        turn += 1
+        idle = idle_state(chip8)
+        if idle is not None and idle[0] == IDLE_LOOP:
+            break
+    return done
+
+
+# Handlers that leave the machine exactly as it was when they jump to themselves
+WAIT_HANDLERS = frozenset((Chip8.OP_1NNN, Chip8.OP_Bnnn, Chip8.OP_Bxnn, Chip8.OP_Fx0A))
+
+
+# Stands in for every address outside the input in an edge, jumps into empty
+# memory or the fonts are all alike
+OUTSIDE = 0xFFFF
+
+
+# Runs a machine like Chip8.run while collecting the coverage that steers the
+# fuzzer: the jumps, skips, calls and returns taken, as (pc, next pc) edges, and
+# the opcodes run
+# Straight-line steps are not recorded, they follow from the edges around them
+# An instruction from WAIT_HANDLERS that jumps to itself ends the slice early:
+# nothing changes until drive ticks the timers or toggles a key, so like
+# scheduler.run_skipping_idle the rest of the passes are counted but not run
+# A run of 0000 words only moves the program counter on, so it is stepped over
+# in one go, most inputs end up there once they run past their last instruction
+class Tracer():
+    def __init__(self, chip8, end):
+        self.chip8 = chip8
+        # First address after the input
+        self.end = end
+        self.edges = set()
+        self.opcodes = set()
+        # Whether 0000 does nothing in the machine's profile
+        self.skip_zeros = decode_entry(chip8.decode_table, 0)[0] is Chip8.op_null
+
+    def run(self, cycles):
+        chip8 = self.chip8
+        if chip8.halted:
+            return 0
+        memory = chip8.memory
+        table = chip8.decode_table
+        end = self.end
+        add_edge = self.edges.add
+        add_opcode = self.opcodes.add
+        skip_zeros = self.skip_zeros
+        i = 0
+        while i < cycles:
+            pc = chip8.pc
+            opcode = (memory[pc] << 8) | memory[pc + 1]
+            chip8.opcode = opcode
+            chip8.pc = pc + 2
+            i += 1
+            add_opcode(opcode)
+            if opcode == 0 and skip_zeros:
+                # Only as far as this slice goes, XO-CHIP memory is 64 KB of mostly zeros
+                ahead = memory[pc:pc + 2 * (cycles - i + 1)]
+                steps = (len(ahead) - len(ahead.lstrip(b"\0"))) // 2
+                chip8.pc = pc + 2 * steps
+                i += steps - 1
+                continue
+            handler, operands = table[opcode]
+            handler(chip8, *operands)
+            next_pc = chip8.pc
+            if next_pc != pc + 2:
+                if next_pc == pc and handler in WAIT_HANDLERS:
+                    add_edge(pc << 16 | pc)
+                    return cycles
+                add_edge((pc if START_ADDRESS <= pc < end else OUTSIDE) << 16 |
+                         (next_pc if START_ADDRESS <= next_pc < end else OUTSIDE))
+            if chip8.halted:
+                return i
+        return cycles
+
+
+# Compiled JIT blocks shared by every input, mutants mostly run the blocks of
+# the input they came from, emptied once it holds JIT_CODE_CACHE_SIZE blocks
+JIT_CODE_CACHE_SIZE = 20000
+jit_code = {}
+
+
+def new_block_cache(chip8):
+    if len(jit_code) >= JIT_CODE_CACHE_SIZE:
+        jit_code.clear()
+    return BlockCache(chip8, code_cache=jit_code)
+
+
+# Engines compared with the traced run, built for a machine like the engines of
+# benchmarks/bench_suite.py
+ENGINES = {
+    "run": lambda chip8: chip8.run,
+    "jit": lambda chip8: new_block_cache(chip8).run,
+}
+# Engines whose state part way through an instruction that raised may differ,
+# only the exception itself is compared
+ENGINES_EXCEPTION_ONLY = frozenset(("jit",))
+
+
+def new_machine(rom, quirks):
+    chip8 = Chip8(seed=0, quirks=quirks)
+    chip8.load_fontset()
+    chip8.load_bytes(rom)
+    return chip8
+
+
+# The state engines are compared on, by name
+def machine_state(chip8):
+    return {
+        "pc": chip8.pc,
+        "index": chip8.index,
+        "registers": bytes(chip8.registers),
+        "stack": (bytes(chip8.stack), chip8.stack_pointer),
+        "timers": (chip8.delay_timer, chip8.sound_timer),
+        "memory": bytes(chip8.memory),
+        "display": (tuple(chip8.display), chip8.plane2 and tuple(chip8.plane2)),
+        "halted": chip8.halted,
+    }
+
+
+# Returns the names of the parts of the machine that hold values no machine
+# should ever reach, each one a finding
+def check_state(chip8):
+    problems = []
+    if not 0 <= chip8.index <= 0xFFFF:
+        problems.append("index")
+    if not 0 <= chip8.pc < len(chip8.memory) and not chip8.halted:
+        problems.append("pc")
+    if not 0 <= chip8.stack_pointer <= len(chip8.stack):
+        problems.append("stack_pointer")
+    if not (0 <= chip8.delay_timer <= 0xFF and 0 <= chip8.sound_timer <= 0xFF):
+        problems.append("timers")
+    for name, rows in (("display", chip8.display), ("plane2", chip8.plane2)):
+        if rows is not None and (len(rows) != chip8.height or any(row >> chip8.width for row in rows)):
+            problems.append(name)
+    return problems
+
+
+# Names the handler of the instruction that was running when an exception was
+# raised, "fetch" when the program counter itself ran off the end of memory
+def failing_handler(chip8):
+    if not 0 <= chip8.pc < len(chip8.memory) - 1:
+        return "fetch"
+    handler, _ = decode_entry(chip8.decode_table, chip8.opcode)
+    return handler.__name__
+
+
+# The outcome of running one input
+class Execution():
+    def __init__(self, chip8, tracer, cycles, error):
+        self.chip8 = chip8
+        self.edges = tracer.edges
+        # Names of the handlers run
+        table = chip8.decode_table
+        self.handlers = {decode_entry(table, opcode)[0].__name__ for opcode in tracer.opcodes}
+        self.cycles = cycles
+        self.error = error
+
+
+def execute(rom, quirks, cycles):
+    chip8 = new_machine(rom, quirks)
+    tracer = Tracer(chip8, START_ADDRESS + len(rom))
+    ran = 0
+    error = None
+    try:
+        ran = drive(chip8, tracer.run, cycles)
+    except Exception as exception:
+        error = exception
+    return Execution(chip8, tracer, ran, error)
+
+
+# Something wrong found by the fuzzer, kept once per key with the first and
+# smallest input that showed it
+class Finding():
+    def __init__(self, kind, key, rom, detail):
+        self.kind = kind
+        self.key = key
+        self.rom = rom
+        self.detail = detail
+        self.count = 1
+
+    def merge(self, other):
+        self.count += other.count
+        if len(other.rom) < len(self.rom):
+            self.rom = other.rom
+            self.detail = other.detail
+
+    def to_dict(self):
+        return {"kind": self.kind, "key": self.key, "detail": self.detail, "count": self.count,
+                "rom": self.rom.hex()}
+
+
+# Sends the interpreter's stack error messages, thousands of them while fuzzing,
+# nowhere
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+# Runs one input through the other engines and returns a finding for every
+# engine that ended up somewhere else than the traced run
+def compare_engines(rom, quirks, cycles, reference, engines):
+    findings = []
+    expected = machine_state(reference.chip8)
+    expected_error = type(reference.error).__name__ if reference.error is not None else None
+    for name in engines:
+        chip8 = new_machine(rom, quirks)
+        error = None
+        try:
+            drive(chip8, ENGINES[name](chip8), cycles)
+        except Exception as exception:
+            error = type(exception).__name__
+        if error != expected_error:
+            findings.append(Finding(FINDING_DIVERGENCE, f"{name}:exception", rom,
+                                    f"{name} raised {error}, the interpreter raised {expected_error}"))
+            continue
+        if error is not None and name in ENGINES_EXCEPTION_ONLY:
+            continue
+        actual = machine_state(chip8)
+        for field in expected:
+            if actual[field] != expected[field]:
+                findings.append(Finding(FINDING_DIVERGENCE, f"{name}:{field}", rom,
+                                        f"{name} ended with a different {field} after {cycles} instructions"))
+                break
+    return findings
+
+
+# Runs inputs through batch.BatchChip8 in groups of BATCH_SIZE, in the same
+# slices as drive, and compares every machine with its traced run
+# Only for the original instruction set with the default quirks, which is all a
+# batch runs, and only for inputs that never reached Cxkk since a batch draws
+# its random numbers from NumPy
+class BatchComparer():
+    def __init__(self, cycles):
+        # Imported here, NumPy is only needed when batches are compared
+        from batch import BatchChip8
+        self.batch_class = BatchChip8
+        self.cycles = cycles
+        self.pending = []
+
+    def add(self, rom, execution):
+        if "OP_Cxkk" in execution.handlers:
+            return []
+        self.pending.append((rom, execution))
+        if len(self.pending) < BATCH_SIZE:
+            return []
+        return self.flush()
+
+    def flush(self):
+        pending = self.pending
+        self.pending = []
+        if not pending:
+            return []
+        batch = self.batch_class(len(pending))
+        batch.load_fontset()
+        for machine, (rom, _) in enumerate(pending):
+            batch.load_bytes(rom, [machine])
+        # Machines stuck jumping to themselves are held like drive stops them
+        stuck = [False] * len(pending)
+        done = 0
+        turn = 0
+        while done < self.cycles and not batch.halted.all():
+            steps = min(SLICE_CYCLES, self.cycles - done)
+            batch.run(steps)
+            done += steps
+            # Like drive, a machine that halted gets no more timer ticks or keys
+            running = ~batch.halted
+            batch.delay_timer -= (batch.delay_timer > 0) & running
+            batch.sound_timer -= (batch.sound_timer > 0) & running
+            batch.keypad[running, KEY_SCHEDULE[turn % len(KEY_SCHEDULE)]] ^= 1
+            turn += 1
+            for machine in range(len(pending)):
+                if batch.halted[machine]:
+                    continue
+                pc = int(batch.pc[machine])
+                if pc + 1 < len(batch.memory[machine]):
+                    opcode = int(batch.memory[machine, pc]) << 8 | int(batch.memory[machine, pc + 1])
+                    if opcode == 0x1000 | pc:
+                        stuck[machine] = True
+                        batch.halted[machine] = True
+        findings = []
+        for machine, (rom, execution) in enumerate(pending):
+            faulted = bool(batch.faulted[machine])
+            # A batch faults where the interpreter raises an IndexError
+            if faulted != isinstance(execution.error, IndexError) or (execution.error is not None and not faulted):
+                findings.append(Finding(FINDING_DIVERGENCE, "batch:exception", rom,
+                                        f"batch faulted {faulted}, the interpreter raised "
+                                        f"{type(execution.error).__name__ if execution.error else None}"))
+                continue
+            if faulted:
+                continue
+            chip8 = batch.to_chip8(machine)
+            chip8.halted = chip8.halted and not stuck[machine]
+            expected = machine_state(execution.chip8)
+            actual = machine_state(chip8)
+            for field in expected:
+                if actual[field] != expected[field]:
+                    findings.append(Finding(FINDING_DIVERGENCE, f"batch:{field}", rom,
+                                            f"batch ended with a different {field}"))
+                    break
+        return findings
+
+
+# Returns an instruction picked from INSTRUCTION_PATTERNS, with addresses that
+# mostly point into an input of size bytes
+def random_instruction(rng, size):
+    opcode, mask = rng.choice(INSTRUCTION_PATTERNS)
+    if opcode in ADDRESS_PATTERNS and rng.random() < 0.8:
+        return opcode | ((START_ADDRESS + rng.randrange(max(2, size))) & ~1)
+    return opcode | (rng.getrandbits(16) & mask)
+
+
+def random_rom(rng, size=SEED_ROM_SIZE):
+    words = [random_instruction(rng, size) for _ in range(size // 2)]
+    return b"".join(word.to_bytes(2, "big") for word in words)
+
+
+# Grows a corpus of inputs that reach new edges, by mutating the inputs already
+# in it, and keeps a finding for every exception, bad state and divergence
+class Fuzzer():
+    def __init__(self, quirks=DEFAULT_QUIRKS, cycles=DEFAULT_CYCLES, seed=None, engines=("run", "jit"),
+                 batch=False, corpus_dir=None, diff_sample=DIFF_SAMPLE):
+        self.quirks = quirks
+        self.cycles = cycles
+        self.rng = random.Random(seed)
+        self.engines = tuple(engines)
+        self.diff_sample = diff_sample
+        self.batch = BatchComparer(cycles) if batch else None
+        self.corpus_dir = corpus_dir
+        self.corpus = []
+        self.known = set()
+        self.edges = set()
+        self.handlers = set()
+        self.findings = {}
+        self.executions = 0
+        self.instructions = 0
+        self.compared = 0
+
+    # Adds inputs to the corpus whether or not they reach anything new
+    def seed(self, roms):
+        for rom in roms:
+            self.run_input(rom, keep=True)
+
+    def load_corpus(self):
+        if self.corpus_dir is None:
+            return
+        for name in sorted(os.listdir(self.corpus_dir)):
+            if name.endswith(".ch8") and name not in self.known:
+                self.known.add(name)
+                with open(os.path.join(self.corpus_dir, name), "rb") as f:
+                    rom = f.read()
+                if len(rom) <= MAX_ROM_SIZE:
+                    self.run_input(rom)
+
+    def save_input(self, rom):
+        if self.corpus_dir is None:
+            return
+        name = f"{zlib.crc32(rom):08x}.ch8"
+        if name in self.known:
+            return
+        self.known.add(name)
+        with open(os.path.join(self.corpus_dir, name), "wb") as f:
+            f.write(rom)
+
+    def add_finding(self, finding):
+        key = (finding.kind, finding.key)
+        if key in self.findings:
+            self.findings[key].merge(finding)
+        else:
+            self.findings[key] = finding
+
+    # Runs one input, returns True if it reached an edge or a handler no input reached before
+    def run_input(self, rom, keep=False):
+        execution = execute(rom, self.quirks, self.cycles)
+        self.executions += 1
+        self.instructions += execution.cycles
+        new_edges = execution.edges - self.edges
+        new_handlers = execution.handlers - self.handlers
+        if new_edges:
+            self.edges |= new_edges
+        if new_handlers:
+            self.handlers |= new_handlers
+        new = bool(new_edges or new_handlers)
+        if new or keep:
+            self.corpus.append(rom)
+            self.save_input(rom)
+
+        chip8 = execution.chip8
+        if execution.error is not None:
+            error = execution.error
+            self.add_finding(Finding(FINDING_EXCEPTION, f"{failing_handler(chip8)}:{type(error).__name__}", rom,
+                                     f"{type(error).__name__}: {error} at pc {chip8.pc:#05x} opcode {chip8.opcode:#06x}"))
+        else:
+            for problem in check_state(chip8):
+                self.add_finding(Finding(FINDING_STATE, problem, rom,
+                                         f"{problem} out of range after {execution.cycles} instructions"))
+        if self.rng.randrange(self.diff_sample) == 0 and (self.engines or self.batch is not None):
+            self.compared += 1
+            for finding in compare_engines(rom, self.quirks, self.cycles, execution, self.engines):
+                self.add_finding(finding)
+            if self.batch is not None:
+                for finding in self.batch.add(rom, execution):
+                    self.add_finding(finding)
+        return new
+
+    # Returns a changed copy of an input from the corpus
+    def mutate(self, rom):
+        rng = self.rng
+        data = bytearray(rom)
+        for _ in range(1 + rng.randrange(4)):
+            choice = rng.randrange(8)
+            word = rng.randrange(max(1, len(data) // 2)) * 2
+            if choice == 0 and data:
+                # Flip a bit
+                data[rng.randrange(len(data))] ^= 1 << rng.randrange(8)
+            elif choice == 1 and data:
+                # Any byte at all
+                data[rng.randrange(len(data))] = rng.getrandbits(8)
+            elif choice in (2, 3):
+                # Swap in a new instruction
+                data[word:word + 2] = random_instruction(rng, len(data)).to_bytes(2, "big")
+            elif choice == 4 and len(data) + 2 <= MAX_ROM_SIZE:
+                data[word:word] = random_instruction(rng, len(data)).to_bytes(2, "big")
+            elif choice == 5 and len(data) > 2:
+                del data[word:word + 2]
+            elif choice == 6 and len(data) > 2:
+                # Repeat a run of instructions
+                end = min(len(data), word + 2 * (1 + rng.randrange(8)))
+                data[end:end] = data[word:end]
+            else:
+                # Splice in part of another input
+                other = rng.choice(self.corpus)
+                start = rng.randrange(max(1, len(other) // 2)) * 2
+                data[word:] = other[start:]
+        return bytes(data[:MAX_ROM_SIZE])
+
+    # Fuzzes until executions inputs ran or duration seconds passed
+    # report, if given, is called with the fuzzer every PROGRESS_INTERVAL seconds
+    def run(self, executions=None, duration=None, report=None):
+        start = time.perf_counter()
+        last_report = start
+        with quiet():
+            self.load_corpus()
+            if not self.corpus:
+                self.seed(random_rom(self.rng) for _ in range(SEED_INPUTS))
+            while executions is None or self.executions < executions:
+                self.run_input(self.mutate(self.rng.choice(self.corpus)))
+                if self.executions % SYNC_EXECUTIONS == 0:
+                    self.load_corpus()
+                now = time.perf_counter()
+                if duration is not None and now - start >= duration:
+                    break
+                if report is not None and now - last_report >= PROGRESS_INTERVAL:
+                    last_report = now
+                    with contextlib.redirect_stdout(sys.__stdout__):
+                        report(self, now - start)
+            if self.batch is not None:
+                for finding in self.batch.flush():
+                    self.add_finding(finding)
+        return time.perf_counter() - start
+
+    # Shrinks the input of each finding by dropping one instruction at a time,
+    # from the end, keeping every cut that still shows the same finding
+    # Batch divergences are left as found, checking one takes a whole batch
+    def minimize(self):
+        with quiet():
+            for finding in self.findings.values():
+                if finding.kind == FINDING_DIVERGENCE and finding.key.split(":")[0] not in ENGINES:
+                    continue
+                rom = finding.rom
+                position = len(rom) - 2
+                while position >= 0:
+                    candidate = rom[:position] + rom[position + 2:]
+                    if candidate and self.shows(candidate, finding):
+                        rom = candidate
+                    position -= 2
+                finding.rom = rom
+
+    def shows(self, rom, finding):
+        execution = execute(rom, self.quirks, self.cycles)
+        error = execution.error
+        if finding.kind == FINDING_EXCEPTION:
+            return error is not None and \
+                f"{failing_handler(execution.chip8)}:{type(error).__name__}" == finding.key
+        if finding.kind == FINDING_STATE:
+            return error is None and finding.key in check_state(execution.chip8)
+        engine = finding.key.split(":")[0]
+        return any(found.key == finding.key
+                   for found in compare_engines(rom, self.quirks, self.cycles, execution, [engine]))
+
+    def stats(self, elapsed):
+        return {
+            "executions": self.executions,
+            "instructions": self.instructions,
+            "compared": self.compared,
+            "corpus": len(self.corpus),
+            "edges": len(self.edges),
+            "handlers": len(self.handlers),
+            "findings": len(self.findings),
+            "elapsed": elapsed,
+            "executions_per_second": self.executions / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+def print_progress(fuzzer, elapsed, worker=0):
+    stats = fuzzer.stats(elapsed)
+    print(f"[{worker}] {stats['executions']} runs ({stats['executions_per_second']:.0f}/s), "
+          f"corpus {stats['corpus']}, {stats['edges']} edges, {stats['handlers']} handlers, "
+          f"{stats['findings']} findings", flush=True)
+
+
+# Runs one fuzzer, in a worker process when there are several
+def run_worker(worker, options):
+    fuzzer = Fuzzer(options["quirks"], options["cycles"], options["seed"] + worker, options["engines"],
+                    options["batch"], options["corpus"], options["diff_sample"])
+    for path in options["seeds"]:
+        with open(path, "rb") as f, quiet():
+            fuzzer.seed([f.read()[:MAX_ROM_SIZE]])
+    elapsed = fuzzer.run(options["executions"], options["duration"],
+                         lambda fuzzer, elapsed: print_progress(fuzzer, elapsed, worker))
+    fuzzer.minimize()
+    return fuzzer.stats(elapsed), fuzzer.handlers, list(fuzzer.findings.values())
+
+
+# Writes every finding's input as a rom and all of them to findings.json
+def save_findings(directory, findings):
+    os.makedirs(directory, exist_ok=True)
+    entries = []
+    for number, finding in enumerate(sorted(findings, key=lambda finding: (finding.kind, finding.key))):
+        entry = finding.to_dict()
+        entry["file"] = f"{number:03d}-{finding.kind}.ch8"
+        with open(os.path.join(directory, entry["file"]), "wb") as f:
+            f.write(finding.rom)
+        entries.append(entry)
+    with open(os.path.join(directory, "findings.json"), "w") as f:
+        json.dump(entries, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fuzz the interpreter with generated roms, guided by coverage")
+    parser.add_argument("seeds", nargs="*", help="roms the corpus starts from (random ones by default)")
+    parser.add_argument("-n", "--executions", type=int, default=None,
+                        help=f"inputs run by each worker (default {DEFAULT_EXECUTIONS} without --duration)")
+    parser.add_argument("-t", "--duration", type=float, default=None, help="seconds to fuzz for")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("-c", "--cycles", type=int, default=DEFAULT_CYCLES, help="instructions each input may run")
+    parser.add_argument("--quirks", default=DEFAULT_QUIRKS, choices=sorted(QUIRK_PROFILES))
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first worker's mutations")
+    parser.add_argument("--engines", default=",".join(ENGINES),
+                        help="engines compared with the interpreter, comma separated, empty for none")
+    parser.add_argument("--diff-sample", type=int, default=DIFF_SAMPLE,
+                        help="compare one input in this many with the other engines")
+    parser.add_argument("--batch", action="store_true",
+                        help="also compare with batch.BatchChip8 (needs NumPy, default quirks only)")
+    parser.add_argument("--corpus", metavar="DIR", help="directory the corpus is kept in and shared through")
+    parser.add_argument("-o", "--out", metavar="DIR", default="findings", help="where findings are written")
+    args = parser.parse_args(argv)
+
+    engines = [name for name in args.engines.split(",") if name]
+    for name in engines:
+        if name not in ENGINES:
+            parser.error(f"Unknown engine: {name}")
+    if args.batch and QUIRK_PROFILES[args.quirks].get("instructions", INSTRUCTIONS_CHIP8) != INSTRUCTIONS_CHIP8:
+        parser.error("--batch only runs the original instruction set")
+    if args.batch and args.quirks != DEFAULT_QUIRKS:
+        parser.error("--batch only runs the default quirks")
+    if args.diff_sample < 1:
+        parser.error("--diff-sample must be at least 1")
+    if args.corpus:
+        os.makedirs(args.corpus, exist_ok=True)
+    options = {
+        "quirks": args.quirks,
+        "cycles": args.cycles,
+        "seed": args.seed,
+        "engines": engines,
+        "batch": args.batch,
+        "corpus": args.corpus,
+        "diff_sample": args.diff_sample,
+        "seeds": args.seeds,
+        "executions": args.executions if args.executions or args.duration else DEFAULT_EXECUTIONS,
+        "duration": args.duration,
+    }
+
+    if args.workers == 1:
+        results = [run_worker(0, options)]
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            results = list(executor.map(run_worker, range(args.workers), [options] * args.workers))
+
+    handlers = set()
+    findings = {}
+    executions = 0
+    rate = 0.0
+    for stats, worker_handlers, worker_findings in results:
+        executions += stats["executions"]
+        rate += stats["executions_per_second"]
+        handlers |= worker_handlers
+        for finding in worker_findings:
+            key = (finding.kind, finding.key)
+            if key in findings:
+                findings[key].merge(finding)
+            else:
+                findings[key] = finding
+    save_findings(args.out, findings.values())
+
+    print(f"\n{executions} runs, {rate:.0f} runs/s over {len(results)} worker(s), {len(handlers)} handlers reached")
+    for finding in sorted(findings.values(), key=lambda finding: (finding.kind, finding.key)):
+        print(f"{finding.kind.upper():<12}{finding.key:<32}x{finding.count:<7}{finding.detail}")
+    print(f"{len(findings)} findings written to {args.out}")
+    return 1 if findings else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
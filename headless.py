@@ -0,0 +1,213 @@
+import argparse
+import hashlib
+import json
+import sys
+import time
+
+from capture import Capture
+from jit import BlockCache
+from chip8 import Chip8, DEFAULT_QUIRKS, DISPLAY_WIDTH, QUIRK_PROFILES, pack_rows
+from quirks import AUTO_QUIRKS, resolve_profile
+from scheduler import DEFAULT_CPU_HZ, frame_budget, run_skipping_idle
+
+# Minimum number of cycles between checks for idle loops and key waits
+HALT_CHECK_INTERVAL = 1024
+
+# Reasons a headless run can stop
+HALT_CYCLES = "cycles"
+HALT_ERROR = "error"
+HALT_EXIT = "exit"
+HALT_IDLE_LOOP = "idle_loop"
+HALT_KEY_WAIT = "key_wait"
+
+
+# SHA-1 of a packed framebuffer, used to compare runs against golden images
+# The second XO-CHIP bitplane is included when there is one
+def display_hash(display, width=DISPLAY_WIDTH, plane2=None):
+    digest = hashlib.sha1(pack_rows(display, width))
+    if plane2 is not None:
+        digest.update(pack_rows(plane2, width))
+    return digest.hexdigest()
+
+
+# Final machine state of a headless run
+class HeadlessResult():
+    def __init__(self, chip8, cycles, halt_reason, elapsed):
+        self.cycles = cycles
+        self.halt_reason = halt_reason
+        self.elapsed = elapsed
+        self.registers = list(chip8.registers)
+        self.memory = bytes(chip8.memory)
+        self.display = list(chip8.display)
+        self.plane2 = list(chip8.plane2) if chip8.plane2 is not None else None
+        self.width = chip8.width
+        self.index = chip8.index
+        self.pc = chip8.pc
+        self.stack = list(chip8.stack)
+        self.stack_pointer = chip8.stack_pointer
+        self.delay_timer = chip8.delay_timer
+        self.sound_timer = chip8.sound_timer
+
+    # Instructions executed per second of host time
+    def cycles_per_second(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return self.cycles / self.elapsed
+
+    # Renders the framebuffer as text, one line per display row
+    def display_text(self, on="#", off="."):
+        rows = []
+        for row in self.display:
+            bits = format(row, f"0{self.width}b")
+            rows.append(bits.replace("0", off).replace("1", on))
+        return "\n".join(rows)
+
+    def display_hash(self):
+        return display_hash(self.display, self.width, self.plane2)
+
+    def to_dict(self):
+        return {
+            "cycles": self.cycles,
+            "halt_reason": self.halt_reason,
+            "elapsed": self.elapsed,
+            "registers": self.registers,
+            "index": self.index,
+            "pc": self.pc,
+            "stack": self.stack,
+            "stack_pointer": self.stack_pointer,
+            "delay_timer": self.delay_timer,
+            "sound_timer": self.sound_timer,
+            "memory": self.memory.hex(),
+            "display": self.display_text(),
+            "display_hash": self.display_hash(),
+        }
+
+
+# Returns the halt reason if the machine can make no further progress on its own
+def check_halt(chip8):
+    pc = chip8.pc
+    opcode = (chip8.memory[pc] << 8) | chip8.memory[pc + 1]
+    # JP to itself, commonly used to end a program
+    if opcode == 0x1000 | pc:
+        return HALT_IDLE_LOOP
+    # LD Vx, K with nothing pressed, nobody is going to press a key
+    if (opcode & 0xF0FF) == 0xF00A and not any(chip8.keypad):
+        return HALT_KEY_WAIT
+    return None
+
+
+# Creates a machine with the fontset and rom loaded
+def create_machine(rom_path, seed=None, quirks=DEFAULT_QUIRKS):
+    chip8 = Chip8(seed, quirks)
+    chip8.load_fontset()
+    chip8.load_rom(rom_path)
+    return chip8
+
+
+# Runs a machine for up to max_cycles, stopping early on a halt condition
+# Timers tick once every frame of cpu_hz / 60 instructions, so runs are repeatable
+# engine is any callable with the same contract as Chip8.run, chip8.run by default
+# With idle_skip, frames spent polling the delay timer are skipped, with the same results
+# capture is a capture.Capture that is shown the display after every frame
+def run_machine(chip8, max_cycles, stop_on_halt=True, cpu_hz=DEFAULT_CPU_HZ, engine=None, idle_skip=False,
+                capture=None):
+    run = engine if engine is not None else chip8.run
+    budget = frame_budget(cpu_hz)
+    executed = 0
+    frame = 0
+    next_check = HALT_CHECK_INTERVAL
+    halt_reason = HALT_CYCLES
+    start = time.perf_counter()
+    while executed < max_cycles:
+        if idle_skip:
+            executed += run_skipping_idle(chip8, run, min(budget, max_cycles - executed))[0]
+        else:
+            executed += run(min(budget, max_cycles - executed))
+        if capture is not None:
+            capture.frame(frame, chip8)
+        frame += 1
+        chip8.update_timers()
+        if chip8.halted:
+            # 00FD is how SUPER-CHIP roms end, anything else halting is an error
+            halt_reason = HALT_EXIT if chip8.opcode == 0x00FD else HALT_ERROR
+            break
+        # Idle loops and key waits leave the machine unchanged, so checking for
+        # them every few frames only costs a few wasted cycles
+        if stop_on_halt and executed >= next_check:
+            next_check = executed + HALT_CHECK_INTERVAL
+            reason = check_halt(chip8)
+            if reason is not None:
+                halt_reason = reason
+                break
+    elapsed = time.perf_counter() - start
+    return HeadlessResult(chip8, executed, halt_reason, elapsed)
+
+
+# Loads a rom and runs it without any display or input
+# With use_jit, instructions run through translated blocks instead of Cycle
+# Runs with the same seed give the same random numbers
+def run_headless(rom_path, max_cycles=100000, stop_on_halt=True, cpu_hz=DEFAULT_CPU_HZ, use_jit=False,
+                 seed=None, idle_skip=False, quirks=DEFAULT_QUIRKS, capture=None):
+    chip8 = create_machine(rom_path, seed, quirks)
+    engine = None
+    if use_jit:
+        engine = BlockCache(chip8).run
+    return run_machine(chip8, max_cycles, stop_on_halt, cpu_hz, engine, idle_skip, capture)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a CHIP-8 rom without a display")
+    parser.add_argument("rom", help="path to the rom file")
+    parser.add_argument("-n", "--cycles", type=int, default=100000,
+                        help="maximum number of cycles to execute")
+    parser.add_argument("--hz", type=int, default=DEFAULT_CPU_HZ,
+                        help="instructions executed per second of emulated time")
+    parser.add_argument("--jit", action="store_true",
+                        help="run through the block translation cache")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for the random number generator (random by default)")
+    parser.add_argument("--quirks", default=DEFAULT_QUIRKS, choices=sorted(QUIRK_PROFILES) + [AUTO_QUIRKS],
+                        help="quirk profile, auto picks one for the rom")
+    parser.add_argument("--quirks-db", metavar="PATH",
+                        help="JSON file of {\"sha1\": \"profile\"} entries for --quirks auto")
+    parser.add_argument("--idle-skip", action="store_true",
+                        help="skip over delay timer polling loops instead of running them")
+    parser.add_argument("--no-halt", action="store_true",
+                        help="keep running through idle loops and key waits")
+    parser.add_argument("--json", action="store_true",
+                        help="print the final state as JSON")
+    parser.add_argument("--display", action="store_true",
+                        help="print the final framebuffer")
+    parser.add_argument("--capture", metavar="PATH",
+                        help="write every distinct frame to PATH, see capture.py")
+    args = parser.parse_args(argv)
+
+    quirks = resolve_profile(args.quirks, args.rom, args.quirks_db)
+    capture = Capture(args.capture) if args.capture else None
+    try:
+        result = run_headless(args.rom, args.cycles, not args.no_halt, args.hz, args.jit, args.seed,
+                              args.idle_skip, quirks, capture)
+    finally:
+        # A rom that crashes the interpreter still leaves a complete file
+        if capture is not None:
+            capture.close()
+
+    if args.json:
+        json.dump(result.to_dict(), sys.stdout)
+        sys.stdout.write("\n")
+        return 0
+
+    print(f"cycles: {result.cycles} ({result.halt_reason})")
+    print(f"time: {result.elapsed:.4f}s ({result.cycles_per_second():.0f} cycles/s)")
+    print(f"pc: {hex(result.pc)} index: {hex(result.index)} sp: {result.stack_pointer}")
+    print("registers: " + " ".join(f"V{i:X}={v:02X}" for i, v in enumerate(result.registers)))
+    if args.display:
+        print(result.display_text())
+    if capture is not None:
+        print(f"captured {capture.captured} of {capture.distinct_frames()} distinct frames to {args.capture}"
+              + (f", {capture.dropped} dropped" if capture.dropped else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
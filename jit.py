@@ -0,0 +1,388 @@
+from chip8 import Chip8, FONTSET_START_ADDRESS, decode_entry
+
+# Longest run of instructions translated into one block
+MAX_BLOCK_LENGTH = 64
+
+
+# Source for instructions that never change the program counter
+# Each template mirrors the matching OP_* handler statement for statement,
+# so translated blocks give exactly the same results as the interpreter
+STRAIGHT_TEMPLATES = {
+    Chip8.OP_00E0: lambda: ["c.OP_00E0()"],
+    Chip8.OP_6xkk: lambda x, kk: [f"R[{x}] = {kk}"],
+    Chip8.OP_7xkk: lambda x, kk: [f"R[{x}] = (R[{x}] + {kk}) & 0xFF"],
+    Chip8.OP_8xy0: lambda x, y: [f"R[{x}] = R[{y}]"],
+    Chip8.OP_8xy1: lambda x, y: [f"R[{x}] |= R[{y}]"],
+    Chip8.OP_8xy2: lambda x, y: [f"R[{x}] &= R[{y}]"],
+    Chip8.OP_8xy3: lambda x, y: [f"R[{x}] ^= R[{y}]"],
+    Chip8.OP_8xy4: lambda x, y: [
+        f"s = R[{x}] + R[{y}]",
+        "R[15] = 1 if s > 255 else 0",
+        f"R[{x}] = s & 0xFF",
+    ],
+    Chip8.OP_8xy5: lambda x, y: [
+        f"R[15] = 1 if R[{x}] > R[{y}] else 0",
+        f"R[{x}] = (R[{x}] - R[{y}]) & 0xFF",
+    ],
+    Chip8.OP_8xy6: lambda x, y: [
+        f"R[15] = R[{x}] & 0x1",
+        f"R[{x}] >>= 1",
+    ],
+    Chip8.OP_8xy7: lambda x, y: [
+        f"R[15] = 1 if R[{y}] > R[{x}] else 0",
+        f"R[{x}] = (R[{y}] - R[{x}]) & 0xFF",
+    ],
+    Chip8.OP_8xyE: lambda x, y: [
+        f"R[15] = (R[{x}] >> 7) & 0x1",
+        f"R[{x}] = (R[{x}] << 1) & 0xFF",
+    ],
+    Chip8.OP_Annn: lambda nnn: [f"c.index = {nnn}"],
+    Chip8.OP_Cxkk: lambda x, kk: [f"R[{x}] = c.random_Generator() & {kk}"],
+    Chip8.OP_Dxyn: lambda x, y, n: [f"c.OP_Dxyn({x}, {y}, {n})"],
+    Chip8.OP_Fx07: lambda x: [f"R[{x}] = c.delay_timer"],
+    Chip8.OP_Fx15: lambda x: [f"c.delay_timer = R[{x}]"],
+    Chip8.OP_Fx18: lambda x: [f"c.OP_Fx18({x})"],
+    Chip8.OP_Fx1E: lambda x: [f"c.index += R[{x}]"],
+    Chip8.OP_Fx29: lambda x: [f"c.index = {FONTSET_START_ADDRESS} + (R[{x}] * 5)"],
+    Chip8.OP_Fx65: lambda x: ["i = c.index"] + [f"R[{k}] = M[i + {k}]" for k in range(x + 1)],
+    Chip8.op_null: lambda *ops: [],
+    # Quirk profile variants
+    Chip8.OP_8xy6_vy: lambda x, y: [
+        f"v = R[{y}]",
+        f"R[{x}] = v >> 1",
+        "R[15] = v & 0x1",
+    ],
+    Chip8.OP_8xyE_vy: lambda x, y: [
+        f"v = R[{y}]",
+        f"R[{x}] = (v << 1) & 0xFF",
+        "R[15] = v >> 7",
+    ],
+    Chip8.OP_Dxyn_clip: lambda x, y, n: [f"c.OP_Dxyn_clip({x}, {y}, {n})"],
+    Chip8.OP_Fx65_increment: lambda x: (["i = c.index"] + [f"R[{k}] = M[i + {k}]" for k in range(x + 1)]
+                                        + [f"c.index = i + {x + 1}"]),
+    Chip8.OP_Fx65_increment_x: lambda x: (["i = c.index"] + [f"R[{k}] = M[i + {k}]" for k in range(x + 1)]
+                                          + [f"c.index = i + {x}"]),
+    # SUPER-CHIP and XO-CHIP instructions, through their handlers
+    Chip8.OP_00E0_planes: lambda: ["c.OP_00E0_planes()"],
+    Chip8.OP_00Cn: lambda n: [f"c.OP_00Cn({n})"],
+    Chip8.OP_00Dn: lambda n: [f"c.OP_00Dn({n})"],
+    Chip8.OP_00FB: lambda: ["c.OP_00FB()"],
+    Chip8.OP_00FC: lambda: ["c.OP_00FC()"],
+    Chip8.OP_00FE: lambda: ["c.OP_00FE()"],
+    Chip8.OP_00FF: lambda: ["c.OP_00FF()"],
+    Chip8.OP_Dxyn_hires: lambda x, y, n: [f"c.OP_Dxyn_hires({x}, {y}, {n})"],
+    Chip8.OP_Dxyn_hires_clip: lambda x, y, n: [f"c.OP_Dxyn_hires_clip({x}, {y}, {n})"],
+    Chip8.OP_Fx30: lambda x: [f"c.OP_Fx30({x})"],
+    Chip8.OP_Fx75: lambda x: [f"c.OP_Fx75({x})"],
+    Chip8.OP_Fx85: lambda x: [f"c.OP_Fx85({x})"],
+    Chip8.OP_5xy3: lambda x, y: [f"c.OP_5xy3({x}, {y})"],
+    Chip8.OP_Fn01: lambda x: [f"c.OP_Fn01({x})"],
+    Chip8.OP_F002: lambda: ["c.OP_F002()"],
+    Chip8.OP_Fx3A: lambda x: [f"c.OP_Fx3A({x})"],
+}
+
+# Conditions under which the skip instructions skip
+SKIP_CONDITIONS = {
+    Chip8.OP_3xkk: lambda x, kk: f"R[{x}] == {kk}",
+    Chip8.OP_4xkk: lambda x, kk: f"R[{x}] != {kk}",
+    Chip8.OP_5xy0: lambda x, y: f"R[{x}] == R[{y}]",
+    Chip8.OP_9xy0: lambda x, y: f"R[{x}] != R[{y}]",
+    Chip8.OP_Ex9E: lambda x: f"c.keypad[R[{x}]] == 1",
+    Chip8.OP_ExA1: lambda x: f"c.keypad[R[{x}]] == 0",
+}
+
+# Instructions that write memory, they end a block and invalidate any
+# translated code they overwrite
+MEMORY_WRITE_TEMPLATES = {
+    Chip8.OP_Fx33: lambda x: ([
+        "i = c.index",
+        f"v = R[{x}]",
+        "M[i] = v // 100",
+        "M[i + 1] = (v // 10) % 10",
+        "M[i + 2] = v % 10",
+    ], 3),
+    Chip8.OP_Fx55: lambda x: (
+        ["i = c.index"] + [f"M[i + {k}] = R[{k}]" for k in range(x + 1)], x + 1),
+    # Quirk profile variants, i still holds the start of the write for the invalidation
+    Chip8.OP_Fx55_increment: lambda x: (
+        ["i = c.index"] + [f"M[i + {k}] = R[{k}]" for k in range(x + 1)] + [f"c.index = i + {x + 1}"], x + 1),
+    Chip8.OP_Fx55_increment_x: lambda x: (
+        ["i = c.index"] + [f"M[i + {k}] = R[{k}]" for k in range(x + 1)] + [f"c.index = i + {x}"], x + 1),
+    Chip8.OP_5xy2: lambda x, y: (["i = c.index", f"c.OP_5xy2({x}, {y})"], abs(x - y) + 1),
+}
+
+
+# A translated run of instructions
+# fn(chip8, budget) runs it, looping while the budget allows if it jumps back
+# to its own start, and returns the number of instructions executed
+# The runner only calls it with budget >= max_length
+class Block():
+    def __init__(self, start, fn, max_length, addresses, source):
+        self.start = start
+        self.fn = fn
+        self.max_length = max_length
+        self.addresses = addresses
+        self.source = source
+
+
+# Translates straight-line runs of instructions into Python functions, caches
+# them by address and runs them in place of Chip8.Cycle
+# code_cache, if given, is a dict shared between caches that keeps compiled
+# blocks by source, so machines running the same code compile it only once
+class BlockCache():
+    def __init__(self, chip8, max_block_length=MAX_BLOCK_LENGTH, code_cache=None):
+        self.chip8 = chip8
+        self.max_block_length = max_block_length
+        self.code_cache = code_cache
+        # Full length blocks by start address
+        self.blocks = {}
+        # Blocks cut short to fit the end of a budget, by (start address, limit)
+        self.short_blocks = {}
+        # Cache keys of the blocks translated from each address
+        self.owners = {}
+        # Non-zero for every address some block was translated from
+        self.code_flags = bytearray(len(chip8.memory))
+        self.translations = 0
+        self.invalidations = 0
+
+    # Drops every translated block, needed after memory is changed from outside
+    # the translated code, for example by loading another rom
+    def flush(self):
+        self.blocks.clear()
+        self.short_blocks.clear()
+        self.owners.clear()
+        self.code_flags[:] = bytes(len(self.code_flags))
+
+    # Drops the blocks translated from any address in [start, start + length)
+    def invalidate(self, start, length):
+        flags = self.code_flags
+        for address in range(start, min(start + length, len(flags))):
+            if not flags[address]:
+                continue
+            flags[address] = 0
+            for key in self.owners.pop(address, ()):
+                if isinstance(key, tuple):
+                    block = self.short_blocks.pop(key, None)
+                else:
+                    block = self.blocks.pop(key, None)
+                if block is not None:
+                    self.invalidations += 1
+
+    # Translates full length blocks at the given addresses ahead of time, for
+    # example the block starts found by analyzer.analyze
+    def warm(self, starts):
+        for start in starts:
+            if start not in self.blocks:
+                block = self.translate(start, self.max_block_length)
+                if block is not None:
+                    self.register(start, block)
+
+    # Returns a block starting at pc no longer than limit, translating it if needed
+    def lookup(self, pc, limit):
+        block = self.blocks.get(pc)
+        if block is None:
+            block = self.translate(pc, self.max_block_length)
+            if block is None:
+                return None
+            self.register(pc, block)
+        if block.max_length <= limit:
+            return block
+
+        key = (pc, limit)
+        block = self.short_blocks.get(key)
+        if block is None:
+            block = self.translate(pc, limit)
+            if block is None:
+                return None
+            self.register(key, block)
+        return block
+
+    def register(self, key, block):
+        if isinstance(key, tuple):
+            self.short_blocks[key] = block
+        else:
+            self.blocks[key] = block
+        for address in block.addresses:
+            self.code_flags[address] = 1
+            self.owners.setdefault(address, []).append(key)
+
+    # Generates and compiles the block starting at start, at most limit instructions long
+    # Returns None if not even one instruction can be translated
+    def translate(self, start, limit):
+        chip8 = self.chip8
+        memory = chip8.memory
+        decode_table = chip8.decode_table
+        handlers = []
+
+        body = []
+        length = 0
+        pc = start
+        # Lines that end the block, run once per pass through it
+        tail = None
+        # Opcode of the last instruction when falling through
+        last_opcode = None
+        loop_jump = None
+        max_length = 0
+
+        while length < limit and pc + 1 < len(memory):
+            opcode = (memory[pc] << 8) | memory[pc + 1]
+            handler, ops = decode_entry(decode_table, opcode)
+            next_pc = pc + 2
+            length += 1
+
+            if handler in STRAIGHT_TEMPLATES:
+                body += STRAIGHT_TEMPLATES[handler](*ops)
+                last_opcode = opcode
+                pc = next_pc
+                continue
+
+            if handler in SKIP_CONDITIONS:
+                condition = SKIP_CONDITIONS[handler](*ops)
+                jump = self.read_jump(next_pc) if length < limit else None
+                if jump is not None:
+                    # A skip over a jump, the usual way of writing a conditional loop
+                    jump_opcode, target = jump
+                    tail = [
+                        f"if {condition}:",
+                        f"    c.opcode = {opcode}",
+                        f"    c.pc = {next_pc + 2}",
+                        f"    return n + {length}",
+                        f"c.opcode = {jump_opcode}",
+                    ]
+                    max_length = length + 1
+                    loop_jump = target
+                else:
+                    tail = [
+                        f"c.opcode = {opcode}",
+                        f"c.pc = {next_pc + 2} if {condition} else {next_pc}",
+                        f"return n + {length}",
+                    ]
+                    max_length = length
+                pc = next_pc + 2 if jump is not None else next_pc
+                break
+
+            if handler is Chip8.OP_1NNN:
+                tail = [f"c.opcode = {opcode}"]
+                max_length = length
+                loop_jump = ops[0]
+                pc = next_pc
+                break
+
+            if handler is Chip8.OP_Bnnn or handler is Chip8.OP_Bxnn:
+                register = ops[0] >> 8 if handler is Chip8.OP_Bxnn else 0
+                tail = [
+                    f"c.opcode = {opcode}",
+                    f"c.pc = {ops[0]} + R[{register}]",
+                    f"return n + {length}",
+                ]
+                max_length = length
+                pc = next_pc
+                break
+
+            if handler in MEMORY_WRITE_TEMPLATES:
+                lines, size = MEMORY_WRITE_TEMPLATES[handler](*ops)
+                tail = lines + [
+                    f"c.opcode = {opcode}",
+                    f"c.pc = {next_pc}",
+                    f"if any(F[i:i + {size}]):",
+                    f"    invalidate(i, {size})",
+                    f"return n + {length}",
+                ]
+                max_length = length
+                pc = next_pc
+                break
+
+            # Calls, returns, key waits and anything else run through the handler
+            handlers.append((handler, ops))
+            tail = [
+                f"c.opcode = {opcode}",
+                f"c.pc = {next_pc}",
+                f"H[{len(handlers) - 1}](c, *O[{len(handlers) - 1}])",
+                f"return n + {length}",
+            ]
+            max_length = length
+            pc = next_pc
+            break
+
+        if length == 0:
+            return None
+
+        if tail is None:
+            # Ran out of room, fall through to the next instruction
+            tail = [
+                f"c.opcode = {last_opcode}",
+                f"c.pc = {pc}",
+                f"return n + {length}",
+            ]
+            max_length = length
+
+        lines = ["def block(c, budget):", "    R = c.registers", "    M = c.memory", "    n = 0"]
+        if loop_jump is None:
+            lines += ["    " + line for line in body + tail]
+        elif loop_jump == start:
+            # The block jumps back to itself, keep looping while the budget allows
+            lines.append("    while True:")
+            lines += ["        " + line for line in body + tail]
+            lines += [
+                f"        n += {max_length}",
+                f"        if n + {max_length} > budget:",
+                f"            c.pc = {start}",
+                "            return n",
+            ]
+        else:
+            lines += ["    " + line for line in body + tail]
+            lines += [f"    c.pc = {loop_jump}", f"    return n + {max_length}"]
+
+        source = "\n".join(lines) + "\n"
+        # The code only names the handlers by position, so it can be shared
+        code_cache = self.code_cache
+        key = (start, source)
+        code = code_cache.get(key) if code_cache is not None else None
+        if code is None:
+            code = compile(source, f"<block {hex(start)}>", "exec")
+            if code_cache is not None:
+                code_cache[key] = code
+        namespace = {
+            "F": self.code_flags,
+            "invalidate": self.invalidate,
+            "H": [handler for handler, ops in handlers],
+            "O": [ops for handler, ops in handlers],
+        }
+        exec(code, namespace)
+        self.translations += 1
+        return Block(start, namespace["block"], max_length, range(start, pc), source)
+
+    # Returns (opcode, target) if the instruction at pc is a plain jump
+    def read_jump(self, pc):
+        memory = self.chip8.memory
+        if pc + 1 >= len(memory):
+            return None
+        opcode = (memory[pc] << 8) | memory[pc + 1]
+        handler, ops = decode_entry(self.chip8.decode_table, opcode)
+        if handler is Chip8.OP_1NNN:
+            return opcode, ops[0]
+        return None
+
+    # Runs up to the given number of cycles, same contract as Chip8.run
+    def run(self, cycles):
+        chip8 = self.chip8
+        if chip8.halted:
+            return 0
+        blocks = self.blocks
+        executed = 0
+        while executed < cycles:
+            remaining = cycles - executed
+            block = blocks.get(chip8.pc)
+            if block is None or block.max_length > remaining:
+                block = self.lookup(chip8.pc, remaining)
+                if block is None:
+                    # Nothing to translate here, let the interpreter deal with it
+                    chip8.Cycle()
+                    executed += 1
+                    if chip8.halted:
+                        break
+                    continue
+            executed += block.fn(chip8, remaining)
+            if chip8.halted:
+                break
+        return executed
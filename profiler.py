@@ -0,0 +1,207 @@
+import argparse
+import json
+import sys
+import time
+
+from chip8 import Chip8, DEFAULT_QUIRKS, QUIRK_PROFILES, decode_entry
+from headless import create_machine, run_machine
+from quirks import AUTO_QUIRKS, resolve_profile
+from scheduler import DEFAULT_CPU_HZ
+
+# Name of the outermost frame in folded stacks
+ROOT_FRAME = "main"
+
+
+# Counts where a rom spends its time
+# Profiler.run has the same contract as Chip8.run and is passed as the engine to
+# run_machine or a Scheduler, so machines that are not profiled run the plain
+# Chip8.run loop without any bookkeeping
+class Profiler():
+    def __init__(self, chip8, timing=True):
+        self.chip8 = chip8
+        # Host time per handler is measured with perf_counter_ns around every call
+        self.timing = timing
+        self.reset()
+
+    # Forgets everything counted so far
+    def reset(self):
+        # Executions and host nanoseconds by handler function
+        self.handler_counts = {}
+        self.handler_time = {}
+        # Executions of the instruction at each address
+        self.pc_counts = [0] * len(self.chip8.memory)
+        # Jumps to an address at or before the jumping instruction, by (source, target)
+        # Key waits (Fx0A) run again from the same address but are not loops
+        self.back_edges = {}
+        # Addresses of the subroutines currently being run, followed from changes
+        # of the stack pointer
+        self.call_stack = []
+        self.stack_key = ROOT_FRAME
+        # Host nanoseconds (or executions without timing) by (stack_key, handler)
+        self.stacks = {}
+        self.cycles = 0
+
+    # Runs up to the given number of cycles, recording every instruction
+    # The fetch and dispatch mirror Chip8.Cycle
+    def run(self, cycles):
+        chip8 = self.chip8
+        if chip8.halted:
+            return 0
+        memory = chip8.memory
+        decode_table = chip8.decode_table
+        handler_counts = self.handler_counts
+        handler_time = self.handler_time
+        pc_counts = self.pc_counts
+        back_edges = self.back_edges
+        stacks = self.stacks
+        clock = time.perf_counter_ns if self.timing else None
+
+        executed = 0
+        while executed < cycles:
+            pc = chip8.pc
+            opcode = (memory[pc] << 8) | memory[pc + 1]
+            chip8.opcode = opcode
+            chip8.pc = pc + 2
+            handler, operands = decode_entry(decode_table, opcode)
+            stack_pointer = chip8.stack_pointer
+
+            if clock is not None:
+                start = clock()
+                handler(chip8, *operands)
+                elapsed = clock() - start
+            else:
+                handler(chip8, *operands)
+                elapsed = 1
+            executed += 1
+
+            handler_counts[handler] = handler_counts.get(handler, 0) + 1
+            handler_time[handler] = handler_time.get(handler, 0) + elapsed
+            pc_counts[pc] += 1
+            key = (self.stack_key, handler)
+            stacks[key] = stacks.get(key, 0) + elapsed
+
+            new_pc = chip8.pc
+            if chip8.stack_pointer != stack_pointer:
+                if chip8.stack_pointer > stack_pointer:
+                    self.enter(new_pc)
+                else:
+                    self.leave()
+            elif new_pc <= pc and handler is not Chip8.OP_Fx0A:
+                edge = (pc, new_pc)
+                back_edges[edge] = back_edges.get(edge, 0) + 1
+
+            if chip8.halted:
+                break
+        self.cycles += executed
+        return executed
+
+    # Follows a call into the subroutine at address
+    def enter(self, address):
+        self.call_stack.append(address)
+        self.stack_key += f";sub_{address:03X}"
+
+    # Follows a return out of the current subroutine
+    def leave(self):
+        if self.call_stack:
+            self.call_stack.pop()
+            self.stack_key = ";".join([ROOT_FRAME] + [f"sub_{address:03X}" for address in self.call_stack])
+
+    # Handlers sorted by host time (or count without timing), as dicts
+    def handler_report(self):
+        report = []
+        for handler, count in self.handler_counts.items():
+            report.append({
+                "handler": handler.__name__,
+                "count": count,
+                "time_ns": self.handler_time[handler] if self.timing else None,
+                "share": count / self.cycles if self.cycles else 0.0,
+            })
+        report.sort(key=lambda entry: (entry["time_ns"] or 0, entry["count"]), reverse=True)
+        return report
+
+    # The most executed addresses as (address, count)
+    def hot_addresses(self, limit=20):
+        counts = [(address, count) for address, count in enumerate(self.pc_counts) if count]
+        counts.sort(key=lambda entry: entry[1], reverse=True)
+        return counts[:limit]
+
+    # Loops found from back edges, as dicts sorted by the number of iterations
+    def hot_loops(self, limit=20):
+        loops = [{"start": target, "end": source, "iterations": count}
+                 for (source, target), count in self.back_edges.items()]
+        loops.sort(key=lambda entry: entry["iterations"], reverse=True)
+        return loops[:limit]
+
+    def report(self, limit=20):
+        return {
+            "cycles": self.cycles,
+            "timing": self.timing,
+            "handlers": self.handler_report(),
+            "hot_addresses": [{"address": address, "count": count}
+                              for address, count in self.hot_addresses(limit)],
+            "hot_loops": self.hot_loops(limit),
+        }
+
+    # Lines in the folded format read by flamegraph.pl and speedscope,
+    # subroutines as frames with the handler as the leaf
+    def folded_stacks(self):
+        return [f"{stack};{handler.__name__} {weight}"
+                for (stack, handler), weight in sorted(self.stacks.items(), key=lambda item: item[0][0])]
+
+    def save_json(self, path, limit=20):
+        with open(path, "w") as f:
+            json.dump(self.report(limit), f, indent=2)
+            f.write("\n")
+
+    def save_folded(self, path):
+        with open(path, "w") as f:
+            f.write("\n".join(self.folded_stacks()) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile a CHIP-8 rom by opcode handler and address")
+    parser.add_argument("rom", help="path to the rom file")
+    parser.add_argument("-n", "--cycles", type=int, default=100000,
+                        help="maximum number of cycles to execute")
+    parser.add_argument("--hz", type=int, default=DEFAULT_CPU_HZ,
+                        help="instructions executed per second of emulated time")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for the random number generator (random by default)")
+    parser.add_argument("--quirks", default=DEFAULT_QUIRKS, choices=sorted(QUIRK_PROFILES) + [AUTO_QUIRKS],
+                        help="quirk profile, auto picks one for the rom")
+    parser.add_argument("--quirks-db", metavar="PATH",
+                        help="JSON file of {\"sha1\": \"profile\"} entries for --quirks auto")
+    parser.add_argument("--no-timing", action="store_true",
+                        help="only count executions, without measuring host time")
+    parser.add_argument("--top", type=int, default=10,
+                        help="number of addresses and loops to show")
+    parser.add_argument("--json", metavar="PATH", help="write the report as JSON")
+    parser.add_argument("--folded", metavar="PATH", help="write folded stacks for flame graphs")
+    args = parser.parse_args(argv)
+
+    quirks = resolve_profile(args.quirks, args.rom, args.quirks_db)
+    chip8 = create_machine(args.rom, args.seed, quirks)
+    profiler = Profiler(chip8, not args.no_timing)
+    result = run_machine(chip8, args.cycles, True, args.hz, profiler.run)
+
+    print(f"cycles: {result.cycles} ({result.halt_reason})")
+    print(f"\n{'handler':<10}{'count':>12}{'share':>8}{'time (ms)':>12}")
+    for entry in profiler.handler_report():
+        time_ms = f"{entry['time_ns'] / 1e6:.2f}" if entry["time_ns"] is not None else "-"
+        print(f"{entry['handler']:<10}{entry['count']:>12}{entry['share']:>8.1%}{time_ms:>12}")
+    print("\nhot addresses:")
+    for address, count in profiler.hot_addresses(args.top):
+        print(f"  {address:#05x}  {count}")
+    print("\nhot loops:")
+    for loop in profiler.hot_loops(args.top):
+        print(f"  {loop['start']:#05x}-{loop['end']:#05x}  {loop['iterations']} iterations")
+
+    if args.json:
+        profiler.save_json(args.json, args.top)
+    if args.folded:
+        profiler.save_folded(args.folded)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
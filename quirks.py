@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+
+from analyzer import analyze
+from chip8 import DEFAULT_QUIRKS, MEMORY_SIZE, QUIRK_PROFILES, START_ADDRESS
+from chip8.romcache import rom_cache
+
+# Pass as the quirks of a rom to pick the profile from the rom itself
+AUTO_QUIRKS = "auto"
+
+# Quirk profiles known to suit particular roms, by SHA-1 of the rom
+# Starts empty, fill it with load_database or by adding entries
+ROM_PROFILES = {}
+# Database resolve_profile reads when it is not given one, only if the file exists
+DEFAULT_DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "quirks.json")
+# Database files already added to ROM_PROFILES by resolve_profile
+loaded_databases = set()
+
+# Opcodes only SUPER-CHIP roms use: scrolling, exit, hires/lores, big font and flags
+SCHIP_OPCODES = (0x00FB, 0x00FC, 0x00FD, 0x00FE, 0x00FF)
+SCHIP_F_OPCODES = (0x30, 0x75, 0x85)
+# Opcodes only XO-CHIP roms use: long I loads, plane selection, audio and pitch
+XOCHIP_OPCODES = (0xF000, 0xF002)
+XOCHIP_F_OPCODES = (0x01, 0x3A)
+
+
+# Adds the entries of a JSON file of {"sha1": "profile"} to ROM_PROFILES
+def load_database(path):
+    with open(path) as f:
+        entries = json.load(f)
+    for rom_hash, profile in entries.items():
+        if profile not in QUIRK_PROFILES:
+            raise ValueError(f"Unknown quirk profile {profile} for {rom_hash}")
+        ROM_PROFILES[rom_hash.lower()] = profile
+
+
+# Guesses the profile from the instructions the rom can reach
+# XO-CHIP instructions mean an XO-CHIP rom, SUPER-CHIP instructions a SUPER-CHIP
+# rom, calls to machine code routines (0nnn) mean a rom written for the COSMAC VIP
+def guess_profile(rom):
+    rom = bytes(rom)
+    # Only XO-CHIP machines have the memory for it
+    if START_ADDRESS + len(rom) > MEMORY_SIZE:
+        return "xochip"
+    machine_calls = False
+    schip = False
+    for address in analyze(rom).code:
+        offset = address - START_ADDRESS
+        if offset < 0 or offset + 1 >= len(rom):
+            continue
+        opcode = (rom[offset] << 8) | rom[offset + 1]
+        if (opcode in XOCHIP_OPCODES or (opcode & 0xFFF0) == 0x00D0 or (opcode & 0xF00E) == 0x5002
+                or ((opcode & 0xF000) == 0xF000 and (opcode & 0xFF) in XOCHIP_F_OPCODES)):
+            return "xochip"
+        if (opcode in SCHIP_OPCODES or (opcode & 0xFFF0) == 0x00C0
+                or ((opcode & 0xF000) == 0xF000 and (opcode & 0xFF) in SCHIP_F_OPCODES)):
+            schip = True
+        elif (opcode & 0xF000) == 0 and opcode not in (0x0000, 0x00E0, 0x00EE):
+            machine_calls = True
+    if schip:
+        return "schip"
+    return "chip8" if machine_calls else DEFAULT_QUIRKS
+
+
+# The profile for a rom, from ROM_PROFILES if it is listed, otherwise guessed
+def detect_profile(rom):
+    profile = ROM_PROFILES.get(hashlib.sha1(bytes(rom)).hexdigest())
+    if profile is not None:
+        return profile
+    return guess_profile(rom)
+
+
+# Resolves a profile name given on a command line, AUTO_QUIRKS picks one for the rom
+# looking it up in the database file first, DEFAULT_DATABASE when none is given
+def resolve_profile(quirks, rom_path, database=None):
+    if quirks != AUTO_QUIRKS:
+        if quirks not in QUIRK_PROFILES:
+            raise ValueError(f"Unknown quirk profile: {quirks}")
+        return quirks
+    if database is None and os.path.exists(DEFAULT_DATABASE):
+        database = DEFAULT_DATABASE
+    if database is not None and database not in loaded_databases:
+        load_database(database)
+        loaded_databases.add(database)
+    return detect_profile(rom_cache.load(rom_path).data)
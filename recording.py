@@ -0,0 +1,259 @@
+import argparse
+import struct
+import sys
+import time
+import zlib
+
+from jit import BlockCache
+from chip8 import Chip8, DEFAULT_QUIRKS, DISPLAY_WIDTH, pack_rows
+from chip8.romcache import rom_cache
+from scheduler import DEFAULT_CPU_HZ
+
+LOG_MAGIC = b"C8IN"
+LOG_VERSION = 2
+# Magic, version, seed, cpu speed, total cycles, sha1 of the rom, quirk profile
+LOG_HEADER = struct.Struct(">4sBQIQ20s16s")
+
+# Kinds of event in a log
+# The keypad changed to a new 16 bit mask (bit k set when key k is down)
+EVENT_KEYS = 0
+# The timers ticked a number of times after the instructions before it
+EVENT_TICKS = 1
+# A frame was presented, with the CRC-32 of the framebuffer
+EVENT_FRAME = 2
+
+
+# Keypad as a 16 bit mask
+def keypad_mask(keypad):
+    mask = 0
+    for key, down in enumerate(keypad):
+        if down:
+            mask |= 1 << key
+    return mask
+
+
+# Sets the keypad from a 16 bit mask
+def set_keypad(keypad, mask):
+    for key in range(len(keypad)):
+        keypad[key] = (mask >> key) & 1
+
+
+# CRC-32 of a packed framebuffer, cheap enough to take on every frame
+# The second XO-CHIP bitplane is included when there is one
+def frame_crc(display, width=DISPLAY_WIDTH, plane2=None):
+    crc = zlib.crc32(pack_rows(display, width))
+    if plane2 is not None:
+        crc = zlib.crc32(pack_rows(plane2, width), crc)
+    return crc
+
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+# Everything needed to reproduce a session: the rom, the random seed, the speed,
+# the quirk profile and a list of (cycle, kind, value) events ordered by the
+# cycle they happened at
+class InputLog():
+    def __init__(self, seed, cpu_hz=DEFAULT_CPU_HZ, rom_hash=bytes(20), events=None, cycles=0,
+                 quirks=DEFAULT_QUIRKS):
+        self.seed = seed
+        self.quirks = quirks
+        self.cpu_hz = cpu_hz
+        self.rom_hash = rom_hash
+        self.events = events if events is not None else []
+        # Total number of instructions run in the session, the last event can be earlier
+        self.cycles = cycles
+
+    def frames(self):
+        return sum(1 for cycle, kind, value in self.events if kind == EVENT_FRAME)
+
+    # Serializes the log as a header followed by compressed events
+    # Each event is a kind byte and the cycle distance from the previous event
+    # as a varint, followed by the key mask, tick count or frame CRC
+    def to_bytes(self):
+        body = bytearray()
+        last = 0
+        for cycle, kind, value in self.events:
+            body.append(kind)
+            write_varint(body, cycle - last)
+            last = cycle
+            if kind == EVENT_KEYS:
+                body += value.to_bytes(2, "big")
+            elif kind == EVENT_TICKS:
+                write_varint(body, value)
+            else:
+                body += value.to_bytes(4, "big")
+        header = LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, self.seed, self.cpu_hz, self.cycles, self.rom_hash,
+                                 self.quirks.encode())
+        return header + zlib.compress(bytes(body), 9)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < LOG_HEADER.size:
+            raise ValueError("Input log is too short")
+        magic, version, seed, cpu_hz, cycles, rom_hash, quirks = LOG_HEADER.unpack_from(data)
+        if magic != LOG_MAGIC:
+            raise ValueError("Not an input log")
+        if version != LOG_VERSION:
+            raise ValueError(f"Unsupported input log version: {version}")
+        body = zlib.decompress(data[LOG_HEADER.size:])
+        events = []
+        cycle = 0
+        offset = 0
+        while offset < len(body):
+            kind = body[offset]
+            delta, offset = read_varint(body, offset + 1)
+            cycle += delta
+            if kind == EVENT_KEYS:
+                value = int.from_bytes(body[offset:offset + 2], "big")
+                offset += 2
+            elif kind == EVENT_TICKS:
+                value, offset = read_varint(body, offset)
+            elif kind == EVENT_FRAME:
+                value = int.from_bytes(body[offset:offset + 4], "big")
+                offset += 4
+            else:
+                raise ValueError(f"Unknown event kind {kind} in input log")
+            events.append((cycle, kind, value))
+        return cls(seed, cpu_hz, rom_hash, events, cycles, quirks.rstrip(b"\0").decode())
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+
+# SHA-1 of a rom file, stored in logs so they are not replayed against another rom
+def rom_hash(rom_path):
+    return rom_cache.load(rom_path).digest
+
+
+# Collects events from a Scheduler, pass it as the recorder argument
+class InputRecorder():
+    def __init__(self, seed, cpu_hz=DEFAULT_CPU_HZ, rom_path=None, quirks=DEFAULT_QUIRKS):
+        self.log = InputLog(seed, cpu_hz, rom_hash(rom_path) if rom_path else bytes(20), quirks=quirks)
+        self.events = self.log.events
+        self.last_keys = 0
+
+    # Called before every frame, only changes of the keypad are stored
+    def keys(self, cycle, keypad):
+        mask = keypad_mask(keypad)
+        if mask != self.last_keys:
+            self.last_keys = mask
+            self.events.append((cycle, EVENT_KEYS, mask))
+
+    # Called after the timers ticked ticks times at the end of a frame
+    def ticks(self, cycle, ticks):
+        self.log.cycles = cycle
+        if ticks:
+            self.events.append((cycle, EVENT_TICKS, ticks))
+
+    # Called for every frame that changed the display
+    def frame(self, cycle, chip8):
+        self.events.append((cycle, EVENT_FRAME, frame_crc(chip8.display, chip8.width, chip8.plane2)))
+
+    def save(self, path):
+        self.log.save(path)
+
+
+# Outcome of replaying a log
+class ReplayResult():
+    def __init__(self, chip8, cycles, frames, mismatch, elapsed):
+        self.chip8 = chip8
+        self.cycles = cycles
+        self.frames = frames
+        # (frame number, cycle) of the first frame that did not match the log, or None
+        self.mismatch = mismatch
+        self.elapsed = elapsed
+
+    def matched(self):
+        return self.mismatch is None
+
+    def cycles_per_second(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return self.cycles / self.elapsed
+
+
+# Runs the rom at full speed, feeding it the recorded keys and timer ticks at
+# the cycles they happened at, and compares every frame with the recorded one
+# With stop_on_mismatch the replay ends at the first frame that differs
+def replay(log, rom_path, use_jit=False, stop_on_mismatch=True):
+    if log.rom_hash != bytes(20) and rom_hash(rom_path) != log.rom_hash:
+        raise ValueError(f"{rom_path} is not the rom this log was recorded with")
+    chip8 = Chip8(log.seed, log.quirks)
+    chip8.load_fontset()
+    chip8.load_rom(rom_path)
+    run = BlockCache(chip8).run if use_jit else chip8.run
+
+    executed = 0
+    frames = 0
+    mismatch = None
+    start = time.perf_counter()
+    # A final event-less stretch runs up to the end of the session
+    for cycle, kind, value in log.events + [(log.cycles, None, None)]:
+        while executed < cycle and not chip8.halted:
+            executed += run(cycle - executed)
+        if executed < cycle:
+            # The machine stopped early, which the recording never did
+            mismatch = (frames, executed)
+            break
+        if kind == EVENT_KEYS:
+            set_keypad(chip8.keypad, value)
+        elif kind == EVENT_TICKS:
+            for _ in range(value):
+                chip8.update_timers()
+        elif kind == EVENT_FRAME:
+            if frame_crc(chip8.display, chip8.width, chip8.plane2) != value and mismatch is None:
+                mismatch = (frames, cycle)
+                if stop_on_mismatch:
+                    break
+            frames += 1
+    elapsed = time.perf_counter() - start
+    return ReplayResult(chip8, executed, frames, mismatch, elapsed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded CHIP-8 session at full speed")
+    parser.add_argument("log", help="input log written by main.py --record")
+    parser.add_argument("rom", help="path to the rom the log was recorded with")
+    parser.add_argument("--jit", action="store_true",
+                        help="run through the block translation cache")
+    args = parser.parse_args(argv)
+
+    log = InputLog.load(args.log)
+    result = replay(log, args.rom, args.jit)
+
+    recorded = log.cycles / log.cpu_hz
+    print(f"cycles: {result.cycles} frames: {result.frames} (recorded {recorded:.1f}s of play)")
+    print(f"time: {result.elapsed:.4f}s ({result.cycles_per_second():.0f} cycles/s)")
+    if not result.matched():
+        frame, cycle = result.mismatch
+        print(f"MISMATCH at frame {frame}, cycle {cycle}")
+        return 1
+    print("all frames match")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import zlib
+
+# Frames kept by default, one minute at 60 frames per second
+DEFAULT_CAPACITY = 3600
+# Every this many frames a full save state is kept, the frames in between are
+# stored as compressed differences from it
+DEFAULT_KEYFRAME_INTERVAL = 60
+
+
+# XORs two equal length byte strings
+def xor_bytes(a, b):
+    return (int.from_bytes(a, "big") ^ int.from_bytes(b, "big")).to_bytes(len(a), "big")
+
+
+# In-memory ring buffer of the last few thousand save states
+# Frames are numbered from 0 as they are pushed, only the last capacity frames are kept
+class RewindBuffer():
+    def __init__(self, capacity=DEFAULT_CAPACITY, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        if capacity <= 0 or keyframe_interval <= 0:
+            raise ValueError("capacity and keyframe_interval must be positive")
+        self.capacity = capacity
+        self.keyframe_interval = keyframe_interval
+        # (keyframe state, compressed XOR delta or None) for each slot
+        self.entries = [None] * capacity
+        self.frames = 0
+        # Number of the oldest frame still in the buffer
+        self.first = 0
+        self.keyframe = None
+
+    def __len__(self):
+        return self.frames - self.first
+
+    # Number of the oldest frame still in the buffer
+    def oldest(self):
+        return self.first
+
+    # Number of the newest frame, -1 if nothing was pushed yet
+    def newest(self):
+        return self.frames - 1
+
+    # Stores the current state of chip8 as the next frame, returns its number
+    def push(self, chip8):
+        return self.push_state(chip8.save_state())
+
+    def push_state(self, state):
+        frame = self.frames
+        if self.keyframe is None or frame % self.keyframe_interval == 0:
+            self.keyframe = state
+            entry = (state, None)
+        else:
+            entry = (self.keyframe, zlib.compress(xor_bytes(state, self.keyframe), 1))
+        # Old keyframes stay alive as long as a delta in the buffer refers to them
+        self.entries[frame % self.capacity] = entry
+        self.frames += 1
+        if self.frames - self.first > self.capacity:
+            self.first = self.frames - self.capacity
+        return frame
+
+    # Returns the save state of a frame
+    def get_state(self, frame):
+        if not self.oldest() <= frame < self.frames:
+            raise IndexError(f"Frame {frame} is no longer in the buffer")
+        keyframe, delta = self.entries[frame % self.capacity]
+        if delta is None:
+            return keyframe
+        return xor_bytes(zlib.decompress(delta), keyframe)
+
+    # Restores chip8 to a frame, later frames are dropped so pushing continues from there
+    def seek(self, chip8, frame):
+        chip8.load_state(self.get_state(frame))
+        self.truncate(frame + 1)
+
+    # Restores chip8 to the state steps frames before the newest one
+    def rewind(self, chip8, steps=1):
+        frame = max(self.newest() - steps, self.oldest())
+        self.seek(chip8, frame)
+        return frame
+
+    # Forgets every frame from frame onwards
+    def truncate(self, frame):
+        frame = max(frame, self.first)
+        for number in range(frame, self.frames):
+            self.entries[number % self.capacity] = None
+        self.frames = frame
+        # The next push has to start from a keyframe again
+        self.keyframe = None
+
+    # Bytes used by the stored states
+    def memory_usage(self):
+        keyframes = {}
+        total = 0
+        for entry in self.entries:
+            if entry is None:
+                continue
+            keyframe, delta = entry
+            keyframes[id(keyframe)] = len(keyframe)
+            if delta is not None:
+                total += len(delta)
+        return total + sum(keyframes.values())
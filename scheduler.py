@@ -0,0 +1,404 @@
+import collections
+import time
+
+# The 60 Hz timer clock belongs to the machine, imported here so callers can
+# keep taking it from the scheduler
+from chip8 import FRAME_TIME, TIMER_HZ
+
+# Instructions per second when no speed is given
+DEFAULT_CPU_HZ = 600
+
+# Where the 60 Hz timer ticks come from
+# Virtual time ticks the timers once per frame no matter how long the frame took,
+# wall time ticks them by the real time that has passed
+VIRTUAL_CLOCK = "virtual"
+WALL_CLOCK = "wall"
+
+# Upper bound on timer ticks caught up in one frame after a long stall
+MAX_CATCH_UP_TICKS = 4
+
+# Busy waits that can be skipped, nothing changes until a key is pressed or the
+# timers tick
+# LD Vx, K with nothing pressed
+IDLE_KEY_WAIT = "key_wait"
+# LD Vx, DT / SE Vx, 0 / JP back, polling the delay timer
+IDLE_TIMER_WAIT = "timer_wait"
+# JP to itself
+IDLE_LOOP = "idle_loop"
+# Slices of a frame's instruction budget with input read before each one, when
+# the scheduler is given a way to read input
+DEFAULT_INPUT_SLICES = 4
+# Budgets shorter than this many passes through a wait just run it, checking
+# for a fixed point would cost about as much as it saves
+IDLE_MIN_PASSES = 8
+
+
+# Number of instructions run in each 60 Hz frame at the given speed
+def frame_budget(cpu_hz):
+    if cpu_hz <= 0:
+        raise ValueError("cpu_hz must be positive")
+    return max(1, round(cpu_hz / TIMER_HZ))
+
+
+# Returns (kind, loop length) if the machine is sitting in a busy wait, otherwise None
+def idle_state(chip8):
+    memory = chip8.memory
+    pc = chip8.pc
+    if pc + 1 >= len(memory):
+        return None
+    opcode = (memory[pc] << 8) | memory[pc + 1]
+    if opcode == 0x1000 | pc:
+        return IDLE_LOOP, 1
+    if (opcode & 0xF0FF) == 0xF00A:
+        if not any(chip8.keypad):
+            return IDLE_KEY_WAIT, 1
+        return None
+    if not chip8.delay_timer:
+        return None
+    # The delay loop may have been entered at any of its three instructions
+    for start in (pc, pc - 2, pc - 4):
+        if start < 0 or start + 5 >= len(memory):
+            continue
+        load = (memory[start] << 8) | memory[start + 1]
+        if (load & 0xF0FF) != 0xF007:
+            continue
+        x = (load >> 8) & 0xF
+        skip = (memory[start + 2] << 8) | memory[start + 3]
+        jump = (memory[start + 4] << 8) | memory[start + 5]
+        if skip == (0x3000 | (x << 8)) and jump == (0x1000 | start):
+            return IDLE_TIMER_WAIT, 3
+    return None
+
+
+# Runs budget instructions through engine, skipping over busy waits
+# A wait is only skipped once a pass through it has left the registers and
+# program counter unchanged, every further pass would do the same until the
+# timers tick, so the machine ends up in exactly the same state as if all the
+# instructions had run
+# The first pass picks up the timer value that ticked since the last frame
+# addresses, if given, are the only places to look for waits, as found ahead of
+# time by analyzer.analyze
+# Returns (instructions counted, kind of wait skipped or None)
+def run_skipping_idle(chip8, engine, budget, addresses=None):
+    if addresses is not None and chip8.pc not in addresses:
+        return engine(budget), None
+    idle = idle_state(chip8)
+    if idle is None:
+        return engine(budget), None
+    kind, length = idle
+    if budget < IDLE_MIN_PASSES * length:
+        return engine(budget), None
+    executed = engine(length)
+    pc = chip8.pc
+    registers = bytes(chip8.registers)
+    executed += engine(length)
+    if executed < 2 * length or chip8.pc != pc or chip8.registers != registers:
+        # Something changed, for example a key was pressed, run the rest normally
+        return executed + engine(budget - executed), None
+    remaining = budget - executed
+    # Whole passes are skipped, the leftover instructions really run so the
+    # program counter ends where it would have
+    skipped = remaining - remaining % length
+    return executed + skipped + engine(remaining - skipped), kind
+
+
+# Timing of a single frame
+class FrameStats():
+    def __init__(self, frame, instructions, timer_ticks, exec_time, render_time, presented, idle=None):
+        self.frame = frame
+        self.instructions = instructions
+        self.timer_ticks = timer_ticks
+        self.exec_time = exec_time
+        self.render_time = render_time
+        self.presented = presented
+        # Kind of busy wait skipped in this frame, or None
+        # With input slices a key wait runs a slice at a time instead, so a key
+        # pressed mid-frame is seen, and a frame that ends in one reports IDLE_KEY_WAIT
+        self.idle = idle
+
+    def to_dict(self):
+        return {
+            "frame": self.frame,
+            "instructions": self.instructions,
+            "timer_ticks": self.timer_ticks,
+            "exec_time": self.exec_time,
+            "render_time": self.render_time,
+            "presented": self.presented,
+            "idle": self.idle,
+        }
+
+
+# Time from a key press to the first frame that changed the display after it
+# The scheduler calls key for every poll that pressed a key and frame for every
+# presented frame that changed the display, all presses waiting are answered by
+# that frame
+# A press is timestamped when it was read (seen), and by the poll before that
+# (since), the earliest it could have happened, so the latencies are a best and
+# worst case of what the player saw
+class InputLatency():
+    def __init__(self, history=1000):
+        self.pending = []
+        # (from seen, from since) in seconds
+        self.latencies = collections.deque(maxlen=history)
+        self.presses = 0
+
+    def key(self, since, seen):
+        self.presses += 1
+        self.pending.append((since, seen))
+
+    def frame(self, now):
+        if not self.pending:
+            return
+        for since, seen in self.pending:
+            self.latencies.append((now - seen, now - since))
+        self.pending.clear()
+
+    # Percentiles in milliseconds, from the press being read and from the poll before
+    def stats(self):
+        result = {"presses": self.presses, "answered": len(self.latencies)}
+        if not self.latencies:
+            return result
+        for index, name in enumerate(("seen", "worst")):
+            values = sorted(latency[index] for latency in self.latencies)
+            last = len(values) - 1
+            result[name] = {
+                "mean_ms": 1000 * sum(values) / len(values),
+                "p50_ms": 1000 * values[last // 2],
+                "p95_ms": 1000 * values[min(last, len(values) * 95 // 100)],
+                "p99_ms": 1000 * values[min(last, len(values) * 99 // 100)],
+                "max_ms": 1000 * values[last],
+            }
+        return result
+
+
+# Drives a Chip8 with separate CPU, timer and render clocks
+# Each frame runs a fixed instruction budget, ticks the timers at 60 Hz and
+# only calls present when the display changed
+# With idle_skip, frames spent in a busy wait are skipped instead of executed,
+# with the same results, idle_addresses limits where waits are looked for
+# Given input (a frontend's poll), the budget is split into input_slices slices
+# spread over the frame, input is read before each one and a slice that draws
+# in answer to a key press is presented straight away, instead of at the end
+# of the frame; once input returns False the frame is finished and stopped is set
+class Scheduler():
+    def __init__(self, chip8, cpu_hz=DEFAULT_CPU_HZ, present=None,
+                 timer_clock=VIRTUAL_CLOCK, throttle=True, engine=None, recorder=None,
+                 idle_skip=False, idle_addresses=None, input=None,
+                 input_slices=DEFAULT_INPUT_SLICES, latency=None):
+        if timer_clock not in (VIRTUAL_CLOCK, WALL_CLOCK):
+            raise ValueError(f"Unknown timer clock: {timer_clock}")
+        self.chip8 = chip8
+        self.present = present
+        self.timer_clock = timer_clock
+        self.throttle = throttle
+        # Any callable that executes up to n instructions and returns how many ran
+        self.engine = engine if engine is not None else chip8.run
+        # Optional recording.InputRecorder that logs keys, timer ticks and frames
+        self.recorder = recorder
+        self.idle_skip = idle_skip
+        self.idle_addresses = frozenset(idle_addresses) if idle_addresses is not None else None
+        if input_slices < 1:
+            raise ValueError("input_slices must be at least 1")
+        self.input = input
+        self.input_slices = input_slices if input is not None else 1
+        # Optional InputLatency
+        self.latency = latency
+        self.stopped = False
+        # Set when a key was pressed in the current frame and not shown yet
+        self._answering = False
+        self.set_speed(cpu_hz)
+
+        self.frame = 0
+        self.instructions = 0
+        self.exec_time = 0.0
+        self.render_time = 0.0
+        self.presented_frames = 0
+        self.idle_frames = 0
+        self.last_stats = None
+
+        now = time.perf_counter()
+        self._next_tick = now + FRAME_TIME
+        self._next_frame = now + FRAME_TIME
+        self._last_poll = now
+
+    # Sets the CPU speed in instructions per second
+    def set_speed(self, cpu_hz):
+        self.instructions_per_frame = frame_budget(cpu_hz)
+        self.cpu_hz = cpu_hz
+
+    # Number of timer ticks due since the last frame
+    def _due_ticks(self, now):
+        if self.timer_clock == VIRTUAL_CLOCK:
+            return 1
+        ticks = 0
+        while now >= self._next_tick:
+            self._next_tick += FRAME_TIME
+            ticks += 1
+        if ticks > MAX_CATCH_UP_TICKS:
+            # Drop the backlog instead of fast-forwarding the timers
+            self._next_tick = now + FRAME_TIME
+            ticks = MAX_CATCH_UP_TICKS
+        return ticks
+
+    # Runs up to count instructions, skipping over busy waits when asked to
+    def _execute(self, count):
+        if self.idle_skip:
+            return run_skipping_idle(self.chip8, self.engine, count, self.idle_addresses)
+        return self.engine(count), None
+
+    # Reads input, returns False once the frontend wants to stop
+    def _poll(self):
+        chip8 = self.chip8
+        keypad = chip8.keypad
+        before = bytes(keypad)
+        running = self.input(chip8)
+        now = time.perf_counter()
+        if keypad != before:
+            # Only presses are timed, a game has nothing to show for a release
+            if any(key and not was for key, was in zip(keypad, before)):
+                self._answering = True
+                if self.latency is not None:
+                    self.latency.key(self._last_poll, now)
+        self._last_poll = now
+        if not running:
+            self.stopped = True
+        return running
+
+    # Sleeps until slice index of slices in the current frame is due, returns
+    # the time slept
+    def _wait_slice(self, index, slices):
+        due = self._next_frame - FRAME_TIME * (slices - index) / slices
+        delay = due - time.perf_counter()
+        if delay <= 0:
+            return 0.0
+        time.sleep(delay)
+        return delay
+
+    # Shows the display if it changed, returns whether present was called
+    def _show(self, cycle):
+        chip8 = self.chip8
+        if not chip8.draw_flag:
+            return False
+        chip8.draw_flag = False
+        self._answering = False
+        if self.recorder is not None:
+            self.recorder.frame(cycle, chip8)
+        if self.latency is not None:
+            self.latency.frame(time.perf_counter())
+        if self.present is None:
+            return False
+        self.present(chip8)
+        return True
+
+    # Runs one frame, returns its FrameStats
+    def run_frame(self, budget=None):
+        chip8 = self.chip8
+        if budget is None:
+            budget = self.instructions_per_frame
+
+        recorder = self.recorder
+        slices = self.input_slices
+        if slices > 1 and self.idle_skip:
+            waiting = idle_state(chip8)
+            if waiting is not None and waiting[0] != IDLE_KEY_WAIT:
+                # Input makes no difference to a loop or a timer wait, run it as
+                # one slice so it can be skipped
+                slices = 1
+
+        start = time.perf_counter()
+        # Time spent sleeping between slices and presenting within the frame
+        waited = 0.0
+        shown = 0.0
+        executed = 0
+        idle = None
+        presented = False
+        for index in range(slices):
+            if self.input is not None:
+                if index and self.throttle:
+                    waited += self._wait_slice(index, slices)
+                if not self._poll():
+                    break
+            if recorder is not None:
+                recorder.keys(self.instructions + executed, chip8.keypad)
+            count = budget * (index + 1) // slices - budget * index // slices
+            ran, idle = self._execute(count)
+            executed += ran
+            if chip8.halted:
+                break
+            if self._answering and index < slices - 1:
+                # Show the answer to a key press without waiting for the frame to end
+                show_start = time.perf_counter()
+                presented = self._show(self.instructions + executed) or presented
+                shown += time.perf_counter() - show_start
+        if slices > 1 and idle is None and self.idle_skip:
+            waiting = idle_state(chip8)
+            if waiting is not None and waiting[0] == IDLE_KEY_WAIT:
+                idle = IDLE_KEY_WAIT
+        executed_at = time.perf_counter()
+
+        ticks = self._due_ticks(executed_at)
+        for _ in range(ticks):
+            chip8.update_timers()
+        if recorder is not None:
+            recorder.ticks(self.instructions + executed, ticks)
+
+        presented = self._show(self.instructions + executed) or presented
+        end = time.perf_counter()
+
+        exec_time = executed_at - start - waited - shown
+        render_time = end - executed_at + shown
+        self.frame += 1
+        self.instructions += executed
+        self.exec_time += exec_time
+        self.render_time += render_time
+        if presented:
+            self.presented_frames += 1
+        if idle is not None:
+            self.idle_frames += 1
+        self.last_stats = FrameStats(self.frame, executed, ticks, exec_time, render_time, presented, idle)
+        return self.last_stats
+
+    # Sleeps until the next frame is due when throttled
+    def sync(self):
+        if not self.throttle:
+            return
+        now = time.perf_counter()
+        delay = self._next_frame - now
+        if delay > 0:
+            time.sleep(delay)
+            self._next_frame += FRAME_TIME
+        else:
+            # Running behind, start counting again from now
+            self._next_frame = now + FRAME_TIME
+
+    # Restarts the clocks from now, after the caller slept for a while (for
+    # example waiting for input) so the timers do not try to catch up
+    def resume(self):
+        now = time.perf_counter()
+        self._next_tick = now + FRAME_TIME
+        self._next_frame = now + FRAME_TIME
+        # Whatever woke the caller up happened just now
+        self._last_poll = now
+
+    # Runs frames until the machine halts or the frame limit is reached
+    def run(self, frames=None):
+        count = 0
+        while not self.chip8.halted and not self.stopped and (frames is None or count < frames):
+            self.run_frame()
+            self.sync()
+            count += 1
+        return count
+
+    # Totals over all frames run so far
+    def summary(self):
+        frames = self.frame or 1
+        return {
+            "frames": self.frame,
+            "instructions": self.instructions,
+            "presented_frames": self.presented_frames,
+            "idle_frames": self.idle_frames,
+            "exec_time": self.exec_time,
+            "render_time": self.render_time,
+            "avg_exec_time": self.exec_time / frames,
+            "avg_render_time": self.render_time / frames,
+        }
@@ -0,0 +1,371 @@
+import argparse
+import asyncio
+import hashlib
+import struct
+import sys
+import time
+
+from analyzer import load_analysis
+from jit import BlockCache
+from chip8 import Chip8, DISPLAY_HEIGHT, DISPLAY_WIDTH, MEMORY_SIZE, START_ADDRESS, STATE_SIZE
+from recording import set_keypad
+from scheduler import DEFAULT_CPU_HZ, FRAME_TIME, Scheduler
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8808
+DEFAULT_MAX_SESSIONS = 256
+# Share of one core a session may use on average, 0.02 lets 50 full speed
+# sessions share a core
+DEFAULT_CPU_SHARE = 0.02
+# Host time a session may save up while it is cheap, in frames
+MAX_CPU_CREDIT_FRAMES = 10
+# Fastest speed a client may ask for, 1000 instructions a frame
+# The credit is only checked before a frame, so this bounds how long one frame
+# can hold up the other sessions
+MAX_CPU_HZ = 60000
+# Bytes waiting to be sent to a client before its frames are dropped
+DEFAULT_MAX_OUTPUT_BUFFER = 64 * 1024
+# Translated blocks a JIT session may keep before its cache is flushed
+DEFAULT_MAX_BLOCKS = 2048
+# Sessions run between chances for the event loop to serve sockets
+SESSIONS_PER_YIELD = 32
+# Rom analyses kept in memory before the oldest are dropped, roms come from
+# clients so they are never written to the disk cache
+DEFAULT_MAX_ANALYSES = 64
+
+# Every message is a type byte and a payload length, followed by the payload
+MESSAGE_HEADER = struct.Struct(">BH")
+
+# Client to server
+# Starts the session: cpu speed, seed, flags, then the rom bytes
+MSG_OPEN = 0x01
+OPEN_HEADER = struct.Struct(">IQB")
+OPEN_JIT = 0x01
+OPEN_SEED = 0x02
+# New keypad state as a 16 bit mask
+MSG_KEYS = 0x02
+KEYS_PAYLOAD = struct.Struct(">H")
+MSG_CLOSE = 0x03
+
+# Server to client
+# The session was created, with its id
+MSG_OPENED = 0x81
+OPENED_PAYLOAD = struct.Struct(">I")
+# Frame number and a mask of the rows that changed, followed by the packed
+# contents of each changed row from the top
+MSG_FRAME = 0x82
+FRAME_HEADER = struct.Struct(">II")
+# Utf-8 description of what went wrong, the connection is closed after it
+MSG_ERROR = 0x83
+
+ROW_BYTES = DISPLAY_WIDTH // 8
+ALL_ROWS = (1 << DISPLAY_HEIGHT) - 1
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_message(kind, payload=b""):
+    return MESSAGE_HEADER.pack(kind, len(payload)) + payload
+
+
+# Reads one message, raises asyncio.IncompleteReadError when the peer hangs up
+async def read_message(reader):
+    kind, length = MESSAGE_HEADER.unpack(await reader.readexactly(MESSAGE_HEADER.size))
+    payload = await reader.readexactly(length) if length else b""
+    return kind, payload
+
+
+def encode_open(rom, cpu_hz=DEFAULT_CPU_HZ, seed=None, use_jit=False):
+    flags = (OPEN_JIT if use_jit else 0) | (OPEN_SEED if seed is not None else 0)
+    return encode_message(MSG_OPEN, OPEN_HEADER.pack(cpu_hz, seed or 0, flags) + bytes(rom))
+
+
+def encode_keys(mask):
+    return encode_message(MSG_KEYS, KEYS_PAYLOAD.pack(mask))
+
+
+# Packs the rows of display selected by rows into a frame message
+def encode_frame(frame, display, rows):
+    parts = [FRAME_HEADER.pack(frame, rows)]
+    for y in range(DISPLAY_HEIGHT):
+        if rows >> y & 1:
+            parts.append(display[y].to_bytes(ROW_BYTES, "big"))
+    return encode_message(MSG_FRAME, b"".join(parts))
+
+
+# Applies a frame message payload to a client side copy of the display,
+# returns the frame number
+def apply_frame(display, payload):
+    frame, rows = FRAME_HEADER.unpack_from(payload)
+    offset = FRAME_HEADER.size
+    for y in range(DISPLAY_HEIGHT):
+        if rows >> y & 1:
+            display[y] = int.from_bytes(payload[offset:offset + ROW_BYTES], "big")
+            offset += ROW_BYTES
+    return frame
+
+
+# One machine and the client it belongs to
+# analysis is the analyzer.RomAnalysis of rom
+class Session():
+    def __init__(self, number, writer, rom, analysis, cpu_hz=DEFAULT_CPU_HZ, seed=None, use_jit=False,
+                 max_output_buffer=DEFAULT_MAX_OUTPUT_BUFFER, max_blocks=DEFAULT_MAX_BLOCKS):
+        self.number = number
+        self.writer = writer
+        self.chip8 = Chip8(seed)
+        self.chip8.load_fontset()
+        self.chip8.load_bytes(rom)
+        self.cache = None
+        if use_jit:
+            self.cache = BlockCache(self.chip8)
+            self.cache.warm(analysis.block_starts())
+        self.scheduler = Scheduler(self.chip8, cpu_hz, self.present, throttle=False,
+                                   engine=self.cache.run if self.cache else None, idle_skip=True,
+                                   idle_addresses=analysis.idle_addresses)
+        self.max_output_buffer = max_output_buffer
+        self.max_blocks = max_blocks
+        # Set while the client is owed a full frame, at the start and after dropped frames
+        self.resync = True
+        self.cpu_credit = 0.0
+        self.cpu_time = 0.0
+        self.throttled_frames = 0
+        self.dropped_frames = 0
+        self.bytes_sent = 0
+
+    # Scheduler callback, sends the rows that changed since the last frame sent
+    def present(self, chip8):
+        rows = ALL_ROWS if self.resync else chip8.dirty_rows
+        transport = self.writer.transport
+        if transport.is_closing():
+            return
+        if transport.get_write_buffer_size() > self.max_output_buffer:
+            # The client is not keeping up, keep the rows for a full frame later
+            self.dropped_frames += 1
+            self.resync = True
+            return
+        chip8.dirty_rows = 0
+        self.resync = False
+        message = encode_frame(self.scheduler.frame, chip8.display, rows)
+        self.writer.write(message)
+        self.bytes_sent += len(message)
+
+    # Runs one frame if the session has host time left, share is the part of
+    # one core it is allowed
+    def run_frame(self, share):
+        budget = share * FRAME_TIME
+        self.cpu_credit = min(self.cpu_credit + budget, budget * MAX_CPU_CREDIT_FRAMES)
+        if self.cpu_credit < 0:
+            # Over its share, the session runs slower than real time until it pays it back
+            self.throttled_frames += 1
+            return
+        start = time.perf_counter()
+        self.scheduler.run_frame()
+        cost = time.perf_counter() - start
+        self.cpu_time += cost
+        self.cpu_credit -= cost
+        if self.resync:
+            # Frames were dropped (or none was sent yet), catch the client up
+            # without waiting for the rom to draw again
+            self.present(self.chip8)
+        cache = self.cache
+        if cache is not None and len(cache.blocks) + len(cache.short_blocks) > self.max_blocks:
+            cache.flush()
+
+    # Approximate bytes held by the session: machine state, translated code and
+    # frames waiting to be sent
+    def memory_usage(self):
+        total = STATE_SIZE
+        if self.cache is not None:
+            for block in list(self.cache.blocks.values()) + list(self.cache.short_blocks.values()):
+                total += len(block.source)
+        return total + self.writer.transport.get_write_buffer_size()
+
+    def stats(self):
+        return {
+            "session": self.number,
+            "frames": self.scheduler.frame,
+            "instructions": self.scheduler.instructions,
+            "cpu_time": self.cpu_time,
+            "throttled_frames": self.throttled_frames,
+            "dropped_frames": self.dropped_frames,
+            "bytes_sent": self.bytes_sent,
+            "memory": self.memory_usage(),
+        }
+
+
+# Hosts many sessions in one process, every connection gets its own machine
+# All sessions advance one frame together 60 times a second
+class SessionServer():
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS, cpu_share=DEFAULT_CPU_SHARE,
+                 max_output_buffer=DEFAULT_MAX_OUTPUT_BUFFER, max_blocks=DEFAULT_MAX_BLOCKS,
+                 max_analyses=DEFAULT_MAX_ANALYSES):
+        self.max_sessions = max_sessions
+        self.cpu_share = cpu_share
+        self.max_output_buffer = max_output_buffer
+        self.max_blocks = max_blocks
+        self.max_analyses = max_analyses
+        # RomAnalyses by SHA-1 of the rom, oldest first
+        self.analyses = {}
+        self.sessions = {}
+        self.next_number = 1
+        self.frames = 0
+        # Ticks that started after the next one was already due
+        self.late_frames = 0
+        self.busy_time = 0.0
+
+    async def handle_client(self, reader, writer):
+        session = None
+        try:
+            while True:
+                kind, payload = await read_message(reader)
+                if kind == MSG_OPEN:
+                    if session is not None:
+                        raise ProtocolError("Session already open")
+                    session = await self.open_session(writer, payload)
+                    writer.write(encode_message(MSG_OPENED, OPENED_PAYLOAD.pack(session.number)))
+                elif kind == MSG_KEYS:
+                    if session is None or len(payload) != KEYS_PAYLOAD.size:
+                        raise ProtocolError("Keys sent before opening a session")
+                    set_keypad(session.chip8.keypad, KEYS_PAYLOAD.unpack(payload)[0])
+                elif kind == MSG_CLOSE:
+                    break
+                else:
+                    raise ProtocolError(f"Unknown message type {kind}")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except (ProtocolError, ValueError) as e:
+            writer.write(encode_message(MSG_ERROR, str(e).encode()))
+        finally:
+            if session is not None:
+                self.sessions.pop(session.number, None)
+            writer.close()
+
+    async def open_session(self, writer, payload):
+        if len(self.sessions) >= self.max_sessions:
+            raise ProtocolError("Server is full")
+        if len(payload) < OPEN_HEADER.size:
+            raise ProtocolError("Open message is too short")
+        cpu_hz, seed, flags = OPEN_HEADER.unpack_from(payload)
+        if not 0 < cpu_hz <= MAX_CPU_HZ:
+            raise ProtocolError(f"cpu_hz must be between 1 and {MAX_CPU_HZ}")
+        rom = payload[OPEN_HEADER.size:]
+        if START_ADDRESS + len(rom) > MEMORY_SIZE:
+            raise ProtocolError(f"ROM is too large: {len(rom)} bytes")
+        analysis = await self.analyze(rom)
+        # Other clients may have filled the server while the rom was analyzed
+        if len(self.sessions) >= self.max_sessions:
+            raise ProtocolError("Server is full")
+        session = Session(
+            self.next_number, writer, rom, analysis, cpu_hz,
+            seed if flags & OPEN_SEED else None, bool(flags & OPEN_JIT),
+            self.max_output_buffer, self.max_blocks,
+        )
+        self.sessions[session.number] = session
+        self.next_number += 1
+        return session
+
+    # Returns the analysis of rom, sessions often share roms so it is only
+    # worked out once, in a worker thread so the frames keep running
+    async def analyze(self, rom):
+        digest = hashlib.sha1(rom).digest()
+        analysis = self.analyses.get(digest)
+        if analysis is None:
+            loop = asyncio.get_running_loop()
+            analysis = await loop.run_in_executor(None, load_analysis, rom, None)
+            self.analyses[digest] = analysis
+            while len(self.analyses) > self.max_analyses:
+                del self.analyses[next(iter(self.analyses))]
+        return analysis
+
+    # Ends a session whose rom crashed the interpreter, the others keep running
+    def fail_session(self, session, error):
+        self.sessions.pop(session.number, None)
+        session.writer.write(encode_message(MSG_ERROR, f"{type(error).__name__}: {error}".encode()))
+        session.writer.close()
+
+    # Advances every session by one frame, letting the sockets be served in between
+    async def run_sessions(self):
+        for count, session in enumerate(list(self.sessions.values()), 1):
+            if session.number in self.sessions:
+                try:
+                    session.run_frame(self.cpu_share)
+                except Exception as e:
+                    self.fail_session(session, e)
+            if count % SESSIONS_PER_YIELD == 0:
+                await asyncio.sleep(0)
+
+    async def run_frames(self):
+        loop = asyncio.get_running_loop()
+        next_frame = loop.time()
+        while True:
+            start = loop.time()
+            await self.run_sessions()
+            self.frames += 1
+            self.busy_time += loop.time() - start
+            next_frame += FRAME_TIME
+            delay = next_frame - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                # Could not keep up, drop the missed ticks instead of bunching them up
+                self.late_frames += 1
+                next_frame = loop.time()
+                await asyncio.sleep(0)
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "frames": self.frames,
+            "late_frames": self.late_frames,
+            "load": self.busy_time / (self.frames * FRAME_TIME) if self.frames else 0.0,
+            "memory": sum(session.memory_usage() for session in self.sessions.values()),
+        }
+
+    # Listens on a Unix socket if path is given, otherwise on host:port
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle_client, path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            await self.run_frames()
+
+
+async def report_stats(server, interval):
+    while True:
+        await asyncio.sleep(interval)
+        stats = server.stats()
+        print(f"{stats['sessions']} sessions, {stats['late_frames']} late frames, "
+              f"load {stats['load']:.0%}, {stats['memory'] / 1024:.0f} KiB", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host many CHIP-8 sessions over TCP or a Unix socket")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--max-sessions", type=int, default=DEFAULT_MAX_SESSIONS)
+    parser.add_argument("--cpu-share", type=float, default=DEFAULT_CPU_SHARE,
+                        help="share of one core each session may use")
+    parser.add_argument("--stats", type=float, default=0,
+                        help="print server statistics every this many seconds")
+    args = parser.parse_args(argv)
+
+    server = SessionServer(args.max_sessions, args.cpu_share)
+
+    async def run():
+        if args.stats > 0:
+            asyncio.ensure_future(report_stats(server, args.stats))
+        await server.serve(args.host, args.port, args.unix)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())